@@ -0,0 +1,266 @@
+#!/usr/bin/python2
+"""Times the pynwm functions that read National Water Model files.
+
+Synthetic channel files are generated with the same variables and attributes
+as HydroShare's georeferenced files (see
+data/analysis_assim.channel_brazos_basin.nc), at a configurable number of
+stations and time steps, as .nc or gzipped .nc.gz files. Station IDs are
+shuffled so COMID lookups do the same work as on real files.
+
+Each benchmark runs in a separate process so its peak memory can be measured
+on its own. Results are printed and appended as JSON lines to an output file
+so runs can be compared.
+
+Usage (from the repository root):
+    PYTHONPATH=src python benchmarks/benchmark_nwm.py \\
+        --stations 10000 100000 --times 1 24 --formats nc gz \\
+        --output bench_results.jsonl
+"""
+
+import argparse
+from datetime import datetime, timedelta
+import gzip
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+
+import netCDF4
+from netCDF4 import Dataset
+import numpy as np
+
+from pynwm import comid_index
+from pynwm import ncfiles
+from pynwm import nwm
+
+_init_time = datetime(2016, 6, 21, 0)
+_flow_vars = [('streamflow', 'meter^3 / sec', 'River Flow'),
+              ('nudge', 'meter^3 / sec', 'Amount of stream flow alteration'),
+              ('q_lateral', 'meter^3 / sec', 'Runoff into channel reach'),
+              ('velocity', 'meter/sec', 'River Velocity')]
+
+
+def make_channel_file(filename, station_ids, valid_time, seed=0):
+    """Writes a synthetic georeferenced channel file for one time step."""
+
+    rs = np.random.RandomState(seed)
+    num_stations = len(station_ids)
+    with Dataset(filename, 'w') as nc:
+        nc.featureType = 'timeSeries'
+        nc.model_initialization_time = _init_time.strftime('%Y-%m-%d_%H:%M:%S')
+        nc.model_output_valid_time = valid_time.strftime('%Y-%m-%d_%H:%M:%S')
+        nc.station_dimension = 'station'
+        nc.createDimension('station', num_stations)
+        nc.createDimension('time', 1)
+
+        time_var = nc.createVariable('time', 'i', ('time',))
+        time_var.units = 'seconds since {0} UTC'.format(
+            _init_time.strftime('%Y-%m-%d %H:%M'))
+        time_var.long_name = 'valid output time'
+        time_var.standard_name = 'time'
+        time_var[:] = int((valid_time - _init_time).total_seconds())
+
+        for name, units, long_name in _flow_vars:
+            var = nc.createVariable(name, 'f4', ('station',), fill_value=1.0)
+            var.units = units
+            var.coordinates = 'latitude longitude'
+            var.long_name = long_name
+            var[:] = rs.lognormal(0, 2, num_stations).astype(np.float32)
+
+        id_var = nc.createVariable('station_id', 'i', ('station',))
+        id_var.long_name = 'Station id'
+        id_var[:] = station_ids
+
+        lat_var = nc.createVariable('latitude', 'f4', ('station',))
+        lat_var.units = 'degrees_north'
+        lat_var.long_name = 'Station latitude'
+        lat_var[:] = rs.uniform(25, 50, num_stations)
+        lon_var = nc.createVariable('longitude', 'f4', ('station',))
+        lon_var.units = 'degrees_east'
+        lon_var.long_name = 'Station longitude'
+        lon_var[:] = rs.uniform(-125, -67, num_stations)
+
+
+def make_channel_files(folder, num_stations, num_times, compressed):
+    """Writes a synthetic short range forecast of num_times files.
+
+    Returns:
+        Tuple of list of filenames and the station_id array.
+    """
+
+    rs = np.random.RandomState(num_stations)
+    station_ids = rs.permutation(
+        np.arange(1, num_stations * 4, 4, dtype=np.int32))
+    nc_files = []
+    for i in range(num_times):
+        valid_time = _init_time + timedelta(hours=i + 1)
+        filename = os.path.join(
+            folder, 'nwm.t00z.short_range.channel_rt.f{0:03d}.conus.nc'.format(
+                i + 1))
+        make_channel_file(filename, station_ids, valid_time, seed=i)
+        if compressed:
+            with open(filename, 'rb') as f, \
+                    gzip.open(filename + '.gz', 'wb') as z:
+                shutil.copyfileobj(f, z)
+            os.remove(filename)
+            filename += '.gz'
+        nc_files.append(filename)
+    return nc_files, station_ids
+
+
+def _bench_read_q_for_comids(nc_files, comids, workdir, workers):
+    for nc_file in nc_files:
+        with ncfiles.unzipped(nc_file) as path:
+            nwm.read_q_for_comids(path, comids)
+
+
+def _bench_subset_channel_file(nc_files, comids, workdir, workers):
+    for i, nc_file in enumerate(nc_files):
+        out_file = os.path.join(workdir, 'subset_{0}.nc'.format(i))
+        with ncfiles.unzipped(nc_file) as path:
+            nwm.subset_channel_file(path, out_file, comids)
+        os.remove(out_file)
+
+
+def _bench_build_streamflow_cube(nc_files, comids, workdir, workers):
+    nwm.build_streamflow_cube(nc_files, comids, workers=workers)
+
+
+def _bench_combine_files(nc_files, comids, workdir, workers):
+    out_file = os.path.join(workdir, 'combined.nc')
+    nwm.combine_files(nc_files, out_file, comids, workers=workers)
+    os.remove(out_file)
+
+
+_benchmarks = [('read_q_for_comids', _bench_read_q_for_comids),
+               ('subset_channel_file', _bench_subset_channel_file),
+               ('build_streamflow_cube', _bench_build_streamflow_cube),
+               ('combine_files', _bench_combine_files)]
+
+
+def _run_in_child(func, args, conn):
+    start_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    comid_index.default_cache.clear()
+    start = time.time()
+    func(*args)
+    seconds = time.time() - start
+    end_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    conn.send((seconds, start_rss, end_rss))
+    conn.close()
+
+
+def time_benchmark(func, args):
+    """Runs func(*args) in a new process.
+
+    Returns:
+        Tuple of elapsed seconds and the increase in peak resident memory in
+        megabytes while running.
+    """
+
+    parent_conn, child_conn = multiprocessing.Pipe()
+    process = multiprocessing.Process(target=_run_in_child,
+                                      args=(func, args, child_conn))
+    process.start()
+    seconds, start_rss, end_rss = parent_conn.recv()
+    process.join()
+    # ru_maxrss is reported in kilobytes on Linux.
+    return seconds, (end_rss - start_rss) / 1024.0
+
+
+def run(stations, times, formats, num_comids, repeat, workers, output,
+        workdir=None):
+    """Runs all benchmarks for each combination of scale and file format.
+
+    Returns:
+        List of result dicts, also appended to output as JSON lines if output
+        is given.
+    """
+
+    results = []
+    versions = {'python': platform.python_version(),
+                'numpy': np.__version__,
+                'netCDF4': netCDF4.__version__}
+    run_time = datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    remove_workdir = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='pynwm_bench_')
+    for num_stations in stations:
+        for num_times in times:
+            for file_format in formats:
+                folder = tempfile.mkdtemp(dir=workdir)
+                nc_files, station_ids = make_channel_files(
+                    folder, num_stations, num_times, file_format == 'gz')
+                input_mb = sum(os.path.getsize(f) for f in nc_files) / 1e6
+                rs = np.random.RandomState(1)
+                comids = rs.choice(station_ids,
+                                   min(num_comids, num_stations),
+                                   replace=False)
+                for name, func in _benchmarks:
+                    worker_options = [None]
+                    if workers and name in ('build_streamflow_cube',
+                                            'combine_files'):
+                        worker_options.append(workers)
+                    for num_workers in worker_options:
+                        for i in range(repeat):
+                            seconds, peak_mb = time_benchmark(
+                                func, (nc_files, comids, folder, num_workers))
+                            result = {
+                                'benchmark': name,
+                                'stations': num_stations,
+                                'times': num_times,
+                                'format': file_format,
+                                'comids': len(comids),
+                                'workers': num_workers,
+                                'repeat': i,
+                                'seconds': seconds,
+                                'files_per_second': num_times / seconds,
+                                'input_mb_per_second': input_mb / seconds,
+                                'peak_rss_increase_mb': peak_mb,
+                                'run_time': run_time}
+                            result.update(versions)
+                            results.append(result)
+                            print('{benchmark:>22} {stations:>8} stations '
+                                  '{times:>4} times {format:>2} '
+                                  'workers={workers} {seconds:8.3f} s '
+                                  '{files_per_second:8.1f} files/s '
+                                  '{peak_rss_increase_mb:8.1f} MB'.format(
+                                      **result))
+                            if output:
+                                with open(output, 'a') as f:
+                                    f.write(json.dumps(result) + '\n')
+                shutil.rmtree(folder)
+    if remove_workdir:
+        shutil.rmtree(workdir)
+    return results
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    arg_parser.add_argument('--stations', type=int, nargs='+',
+                            default=[10000, 100000],
+                            help='Numbers of stations per file')
+    arg_parser.add_argument('--times', type=int, nargs='+', default=[1, 24],
+                            help='Numbers of time steps (files)')
+    arg_parser.add_argument('--formats', nargs='+', default=['nc', 'gz'],
+                            choices=['nc', 'gz'], help='File formats')
+    arg_parser.add_argument('--comids', type=int, default=500,
+                            help='Number of COMIDs to extract')
+    arg_parser.add_argument('--repeat', type=int, default=1,
+                            help='Number of times to run each benchmark')
+    arg_parser.add_argument('--workers', type=int, default=None,
+                            help='Also time parallel builds with this many '
+                                 'processes')
+    arg_parser.add_argument('--output', default=None,
+                            help='File to append JSON line results to')
+    arg_parser.add_argument('--workdir', default=None,
+                            help='Folder for generated files')
+    args = arg_parser.parse_args()
+    run(args.stations, args.times, args.formats, args.comids, args.repeat,
+        args.workers, args.output, args.workdir)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/python2
+"""Local archive of streamflow history for fast per-river queries.
+
+Each National Water Model file holds every river at a single time step, so
+reading the history of one river means opening one file per time step. This
+module copies streamflow from model files into a single netCDF file laid out
+the other way around: values for each river are stored together, in chunks of
+consecutive time steps. The history of a river, or of a set of rivers, over
+any time range can then be read with a handful of small reads.
+
+The archive also stores the sort order of its COMIDs, so finding a river's
+row never requires sorting, and the valid times already ingested, so files can
+be ingested again without duplicating time steps.
+
+Example:
+    >>> from pynwm import archive
+    >>> comids = [5671187, 5670795]
+    >>> with archive.StreamflowArchive.create('history.nc', comids) as a:
+            a.ingest(analysis_files)
+    >>> with archive.StreamflowArchive('history.nc') as a:
+            times, q = a.query(5671187, '2016-06-01', '2016-06-21')
+"""
+
+from datetime import datetime
+
+from dateutil import parser as date_parser
+from netCDF4 import Dataset
+import numpy as np
+import pytz
+
+from pynwm import comid_index
+from pynwm import ncfiles
+from pynwm import nwm
+
+_epoch = datetime(1970, 1, 1, tzinfo=pytz.utc)
+_time_units = 'seconds since 1970-01-01 00:00:00 UTC'
+
+
+def _to_epoch_seconds(date):
+    """Returns seconds since 1970 for a datetime, string, or None."""
+
+    if date is None:
+        return None
+    if isinstance(date, basestring):
+        date = date_parser.parse(date)
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=pytz.utc)
+    return int((date - _epoch).total_seconds())
+
+
+class StreamflowArchive(object):
+    """Streamflow history stored by river in a chunked netCDF file.
+
+    Attributes:
+        filename: Filename of the archive.
+        comids: Numpy array of COMIDs in the order rows are stored.
+        times: Numpy array of ingested valid times in seconds since 1970, in
+            the order they were ingested.
+    """
+
+    def __init__(self, filename, mode='r'):
+        """Opens an existing archive.
+
+        Args:
+            filename: Filename of the archive.
+            mode: (Optional) 'r' to only query the archive, or 'a' to also
+                ingest files into it.
+        """
+
+        self.filename = filename
+        self._nc = Dataset(filename, mode)
+        variables = self._nc.variables
+        self.comids = np.ma.getdata(variables['station_id'][:])
+        sort_index = np.ma.getdata(variables['station_sort_index'][:])
+        self._index = comid_index.ComidIndex(self.comids, sort_index)
+        self.times = np.ma.getdata(variables['time'][:]).astype(np.int64)
+
+    @classmethod
+    def create(cls, filename, comids, station_chunk=64, time_chunk=2048,
+               zlib=False, complevel=4):
+        """Creates an empty archive for a set of rivers.
+
+        Args:
+            filename: Filename of the new archive. An existing file is
+                overwritten.
+            comids: List or numpy array of integers representing COMIDs of the
+                rivers to archive.
+            station_chunk: (Optional) Number of rivers per chunk.
+            time_chunk: (Optional) Number of time steps per chunk. Querying a
+                river reads roughly one chunk per time_chunk time steps.
+            zlib: (Optional) True if streamflow should be compressed.
+            complevel: (Optional) Compression level from 1 to 9 if zlib is
+                True.
+
+        Returns:
+            StreamflowArchive opened for ingesting.
+        """
+
+        comids = np.ma.getdata(np.asarray(comids)).astype(np.int32)
+        with Dataset(filename, 'w') as nc:
+            nc.createDimension('station', len(comids))
+            nc.createDimension('time', None)
+
+            comid_var = nc.createVariable('station_id', 'i', ('station',))
+            comid_var.long_name = 'Station id'
+            comid_var[:] = comids
+
+            sort_var = nc.createVariable('station_sort_index', 'i',
+                                         ('station',))
+            sort_var.long_name = 'Position of station_id values in sort order'
+            sort_var[:] = comids.argsort()
+
+            time_var = nc.createVariable('time', 'i8', ('time',))
+            time_var.long_name = 'valid output time'
+            time_var.standard_name = 'time'
+            time_var.units = _time_units
+
+            chunksizes = (min(station_chunk, len(comids)), time_chunk)
+            q_var = nc.createVariable(
+                'streamflow', 'f4', ('station', 'time'), zlib=zlib,
+                complevel=complevel, chunksizes=chunksizes)
+            q_var.long_name = 'River Flow'
+            q_var.units = 'meter^3 / sec'
+        return cls(filename, 'a')
+
+    def close(self):
+        self._nc.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def rows(self, comids):
+        """Returns archive row positions for a list of COMIDs.
+
+        Raises:
+            ValueError: A COMID is not in the archive.
+        """
+
+        comids = np.atleast_1d(np.asarray(comids, dtype=self.comids.dtype))
+        found = np.searchsorted(self._index.sorted_comids, comids)
+        found = np.minimum(found, len(self.comids) - 1)
+        rows = self._index.sorted_index[found]
+        missing = self.comids[rows] != comids
+        if missing.any():
+            raise ValueError('COMIDs not in archive: {0}'.format(
+                ', '.join(str(c) for c in comids[missing])))
+        return rows
+
+    def _write(self, times, block):
+        start = len(self.times)
+        end = start + len(times)
+        self._nc.variables['time'][start:end] = times
+        self._nc.variables['streamflow'][:, start:end] = block[:len(times)].T
+        self.times = np.concatenate([self.times, times])
+
+    def ingest(self, nc_files, batch_size=64):
+        """Adds streamflow from model files for valid times not yet archived.
+
+        Missing values are stored as NaN.
+
+        Args:
+            nc_files: List of netCDF filenames. Files can have .nc or .gz
+                extension. Each file must have a station_id variable.
+            batch_size: (Optional) Number of time steps written at once.
+                Larger batches write each chunk fewer times but use more
+                memory.
+
+        Returns:
+            Number of time steps added.
+        """
+
+        initial_count = len(self.times)
+        known_times = set(self.times.tolist())
+        block = np.zeros((batch_size, len(self.comids)), np.float32)
+        times = []
+        for nc_file in nc_files:
+            with ncfiles.unzipped(nc_file) as path, Dataset(path, 'r') as nc:
+                t = _to_epoch_seconds(ncfiles.read_valid_time(nc))
+                if t in known_times:
+                    continue
+                nc_comids = nc.variables['station_id'][:]
+                indices = comid_index.get_comid_index(nc_comids).indices(
+                    self.comids)
+                q_var = nc.variables['streamflow']
+                q_var.set_auto_maskandscale(False)
+                block[len(times)] = nwm._to_float(q_var[indices],
+                                                  nwm._get_packing(q_var))
+            known_times.add(t)
+            times.append(t)
+            if len(times) == batch_size:
+                self._write(np.array(times, np.int64), block)
+                times = []
+        if times:
+            self._write(np.array(times, np.int64), block)
+        self._nc.sync()
+        return len(self.times) - initial_count
+
+    def query(self, comids, start_date=None, end_date=None):
+        """Returns archived streamflow for rivers over a time range.
+
+        Args:
+            comids: A COMID, or list or numpy array of COMIDs.
+            start_date: (Optional) Earliest valid time to include, as a
+                datetime or string. Naive datetimes are taken as UTC. If None,
+                the range starts at the earliest archived time.
+            end_date: (Optional) Latest valid time to include, as for
+                start_date.
+
+        Returns:
+            Tuple consisting of:
+                numpy datetime64 array of valid times in UTC, sorted
+                streamflow array (float32) sized by (number of COMIDs, number
+                    of times), or by (number of times) if comids is a single
+                    COMID
+
+        Raises:
+            ValueError: A COMID is not in the archive.
+        """
+
+        rows = self.rows(comids)
+        start = _to_epoch_seconds(start_date)
+        end = _to_epoch_seconds(end_date)
+        in_range = np.ones(len(self.times), dtype=bool)
+        if start is not None:
+            in_range &= self.times >= start
+        if end is not None:
+            in_range &= self.times <= end
+        positions = np.flatnonzero(in_range)
+        positions = positions[np.argsort(self.times[positions],
+                                         kind='mergesort')]
+
+        if not len(positions):
+            q = np.zeros((len(rows), 0), np.float32)
+        else:
+            # Read the smallest span of time positions covering the range,
+            # then pick and order the positions in memory.
+            first, last = positions.min(), positions.max() + 1
+            q_var = self._nc.variables['streamflow']
+            row_order = np.argsort(rows)
+            q = np.empty((len(rows), last - first), np.float32)
+            q[row_order] = np.ma.getdata(
+                q_var[rows[row_order].tolist(), first:last])
+            q = q[:, positions - first]
+
+        times = self.times[positions].astype('datetime64[s]')
+        if np.ndim(comids) == 0:
+            return times, q[0]
+        return times, q
@@ -0,0 +1,256 @@
+#!/usr/bin/python2
+"""Compact, append-only store of streamflow for a fixed set of rivers.
+
+Extracting the same basin from every new analysis file with
+subset_channel_file writes a complete netCDF file, with all of its
+attributes, for each time step. A BasinStore instead keeps the basin's COMIDs
+once in a small header, followed by one fixed-size record per time step: the
+valid time as int64 seconds since 1970 and the streamflow of every river as
+little-endian float32. Appending a time step writes one record to the end of
+the file, and reading any time range is a single slice of a memory map.
+
+Valid times must be appended in increasing order, which keeps records sorted
+so a time range is found by binary search. A record left incomplete by an
+interrupted write is ignored when reading and overwritten by the next append.
+
+Example:
+    >>> from pynwm import basin
+    >>> with basin.BasinStore.create('brazos.nwmb', brazos_comids) as store:
+            store.ingest(analysis_files)
+    >>> with basin.BasinStore('brazos.nwmb', 'a') as store:
+            store.ingest([latest_analysis_file])  # every hour
+    >>> with basin.BasinStore('brazos.nwmb') as store:
+            times, q = store.read('2016-01-01', '2016-12-31 23:00')
+"""
+
+import os
+import struct
+
+import numpy as np
+
+from pynwm import archive
+from pynwm import comid_index
+from pynwm import nwm
+
+_magic = 'NWMBASN1'
+_header_format = '<8sq'
+_header_size = struct.calcsize(_header_format)
+_time_format = '<q'
+
+
+class BasinStore(object):
+    """Streamflow for a fixed set of rivers, one record per time step.
+
+    Attributes:
+        filename: Filename of the store.
+        comids: Numpy array of COMIDs in the order values are stored.
+    """
+
+    def __init__(self, filename, mode='r'):
+        """Opens an existing store.
+
+        Args:
+            filename: Filename of the store.
+            mode: (Optional) 'r' to only read the store, or 'a' to also
+                append time steps to it.
+
+        Raises:
+            ValueError: The file is not a basin store.
+        """
+
+        if mode not in ('r', 'a'):
+            raise ValueError('Mode must be r or a')
+        self.filename = filename
+        self._file = open(filename, 'r+b' if mode == 'a' else 'rb')
+        header = self._file.read(_header_size)
+        if len(header) == _header_size:
+            magic, num_rivers = struct.unpack(_header_format, header)
+            self.comids = np.fromfile(self._file, '<i8', num_rivers)
+        if (len(header) != _header_size or magic != _magic or
+                len(self.comids) != num_rivers):
+            self._file.close()
+            raise ValueError('Not a basin store: {0}'.format(filename))
+        self._index = None
+        self._data_offset = self._file.tell()
+        self._dtype = np.dtype([('time', '<i8'),
+                                ('streamflow', '<f4', (num_rivers,))])
+        self._records = None
+        self._times = np.zeros(0, np.int64)
+        self._count = 0
+        self._refresh()
+        if mode == 'a':
+            # Drop a record left incomplete by an interrupted append.
+            self._file.truncate(self._data_offset +
+                                self._count * self._dtype.itemsize)
+            self._file.seek(0, os.SEEK_END)
+
+    @classmethod
+    def create(cls, filename, comids):
+        """Creates an empty store for a set of rivers.
+
+        Args:
+            filename: Filename of the new store. An existing file is
+                overwritten.
+            comids: List or numpy array of integers representing COMIDs of the
+                rivers to store, e.g., the station_id variable of a basin file.
+
+        Returns:
+            BasinStore opened for appending.
+        """
+
+        comids = np.ma.getdata(np.asarray(comids)).astype('<i8')
+        with open(filename, 'wb') as f:
+            f.write(struct.pack(_header_format, _magic, len(comids)))
+            f.write(comids.tostring())
+        return cls(filename, 'a')
+
+    def close(self):
+        self._records = None
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return self._count
+
+    def _refresh(self):
+        """Maps records appended since the store was last mapped.
+
+        Records may have been appended by this store or by another process.
+        """
+
+        size = os.fstat(self._file.fileno()).st_size
+        count = max(size - self._data_offset, 0) // self._dtype.itemsize
+        if self._records is not None and len(self._records) == count:
+            return
+        if not count:
+            self._records = np.zeros(0, self._dtype)
+            return
+        self._records = np.memmap(self.filename, self._dtype, 'r',
+                                  self._data_offset, (count,))
+        if count > self._count:
+            self._times = np.concatenate(
+                [self._times, self._records['time'][self._count:]])
+            self._count = count
+
+    @property
+    def times(self):
+        """Numpy datetime64 array of stored valid times in UTC."""
+
+        self._refresh()
+        return self._times.astype('datetime64[s]')
+
+    def append(self, valid_time, q):
+        """Appends one time step.
+
+        Args:
+            valid_time: Valid time of the values, as a datetime or string.
+                Naive datetimes are taken as UTC.
+            q: Streamflow of each river, in the order of comids.
+
+        Raises:
+            ValueError: valid_time is not later than the last stored time, or
+                q does not have one value per river.
+        """
+
+        t = archive._to_epoch_seconds(valid_time)
+        if self._count and t <= self._times[-1]:
+            raise ValueError('Valid time {0} is not after the last stored '
+                             'time'.format(valid_time))
+        q = np.asarray(q, '<f4')
+        if q.shape != (len(self.comids),):
+            raise ValueError('Expected {0} values, got {1}'.format(
+                len(self.comids), q.size))
+        self._file.write(struct.pack(_time_format, t) + q.tostring())
+        self._file.flush()
+        self._times = np.append(self._times, t)
+        self._count += 1
+
+    def ingest(self, nc_files):
+        """Appends streamflow from model files newer than the last time step.
+
+        Files with a valid time at or before the last stored time are skipped,
+        so the same files can be ingested again, e.g., by an hourly job.
+
+        Args:
+            nc_files: List of netCDF filenames sorted by valid time. Files
+                can have .nc or .gz extension. Each file must have a
+                station_id variable.
+
+        Returns:
+            Number of time steps added.
+        """
+
+        initial_count = self._count
+        for nc_file in nc_files:
+            date, q, _ = nwm._read_q_from_file(nc_file, self.comids)
+            if (self._count and
+                    archive._to_epoch_seconds(date) <= self._times[-1]):
+                continue
+            self.append(date, q)
+        return self._count - initial_count
+
+    def columns(self, comids):
+        """Returns positions of COMIDs within the stored values.
+
+        Raises:
+            ValueError: A COMID is not in the store.
+        """
+
+        if self._index is None:
+            self._index = comid_index.ComidIndex(self.comids)
+        comids = np.atleast_1d(np.asarray(comids, self.comids.dtype))
+        found = np.searchsorted(self._index.sorted_comids, comids)
+        found = np.minimum(found, len(self.comids) - 1)
+        columns = self._index.sorted_index[found]
+        missing = self.comids[columns] != comids
+        if missing.any():
+            raise ValueError('COMIDs not in store: {0}'.format(
+                ', '.join(str(c) for c in comids[missing])))
+        return columns
+
+    def read(self, start_date=None, end_date=None, comids=None):
+        """Returns stored streamflow over a time range.
+
+        Args:
+            start_date: (Optional) Earliest valid time to include, as a
+                datetime or string. Naive datetimes are taken as UTC. If None,
+                the range starts at the first stored time.
+            end_date: (Optional) Latest valid time to include, as for
+                start_date.
+            comids: (Optional) A COMID, or list or numpy array of COMIDs, to
+                read. If None, all rivers are read.
+
+        Returns:
+            Tuple consisting of:
+                numpy datetime64 array of valid times in UTC
+                streamflow array (float32) sized by (number of times, number
+                    of rivers), or by (number of times) if comids is a single
+                    COMID. If comids is None, this is a read-only view of the
+                    memory-mapped file.
+
+        Raises:
+            ValueError: A COMID is not in the store.
+        """
+
+        self._refresh()
+        start = 0
+        end = self._count
+        if start_date is not None:
+            start = np.searchsorted(
+                self._times, archive._to_epoch_seconds(start_date), 'left')
+        if end_date is not None:
+            end = np.searchsorted(
+                self._times, archive._to_epoch_seconds(end_date), 'right')
+        end = max(start, end)
+        q = self._records['streamflow'][start:end]
+        if comids is not None:
+            q = q[:, self.columns(comids)]
+            if np.ndim(comids) == 0:
+                q = q[:, 0]
+        times = self._times[start:end].astype('datetime64[s]')
+        return times, q
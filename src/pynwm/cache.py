@@ -0,0 +1,139 @@
+#!/usr/bin/python2
+"""Time-limited cache for responses from listing services.
+
+HydroShare file lists and folder contents change only when new model results
+arrive, at most a few times an hour, but are requested far more often. This
+module keeps responses for a configurable number of seconds in memory and,
+optionally, in a folder on disk so several processes can share them.
+
+Example:
+    >>> from pynwm import nwm
+    >>> nwm.listing_cache.ttl = 120
+    >>> start_date, end_date = nwm.get_analysis_bounding_dates()
+    >>> filename = nwm.get_latest_analysis_filename()
+    >>> nwm.listing_cache.hits, nwm.listing_cache.misses
+    (1, 1)
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+def _to_str(text):
+    """Returns unicode as a UTF-8 encoded str, and other values unchanged."""
+
+    if isinstance(text, unicode):
+        return text.encode('utf-8')
+    return text
+
+
+class TTLCache(object):
+    """Cache of string values that expire a fixed time after being stored.
+
+    Keys and values are stored as str; unicode is encoded as UTF-8, so values
+    read back from disk are the same type as values kept in memory.
+
+    Attributes:
+        ttl: Number of seconds a value is returned after being stored.
+        cache_dir: Folder where values are also saved as .json files, or None
+            if values are only kept in memory.
+        hits: Number of get calls that returned a stored value.
+        misses: Number of get calls that found no unexpired value.
+    """
+
+    def __init__(self, ttl=300, cache_dir=None):
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _filename(self, key):
+        digest = hashlib.sha1(_to_str(key)).hexdigest()
+        return os.path.join(self.cache_dir,
+                            'ttl_cache_{0}.json'.format(digest))
+
+    def _read_file(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._filename(key), 'r') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if _to_str(entry.get('key')) != key:
+            return None
+        return entry['stored'], _to_str(entry['value'])
+
+    def _write_file(self, key, stored, value):
+        if not self.cache_dir:
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        fd, tmp_filename = tempfile.mkstemp(suffix='.json', dir=self.cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'key': key, 'stored': stored, 'value': value}, f)
+        os.rename(tmp_filename, self._filename(key))
+
+    def get(self, key):
+        """Returns the value stored for key, or None if missing or expired."""
+
+        key = _to_str(key)
+        now = time.time()
+        with self._lock:
+            entry = self._values.get(key)
+        if entry is None or now - entry[0] >= self.ttl:
+            # Another process may have stored a newer value on disk.
+            file_entry = self._read_file(key)
+            if file_entry is not None and (entry is None or
+                                           file_entry[0] > entry[0]):
+                entry = file_entry
+                with self._lock:
+                    self._values[key] = entry
+        if entry is not None and now - entry[0] < self.ttl:
+            self.hits += 1
+            return entry[1]
+        self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """Stores value for key, replacing any existing value."""
+
+        key = _to_str(key)
+        value = _to_str(value)
+        stored = time.time()
+        with self._lock:
+            self._values[key] = (stored, value)
+        self._write_file(key, stored, value)
+
+    def invalidate(self, key=None):
+        """Removes the value for key, or all values if key is None."""
+
+        key = _to_str(key)
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+        if not self.cache_dir or not os.path.isdir(self.cache_dir):
+            return
+        if key is None:
+            filenames = [os.path.join(self.cache_dir, f)
+                         for f in os.listdir(self.cache_dir)
+                         if f.startswith('ttl_cache_')]
+        else:
+            filenames = [self._filename(key)]
+        for filename in filenames:
+            if os.path.isfile(filename):
+                os.remove(filename)
+
+    def reset_counters(self):
+        """Sets hits and misses back to zero."""
+
+        self.hits = 0
+        self.misses = 0
@@ -0,0 +1,206 @@
+#!/usr/bin/python2
+"""Non-blocking access to HydroShare for services handling many users.
+
+Each nwm function blocks until HydroShare responds. HydroShareClient runs
+those calls on a fixed number of background threads and returns a Request
+right away, so a web service can start requests for many users and handle
+each response as it arrives instead of waiting on them one at a time. All
+requests share the same pool of keep-alive connections as the rest of pynwm,
+connections.default_pool, which the client does not change. It keeps up to
+default_pool.max_idle idle connections per host; with a higher
+max_concurrency, raise max_idle to match so connections are reused rather
+than closed after each call.
+
+Request mirrors the interface of Python 3 futures (result, done and
+add_done_callback), so it can be handed to an event loop. For example, in
+Tornado a done callback can pass the result to IOLoop.add_callback.
+
+Example:
+    >>> from pynwm import client, connections
+    >>> connections.default_pool.max_idle = 16
+    >>> with client.HydroShareClient(max_concurrency=16, timeout=30) as c:
+            requests = [c.get_streamflow('short_range', comid)
+                        for comid in comids]
+            series = [r.result() for r in requests]
+"""
+
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+
+from pynwm import download
+from pynwm import nwm
+
+
+class Request(object):
+    """Result of a call that is running in the background."""
+
+    def __init__(self, timeout=None):
+        self._timeout = timeout
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks = []
+        self._result = None
+        self._exc_info = None
+
+    def _finish(self, result=None, exc_info=None):
+        with self._lock:
+            self._result = result
+            self._exc_info = exc_info
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def _wait(self, timeout):
+        if timeout is None:
+            timeout = self._timeout
+        if not self._done.wait(timeout):
+            raise TimeoutError('Request did not finish within {0} '
+                               'seconds'.format(timeout))
+
+    def done(self):
+        """Returns True if the call has finished."""
+
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the call to finish and returns its result.
+
+        Args:
+            timeout: (Optional) Maximum number of seconds to wait. If None,
+                the client's timeout is used.
+
+        Raises:
+            TimeoutError: The call did not finish in time.
+            Exception: Any exception raised by the call is raised again.
+        """
+
+        self._wait(timeout)
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self, timeout=None):
+        """Waits for the call to finish and returns its exception or None.
+
+        Raises:
+            TimeoutError: The call did not finish in time.
+        """
+
+        self._wait(timeout)
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, callback):
+        """Calls callback(request) once the call finishes.
+
+        The callback runs on the background thread that made the call, or
+        right away if the call has already finished.
+        """
+
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+
+class HydroShareClient(object):
+    """Runs HydroShare requests in the background with limited concurrency.
+
+    Attributes:
+        max_concurrency: Maximum number of calls running at the same time.
+            Further calls wait for one of them to finish.
+        timeout: Default number of seconds Request.result waits, or None to
+            wait without limit. The socket timeout of each connection is set
+            by connections.default_pool.timeout, and the number of idle
+            connections kept by connections.default_pool.max_idle.
+    """
+
+    def __init__(self, max_concurrency=8, timeout=None):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._pool = ThreadPool(max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Waits for running calls to finish and stops background threads."""
+
+        self._pool.close()
+        self._pool.join()
+
+    def submit(self, func, *args, **kwargs):
+        """Runs func(*args, **kwargs) in the background.
+
+        Returns:
+            Request for the result of the call.
+        """
+
+        request = Request(self.timeout)
+
+        def run():
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                request._finish(exc_info=sys.exc_info())
+            else:
+                request._finish(result)
+
+        self._pool.apply_async(run)
+        return request
+
+    def get_streamflow(self, product, comid, sim_datetime_utc=None,
+                       timezone=None, as_arrays=False, stack_members=False):
+        """Starts nwm.get_streamflow and returns a Request for its result."""
+
+        return self.submit(nwm.get_streamflow, product, comid,
+                           sim_datetime_utc, timezone, as_arrays,
+                           stack_members)
+
+    def get_latest_forecast_date(self, product):
+        """Starts nwm.get_latest_forecast_date and returns a Request."""
+
+        return self.submit(nwm.get_latest_forecast_date, product)
+
+    def get_analysis_bounding_dates(self):
+        """Starts nwm.get_analysis_bounding_dates and returns a Request."""
+
+        return self.submit(nwm.get_analysis_bounding_dates)
+
+    def get_analysis_filenames(self):
+        """Starts a request for the list of analysis and assimilation files.
+
+        Returns:
+            Request for a list of filenames, oldest first.
+        """
+
+        return self.submit(nwm._get_analysis_filenames)
+
+    def get_latest_analysis_filename(self):
+        """Starts nwm.get_latest_analysis_filename and returns a Request."""
+
+        return self.submit(nwm.get_latest_analysis_filename)
+
+    def get_latest_analysis_file(self, output_folder):
+        """Starts nwm.get_latest_analysis_file and returns a Request."""
+
+        return self.submit(nwm.get_latest_analysis_file, output_folder)
+
+    def download_files(self, files, output_folder, workers=4,
+                       decompress=False, overwrite=False):
+        """Starts download.download_files and returns a Request.
+
+        The download counts as one call toward max_concurrency, but uses up
+        to workers connections of its own.
+        """
+
+        return self.submit(download.download_files, files, output_folder,
+                           workers, decompress, overwrite)
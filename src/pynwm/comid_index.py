@@ -0,0 +1,188 @@
+#!/usr/bin/python2
+"""Caches the lookup from COMID to row position within model result files.
+
+Each National Water Model channel file stores results for roughly 2.7 million
+river reaches, ordered by the station_id variable. Finding the rows for a set
+of COMIDs requires sorting the station_id array, which takes far longer than
+reading the handful of values typically requested. Files from the same model
+configuration share the same station_id layout, so the sort only needs to be
+done once per layout.
+
+This module keeps sorted indices in memory keyed by a fingerprint of the
+station_id array, evicting the least recently used index when the cache is
+full. Indices can optionally be saved to a folder as .npy files so later
+processes can skip the sort as well.
+
+Example:
+    >>> from pynwm import comid_index
+    >>> comid_index.default_cache.cache_dir = '/var/cache/pynwm'
+    >>> index = comid_index.get_comid_index(nc.variables['station_id'][:])
+    >>> rows = index.indices([5671187, 5670795])
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import tempfile
+import threading
+
+import numpy as np
+
+from pynwm import instrument
+
+
+def fingerprint_station_ids(nc_comids):
+    """Returns a hex digest identifying the layout of a station_id array.
+
+    Args:
+        nc_comids: Numpy array of COMIDs in the order stored in a file.
+
+    Returns:
+        String that is equal for arrays with identical dtype, shape and values.
+    """
+
+    nc_comids = np.ascontiguousarray(np.ma.getdata(nc_comids))
+    digest = hashlib.sha1()
+    digest.update('{0}{1}'.format(nc_comids.dtype.str, nc_comids.shape))
+    digest.update(nc_comids.data)
+    return digest.hexdigest()
+
+
+class ComidIndex(object):
+    """Maps COMIDs to row positions within a station_id array.
+
+    Attributes:
+        fingerprint: Digest of the station_id array the index was built from.
+        sorted_index: Array of row positions that sorts the station_id array.
+        sorted_comids: The station_id array in sorted order.
+    """
+
+    def __init__(self, nc_comids, sorted_index=None, fingerprint=None):
+        """Builds the index, sorting nc_comids unless sorted_index is given.
+
+        Args:
+            nc_comids: Numpy array of COMIDs in the order stored in a file.
+            sorted_index: (Optional) Previously computed argsort of nc_comids.
+            fingerprint: (Optional) Previously computed fingerprint of
+                nc_comids.
+        """
+
+        nc_comids = np.ma.getdata(nc_comids)
+        if sorted_index is None:
+            sorted_index = nc_comids.argsort()
+        if fingerprint is None:
+            fingerprint = fingerprint_station_ids(nc_comids)
+        self.fingerprint = fingerprint
+        self.sorted_index = sorted_index
+        self.sorted_comids = nc_comids[sorted_index]
+
+    def __len__(self):
+        return len(self.sorted_index)
+
+    def indices(self, comids):
+        """Returns row positions for a list or numpy array of COMIDs."""
+
+        found_index_sorted = np.searchsorted(self.sorted_comids,
+                                             np.asarray(comids))
+        return self.sorted_index[found_index_sorted]
+
+
+class ComidIndexCache(object):
+    """Least recently used cache of ComidIndex objects.
+
+    Attributes:
+        max_size: Maximum number of indices kept in memory.
+        cache_dir: Folder where indices are saved as .npy files, or None if
+            indices are only kept in memory.
+        hits: Number of lookups answered from memory or disk.
+        misses: Number of lookups that required sorting station_id.
+    """
+
+    def __init__(self, max_size=4, cache_dir=None):
+        self.max_size = max_size
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+        self._indices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _sidecar_filename(self, fingerprint):
+        return os.path.join(self.cache_dir,
+                            'comid_index_{0}.npy'.format(fingerprint))
+
+    def _load(self, nc_comids, fingerprint):
+        if not self.cache_dir:
+            return None
+        filename = self._sidecar_filename(fingerprint)
+        if not os.path.isfile(filename):
+            return None
+        sorted_index = np.load(filename)
+        if len(sorted_index) != len(nc_comids):
+            return None
+        return ComidIndex(nc_comids, sorted_index, fingerprint)
+
+    def _save(self, index):
+        if not self.cache_dir:
+            return
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        # Write to a unique name first so concurrent processes never read a
+        # partially written sidecar.
+        fd, tmp_filename = tempfile.mkstemp(suffix='.npy', dir=self.cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            np.save(f, index.sorted_index)
+        os.rename(tmp_filename, self._sidecar_filename(index.fingerprint))
+
+    def get(self, nc_comids):
+        """Returns the ComidIndex for a station_id array, building if needed.
+
+        Args:
+            nc_comids: Numpy array of COMIDs in the order stored in a file.
+
+        Returns:
+            ComidIndex for the array.
+        """
+
+        fingerprint = fingerprint_station_ids(nc_comids)
+        with self._lock:
+            index = self._indices.pop(fingerprint, None)
+            if index is not None:
+                self._indices[fingerprint] = index
+                self.hits += 1
+                instrument.count('comid_index_hits')
+                return index
+
+        index = self._load(nc_comids, fingerprint)
+        loaded = index is not None
+        if loaded:
+            instrument.count('comid_index_hits')
+        else:
+            instrument.count('comid_index_misses')
+            with instrument.stage('build_comid_index'):
+                index = ComidIndex(nc_comids, fingerprint=fingerprint)
+            self._save(index)
+
+        with self._lock:
+            if loaded:
+                self.hits += 1
+            else:
+                self.misses += 1
+            self._indices[fingerprint] = index
+            while len(self._indices) > self.max_size:
+                self._indices.popitem(last=False)
+        return index
+
+    def clear(self):
+        """Removes all indices from memory. Saved .npy files are kept."""
+
+        with self._lock:
+            self._indices.clear()
+
+
+default_cache = ComidIndexCache()
+
+
+def get_comid_index(nc_comids):
+    """Returns a ComidIndex for a station_id array using the default cache."""
+
+    return default_cache.get(nc_comids)
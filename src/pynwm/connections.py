@@ -0,0 +1,192 @@
+#!/usr/bin/python2
+"""Reuses HTTP connections across requests to the HydroShare API.
+
+Opening a new HTTPS connection for every request costs a TCP and TLS handshake,
+which is often slower than the request itself. This module keeps idle
+connections open per host so later requests, including requests from several
+threads, can reuse them.
+
+Redirects are followed, and proxies set by the http_proxy and https_proxy
+environment variables are used unless no_proxy excludes the host, as with
+urllib.
+
+Example:
+    >>> from pynwm import connections
+    >>> text = connections.get('https://apps.hydroshare.org/apps/...')
+"""
+
+import base64
+import httplib
+import socket
+import threading
+import urllib
+import urlparse
+from urllib2 import HTTPError
+
+from pynwm import instrument
+
+_redirect_statuses = (301, 302, 303, 307, 308)
+_max_redirects = 5
+
+
+def _get_proxy(scheme, netloc):
+    """Returns the proxy for a host from the environment, or None.
+
+    Returns:
+        Tuple of proxy host, port and Proxy-Authorization header value (None
+        if the proxy URI has no credentials), or None if no proxy is used.
+    """
+
+    proxy = urllib.getproxies().get(scheme)
+    if not proxy:
+        return None
+    if urllib.proxy_bypass(urlparse.urlsplit('//' + netloc).hostname):
+        return None
+    if '://' not in proxy:
+        proxy = 'http://' + proxy
+    parts = urlparse.urlsplit(proxy)
+    authorization = None
+    if parts.username is not None:
+        credentials = '{0}:{1}'.format(urllib.unquote(parts.username),
+                                       urllib.unquote(parts.password or ''))
+        authorization = 'Basic ' + base64.b64encode(credentials)
+    return parts.hostname, parts.port or 80, authorization
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of keep-alive HTTP and HTTPS connections.
+
+    Attributes:
+        max_idle: Maximum number of idle connections kept open per host.
+        timeout: Socket timeout in seconds for new connections.
+    """
+
+    def __init__(self, max_idle=8, timeout=60):
+        self.max_idle = max_idle
+        self.timeout = timeout
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _checkout(self, key):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop(), True
+        scheme, netloc, proxy = key
+        if proxy is None:
+            host = netloc
+        else:
+            host = '{0}:{1}'.format(proxy[0], proxy[1])
+        if scheme == 'https':
+            conn = httplib.HTTPSConnection(host, timeout=self.timeout)
+            if proxy is not None:
+                tunnel_headers = {}
+                if proxy[2]:
+                    tunnel_headers['Proxy-Authorization'] = proxy[2]
+                conn.set_tunnel(netloc, headers=tunnel_headers)
+        else:
+            conn = httplib.HTTPConnection(host, timeout=self.timeout)
+        return conn, False
+
+    def _checkin(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_idle:
+                idle.append(conn)
+                return
+        conn.close()
+
+    def get(self, uri, headers=None):
+        """Returns the body of a GET request as a string.
+
+        Redirects are followed, up to five in a row.
+
+        Args:
+            uri: Absolute http or https URI to request.
+            headers: (Optional) Dict of additional request headers.
+
+        Returns:
+            Response body.
+
+        Raises:
+            HTTPError: The server responded with a status other than 2xx
+                after following redirects, or redirected too many times.
+        """
+
+        for _ in range(_max_redirects + 1):
+            with instrument.stage('http_request'):
+                text, response = self._request(uri, headers)
+            instrument.count('bytes_downloaded', len(text))
+            location = response.getheader('location')
+            if response.status not in _redirect_statuses or not location:
+                break
+            uri = urlparse.urljoin(uri, location)
+        else:
+            raise HTTPError(uri, response.status, 'Too many redirects',
+                            response.msg, None)
+        if not 200 <= response.status < 300:
+            raise HTTPError(uri, response.status, response.reason,
+                            response.msg, None)
+        return text
+
+    def _request(self, uri, headers):
+        """Returns the body and response of a GET request."""
+
+        parts = urlparse.urlsplit(uri)
+        proxy = _get_proxy(parts.scheme, parts.netloc)
+        key = (parts.scheme, parts.netloc, proxy)
+        request_headers = {'Connection': 'keep-alive'}
+        if proxy is not None and parts.scheme == 'http':
+            # Plain HTTP proxies are sent the whole URI.
+            path = urlparse.urlunsplit(parts[:4] + ('',))
+            if proxy[2]:
+                request_headers['Proxy-Authorization'] = proxy[2]
+        else:
+            path = parts.path or '/'
+            if parts.query:
+                path += '?' + parts.query
+        if headers:
+            request_headers.update(headers)
+
+        conn, reused = self._checkout(key)
+        try:
+            conn.request('GET', path, headers=request_headers)
+            response = conn.getresponse()
+        except (httplib.HTTPException, socket.error):
+            conn.close()
+            if not reused:
+                raise
+            # The server may have closed an idle connection, so retry once
+            # on a new one.
+            conn, reused = self._checkout(key)
+            conn.request('GET', path, headers=request_headers)
+            response = conn.getresponse()
+
+        try:
+            text = response.read()
+        except Exception:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(key, conn)
+        return text, response
+
+    def close(self):
+        """Closes all idle connections."""
+
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for conns in idle.itervalues():
+            for conn in conns:
+                conn.close()
+
+
+default_pool = ConnectionPool()
+
+
+def get(uri, headers=None):
+    """Returns the body of a GET request using the default pool."""
+
+    return default_pool.get(uri, headers)
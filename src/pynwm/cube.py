@@ -0,0 +1,349 @@
+#!/usr/bin/python2
+"""Streamflow from many model files, read only where it is accessed.
+
+nwm.build_streamflow_cube reads every time step of every river into memory,
+which is more than a modest machine holds for a 720 step long range forecast
+across the whole country. StreamflowCube looks like the same (time, river)
+array but reads from the files on demand: indexing reads only the files and
+rivers asked for, and reductions such as max read one file at a time, so
+memory use depends on the number of rivers rather than the number of files.
+
+A few files are kept open between reads. Zipped files are unzipped when
+opened and the temporary copy is removed when the file is closed.
+
+Example:
+    >>> from pynwm import cube
+    >>> with cube.StreamflowCube(long_range_files) as q:
+            print q.shape
+            first = q[0]
+            one_river = q.subset([5671187])[:, 0]
+            max_q = q.max(axis=0)
+"""
+
+from collections import OrderedDict
+import threading
+
+from netCDF4 import Dataset
+import numpy as np
+
+from pynwm import comid_index
+from pynwm import ncfiles
+from pynwm import nwm
+
+
+class DatasetCache(object):
+    """Least recently used cache of open netCDF datasets.
+
+    Attributes:
+        max_open: Maximum number of files kept open.
+    """
+
+    def __init__(self, max_open=4):
+        self.max_open = max_open
+        self._open = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, nc_file):
+        """Returns an open Dataset for a .nc or .gz file."""
+
+        with self._lock:
+            entry = self._open.pop(nc_file, None)
+            if entry is None:
+                context = ncfiles.unzipped(nc_file)
+                path = context.__enter__()
+                try:
+                    entry = (context, Dataset(path, 'r'))
+                except BaseException:
+                    context.__exit__(None, None, None)
+                    raise
+            self._open[nc_file] = entry
+            while len(self._open) > self.max_open:
+                _, old_entry = self._open.popitem(last=False)
+                self._close(old_entry)
+            return entry[1]
+
+    def _close(self, entry):
+        context, nc = entry
+        nc.close()
+        context.__exit__(None, None, None)
+
+    def close(self):
+        """Closes all open files."""
+
+        with self._lock:
+            while self._open:
+                _, entry = self._open.popitem(last=False)
+                self._close(entry)
+
+
+class StreamflowCube(object):
+    """Lazy (time, river) array of streamflow over a list of model files.
+
+    Indexing works like a numpy array with integers, slices or lists of
+    positions, e.g., q[3], q[:, 10:20] or q[[0, 5], [2, 7, 9]], and returns a
+    float32 numpy array. Use subset to select rivers by COMID.
+
+    Attributes:
+        nc_files: List of netCDF filenames, one per time step.
+        comids: Numpy array of COMIDs of the rivers (columns), or None if the
+            files have no station_id variable.
+        shape: Tuple of (number of time steps, number of rivers).
+    """
+
+    def __init__(self, nc_files, comids=None, consistent_comid_order=True,
+                 max_open=4, datasets=None):
+        """Creates a cube without reading any streamflow.
+
+        Args:
+            nc_files: List of netCDF filenames. Files can have .nc or .gz
+                extension.
+            comids: (Optional) List or numpy array of integers representing
+                COMIDs for the rivers to include. If None, all rivers are used
+                in the same order as the first file.
+            consistent_comid_order: (Optional) True if the order of COMIDs in
+                all files is the same; False otherwise. If True, rivers are
+                only looked up in the first file read.
+            max_open: (Optional) Maximum number of files kept open.
+            datasets: (Optional) DatasetCache to share with other cubes. If
+                None, the cube keeps its own.
+        """
+
+        if not len(nc_files):
+            raise ValueError('No files for cube')
+        self.nc_files = list(nc_files)
+        self.consistent_comid_order = consistent_comid_order
+        self._datasets = datasets or DatasetCache(max_open)
+        self._shared_indices = None
+        self._dates = None
+
+        if comids is not None and len(comids):
+            if type(comids[0]) is str:
+                comids = [int(comid) for comid in comids]
+            self.comids = np.asarray(comids)
+            self._file_order = False
+            num_rivers = len(self.comids)
+        else:
+            nc = self._datasets.get(self.nc_files[0])
+            num_rivers = len(nc.variables['streamflow'])
+            self.comids = None
+            if 'station_id' in nc.variables:
+                self.comids = np.ma.getdata(nc.variables['station_id'][:])
+            # Rivers are in the order of the first file, so with consistent
+            # ordering no lookup is needed.
+            self._file_order = consistent_comid_order or self.comids is None
+        self.shape = (len(self.nc_files), num_rivers)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Closes all files opened by the cube."""
+
+        self._datasets.close()
+
+    def subset(self, comids):
+        """Returns a cube of the same files for a set of COMIDs.
+
+        The new cube shares open files with this one.
+        """
+
+        return StreamflowCube(self.nc_files, comids,
+                              self.consistent_comid_order,
+                              datasets=self._datasets)
+
+    @property
+    def dates(self):
+        """List of valid output datetimes of the files, read when first used.
+        """
+
+        if self._dates is None:
+            self._dates = [ncfiles.read_valid_time(self._datasets.get(f))
+                           for f in self.nc_files]
+        return self._dates
+
+    def _get_indices(self, t, nc):
+        """Returns file rows of the cube's rivers, or None if in file order.
+        """
+
+        if self._file_order:
+            return None
+        if self.consistent_comid_order and self._shared_indices is not None:
+            return self._shared_indices
+        if 'station_id' not in nc.variables:
+            m = ('COMIDs provided, but index to COMIDs cannot be built '
+                 'because {0} has no station_id variable')
+            raise Exception(m.format(self.nc_files[t]))
+        nc_comids = nc.variables['station_id'][:]
+        indices = comid_index.get_comid_index(nc_comids).indices(self.comids)
+        if self.consistent_comid_order:
+            self._shared_indices = indices
+        return indices
+
+    def _read(self, t, columns=None):
+        """Returns the open dataset of a time step and its streamflow."""
+
+        nc = self._datasets.get(self.nc_files[t])
+        var = nc.variables['streamflow']
+        var.set_auto_maskandscale(False)
+        indices = self._get_indices(t, nc)
+        if indices is None:
+            if columns is None:
+                q = var[:]
+            elif isinstance(columns, slice):
+                q = var[columns]
+            else:
+                q = nwm._read_rows(var, nwm._plan_row_reads(columns))
+        else:
+            if columns is not None:
+                indices = indices[columns]
+            q = nwm._read_rows(var, nwm._plan_row_reads(indices))
+        return nc, nwm._to_float(np.ma.getdata(q), nwm._get_packing(var),
+                                 np.float32)
+
+    def read(self, t, columns=None):
+        """Reads streamflow of one time step.
+
+        Args:
+            t: Position of the time step.
+            columns: (Optional) Numpy array of river positions, or a slice. If
+                None, all rivers are read.
+
+        Returns:
+            float32 numpy array of streamflow. Missing values are NaN, as
+            returned by nwm.build_streamflow_cube.
+        """
+
+        return self._read(t, columns)[1]
+
+    def iter_rows(self, columns=None, dates=False):
+        """Yields streamflow of each time step in order, as for read.
+
+        If dates is True, tuples of valid output datetime and streamflow are
+        yielded instead, with the date read from the file already open for
+        the streamflow.
+        """
+
+        for t in range(self.shape[0]):
+            nc, q = self._read(t, columns)
+            if dates:
+                if self._dates is not None:
+                    date = self._dates[t]
+                else:
+                    date = ncfiles.read_valid_time(nc)
+                yield date, q
+            else:
+                yield q
+
+    def __getitem__(self, key):
+        if not isinstance(key, tuple):
+            key = (key,)
+        if len(key) > 2:
+            raise IndexError('Too many indices for cube')
+        times = np.arange(self.shape[0])[key[0]]
+        column_key = key[1] if len(key) == 2 else slice(None)
+        if isinstance(column_key, slice):
+            columns = column_key
+            num_columns = len(range(*column_key.indices(self.shape[1])))
+        else:
+            columns = np.arange(self.shape[1])[column_key]
+            num_columns = np.size(columns)
+
+        out = np.empty((np.size(times), num_columns), np.float32)
+        for i, t in enumerate(np.atleast_1d(times)):
+            out[i] = self.read(t, np.atleast_1d(columns)
+                               if not isinstance(columns, slice) else columns)
+        if np.ndim(times) == 0:
+            out = out[0]
+        if not isinstance(columns, slice) and np.ndim(columns) == 0:
+            out = out[..., 0]
+        return out
+
+    def reduce(self, reductions, columns=None):
+        """Computes reductions over time, reading one time step at a time.
+
+        Args:
+            reductions: List of reductions.Reduction objects.
+            columns: (Optional) Numpy array of river positions, or a slice. If
+                None, all rivers are used.
+
+        Returns:
+            Dict of reduction name to its result.
+        """
+
+        for date, q in self.iter_rows(columns, dates=True):
+            for reduction in reductions:
+                reduction.update(date, q)
+        return {r.name: r.result() for r in reductions}
+
+    def _reduce(self, ufunc, axis):
+        """Applies a numpy ufunc reduction one time step at a time."""
+
+        if axis == 1:
+            return np.array([ufunc.reduce(q) for q in self.iter_rows()])
+        result = None
+        for q in self.iter_rows():
+            if result is None:
+                result = q.copy()
+            else:
+                ufunc(result, q, out=result)
+        if axis is None:
+            return ufunc.reduce(result)
+        return result
+
+    def max(self, axis=None):
+        """Returns maximum streamflow, ignoring missing values.
+
+        Args:
+            axis: (Optional) 0 for the maximum of each river over time, 1 for
+                the maximum over rivers of each time step, or None for a
+                single value.
+        """
+
+        return self._reduce(np.fmax, axis)
+
+    def min(self, axis=None):
+        """Returns minimum streamflow, with axis as for max."""
+
+        return self._reduce(np.fmin, axis)
+
+    def _sum_count(self, axis):
+        """Returns the float64 sum and number of values that are not NaN."""
+
+        if axis == 1:
+            sums = []
+            counts = []
+            for q in self.iter_rows():
+                ok = ~np.isnan(q)
+                sums.append(q[ok].sum(dtype=np.float64))
+                counts.append(ok.sum())
+            return np.array(sums), np.array(counts)
+        total = np.zeros(self.shape[1], np.float64)
+        count = np.zeros(self.shape[1], np.int64)
+        for q in self.iter_rows():
+            ok = ~np.isnan(q)
+            total[ok] += q[ok]
+            count += ok
+        if axis is None:
+            return total.sum(), count.sum()
+        return total, count
+
+    def sum(self, axis=None):
+        """Returns the sum of streamflow in float64, with axis as for max."""
+
+        return self._sum_count(axis)[0]
+
+    def mean(self, axis=None):
+        """Returns mean streamflow in float64, with axis as for max.
+
+        The mean is NaN where every value is missing.
+        """
+
+        total, count = self._sum_count(axis)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return total / count
@@ -0,0 +1,281 @@
+#!/usr/bin/python2
+"""Downloads many model result files from NOAA or HydroShare at once.
+
+A complete long range forecast is hundreds of files. This module downloads a
+list of files over several connections at once, skips files that were already
+downloaded, and resumes partially downloaded files where they left off.
+
+Files are first written with a .part extension and renamed once complete, so
+an interrupted run never leaves a truncated file under the final name.
+
+Example:
+    >>> from pynwm import download, noaa_nwm
+    >>> files = noaa_nwm.list_files('nwm.20160928', 'long_range')
+    >>> results = download.download_files(files, 'nwm_files', workers=8,
+                                          decompress=True)
+    >>> failed = [r for r in results if r['status'] == 'failed']
+"""
+
+import ftplib
+from ftplib import FTP
+from multiprocessing.pool import ThreadPool
+import os
+import threading
+import urllib
+import urllib2
+import urlparse
+
+from pynwm import instrument
+from pynwm import ncfiles
+from pynwm import noaa_nwm
+from pynwm import nwm
+
+_chunk_size = 1024 * 1024
+
+
+def _get_uri(source):
+    """Returns the URI for a file path, HydroShare filename or crawl record."""
+
+    if isinstance(source, dict):
+        source = source['path']
+    if source.startswith(('ftp://', 'http://', 'https://')):
+        return source
+    if source.startswith('/'):
+        return 'ftp://{0}:{1}{2}'.format(noaa_nwm._ftp_url,
+                                         noaa_nwm._ftp_port, source)
+    return (nwm._hydroshare_url + 'nwm-data-explorer/api/'
+            'GetFile?file={0}').format(urllib.quote(source))
+
+
+def _get_filename(uri):
+    parts = urlparse.urlsplit(uri)
+    if parts.scheme == 'ftp':
+        return os.path.basename(parts.path)
+    query = urlparse.parse_qs(parts.query)
+    if 'file' in query:
+        return os.path.basename(query['file'][0])
+    return os.path.basename(parts.path)
+
+
+class _FtpConnections(object):
+    """FTP connections kept open per thread and host."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._all = []
+        self._lock = threading.Lock()
+
+    def get(self, host, port):
+        connections = getattr(self._local, 'connections', None)
+        if connections is None:
+            connections = self._local.connections = {}
+        ftp = connections.get((host, port))
+        if ftp is None:
+            ftp = FTP()
+            ftp.connect(host, port)
+            ftp.login()
+            ftp.voidcmd('TYPE I')
+            connections[(host, port)] = ftp
+            with self._lock:
+                self._all.append(ftp)
+        return ftp
+
+    def drop(self, host, port):
+        """Closes this thread's connection to a host, if it has one.
+
+        The next get opens a new connection, so a connection left in an
+        unknown state by a failed transfer is not used again.
+        """
+
+        connections = getattr(self._local, 'connections', None) or {}
+        ftp = connections.pop((host, port), None)
+        if ftp is None:
+            return
+        with self._lock:
+            self._all.remove(ftp)
+        ftp.close()
+
+    def close(self):
+        for ftp in self._all:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+
+
+def _ftp_size(ftp, path):
+    try:
+        return ftp.size(path)
+    except ftplib.all_errors:
+        return None
+
+
+def _download_ftp(ftp_connections, uri, part_filename):
+    """Downloads or resumes an FTP file into part_filename.
+
+    Returns:
+        Size of the remote file in bytes, or None if unknown.
+    """
+
+    parts = urlparse.urlsplit(uri)
+    ftp = ftp_connections.get(parts.hostname, parts.port or 21)
+    remote_size = _ftp_size(ftp, parts.path)
+    offset = 0
+    if os.path.isfile(part_filename):
+        offset = os.path.getsize(part_filename)
+    if remote_size is not None and offset > remote_size:
+        offset = 0
+    if remote_size is not None and offset == remote_size:
+        return remote_size
+    with open(part_filename, 'ab' if offset else 'wb') as f:
+        ftp.retrbinary('RETR {0}'.format(parts.path), f.write, _chunk_size,
+                       rest=offset or None)
+    return remote_size
+
+
+def _download_http(uri, part_filename):
+    """Downloads or resumes an HTTP file into part_filename.
+
+    Returns:
+        Size of the remote file in bytes, or None if unknown.
+    """
+
+    offset = 0
+    if os.path.isfile(part_filename):
+        offset = os.path.getsize(part_filename)
+    request = urllib2.Request(uri)
+    if offset:
+        request.add_header('Range', 'bytes={0}-'.format(offset))
+    try:
+        response = urllib2.urlopen(request)
+    except urllib2.HTTPError as ex:
+        if ex.code != 416:
+            raise
+        # The requested range starts at the end of the file, so the partial
+        # file is already complete.
+        return offset
+    if response.getcode() != 206:
+        offset = 0
+    length = response.info().getheader('Content-Length')
+    remote_size = offset + int(length) if length else None
+    with open(part_filename, 'ab' if offset else 'wb') as f:
+        while True:
+            chunk = response.read(_chunk_size)
+            if not chunk:
+                break
+            f.write(chunk)
+    return remote_size
+
+
+def _remote_size(ftp_connections, uri):
+    """Returns size in bytes of a remote file, or None if unknown."""
+
+    parts = urlparse.urlsplit(uri)
+    if parts.scheme == 'ftp':
+        ftp = ftp_connections.get(parts.hostname, parts.port or 21)
+        return _ftp_size(ftp, parts.path)
+    request = urllib2.Request(uri)
+    request.get_method = lambda: 'HEAD'
+    try:
+        length = urllib2.urlopen(request).info().getheader('Content-Length')
+    except urllib2.URLError:
+        return None
+    return int(length) if length else None
+
+
+def _download_one(ftp_connections, source, output_folder, decompress,
+                  overwrite):
+    uri = _get_uri(source)
+    filename = os.path.join(output_folder, _get_filename(uri))
+    final_filename = filename
+    if decompress and filename[-3:] == '.gz':
+        final_filename = filename[:-3]
+    result = {'source': source, 'filename': final_filename,
+              'status': None, 'error': None}
+    try:
+        if os.path.isfile(final_filename) and not overwrite:
+            # A decompressed file cannot be compared with the remote size, so
+            # its presence is enough. Model result files are never changed
+            # once published.
+            if final_filename != filename:
+                result['status'] = 'skipped'
+                return result
+            remote_size = _remote_size(ftp_connections, uri)
+            local_size = os.path.getsize(final_filename)
+            if remote_size is None or remote_size == local_size:
+                result['status'] = 'skipped'
+                return result
+
+        part_filename = filename + '.part'
+        if overwrite and os.path.isfile(part_filename):
+            os.remove(part_filename)
+        start_size = 0
+        if os.path.isfile(part_filename):
+            start_size = os.path.getsize(part_filename)
+        with instrument.stage('download'):
+            if uri.startswith('ftp://'):
+                remote_size = _download_ftp(ftp_connections, uri,
+                                            part_filename)
+            else:
+                remote_size = _download_http(uri, part_filename)
+        local_size = os.path.getsize(part_filename)
+        instrument.count('bytes_downloaded', max(local_size - start_size, 0))
+        if remote_size is not None and local_size != remote_size:
+            raise IOError('Downloaded {0} of {1} bytes for {2}'.format(
+                local_size, remote_size, uri))
+        os.rename(part_filename, filename)
+        if final_filename != filename:
+            ncfiles.gunzip(filename, final_filename + '.part')
+            os.rename(final_filename + '.part', final_filename)
+            os.remove(filename)
+        result['status'] = 'downloaded'
+    except Exception as ex:
+        result['status'] = 'failed'
+        result['error'] = ex
+        parts = urlparse.urlsplit(uri)
+        if parts.scheme == 'ftp':
+            ftp_connections.drop(parts.hostname, parts.port or 21)
+    return result
+
+
+def download_files(files, output_folder, workers=4, decompress=False,
+                   overwrite=False):
+    """Downloads model result files using several connections at once.
+
+    Args:
+        files: List of files to download. Each can be a filename including
+            FTP directory as returned by noaa_nwm.list_files, a record from
+            noaa_nwm.crawl, a filename from HydroShare's GetFileList, or a
+            full ftp, http or https URI.
+        output_folder: Path to the folder where files will be saved.
+        workers: (Optional) Number of files downloaded at the same time.
+        decompress: (Optional) True if .gz files should be unzipped after
+            downloading, keeping only the unzipped file.
+        overwrite: (Optional) True if files already downloaded should be
+            downloaded again. Otherwise they are skipped when the local size
+            matches the remote size, or, for unzipped files, when present.
+
+    Returns:
+        List of dicts in the order of files, each with source (the item from
+        files), filename (local filename), status ('downloaded', 'skipped' or
+        'failed') and error (the exception if failed, otherwise None).
+    """
+
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+    files = list(files)
+    if not files:
+        return []
+
+    ftp_connections = _FtpConnections()
+    pool = ThreadPool(max(1, min(workers, len(files))))
+    try:
+        results = pool.map(
+            lambda source: _download_one(ftp_connections, source,
+                                         output_folder, decompress, overwrite),
+            files)
+    finally:
+        pool.close()
+        pool.join()
+        ftp_connections.close()
+    return results
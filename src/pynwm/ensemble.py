@@ -0,0 +1,278 @@
+#!/usr/bin/python2
+"""Ensemble statistics across long range forecast members.
+
+The long range forecast is an ensemble: four members per cycle, or sixteen
+when the members of the last four cycles are combined as lagged members.
+This module summarizes the members at each valid time with their mean,
+spread (standard deviation) and percentiles for every river.
+
+Files are read one valid time at a time, holding only one time step of each
+member in memory, so all members never have to be loaded at once. Members
+are aligned by the valid time read from each file, so lagged members that
+start and end at different times can be combined; each valid time uses the
+members available at that time. Missing values are left out of every
+statistic, so a river missing from all members at a time gets NaN.
+
+Example:
+    >>> from pynwm import ensemble
+    >>> members = ensemble.group_members(long_range_files)
+    >>> stats = ensemble.ensemble_stats(members, comids, percentiles=[10, 90])
+    >>> stats['mean'].shape  # (number of valid times, number of COMIDs)
+"""
+
+from datetime import timedelta
+
+from netCDF4 import Dataset
+import numpy as np
+
+from pynwm import nwm
+from pynwm import scan
+
+
+def group_members(nc_files, workers=None):
+    """Groups long range files into ensemble members.
+
+    Files are grouped by the time the cycle was run and member number, using
+    scan.scan_files, so files are only opened if their filenames do not
+    include the forecast date.
+
+    Args:
+        nc_files: List of NOAA or HydroShare long range filenames, optionally
+            including folders, from one or more cycles.
+        workers: (Optional) Number of threads reading headers at once.
+
+    Returns:
+        List of members, each a list of filenames sorted by time step.
+        Members are sorted by the time the cycle was run and member number.
+
+    Raises:
+        ValueError: A filename does not describe a channel file, or its valid
+            time cannot be found.
+    """
+
+    members = {}
+    for record in scan.scan_files(nc_files, workers=workers):
+        if record['product'] is None or record['valid_time'] is None:
+            raise ValueError('Not a channel file: {0}'.format(
+                record['filename']))
+        init_time = (record['valid_time'] -
+                     timedelta(hours=record['forecast_hour']))
+        key = (init_time, record['member'])
+        members.setdefault(key, []).append(
+            (record['forecast_hour'], record['filename']))
+    return [[f for _, f in sorted(members[key])] for key in sorted(members)]
+
+
+def _stats(values, percentiles):
+    """Returns statistics over the first axis of values, ignoring NaN.
+
+    Returns:
+        Tuple of the number of values that are not NaN, mean and spread
+        (float32) and percentiles (float32, sized by number of percentiles
+        first), each NaN where there are no values.
+    """
+
+    values = np.asarray(values, np.float64)
+    present = ~np.isnan(values)
+    counts = present.sum(axis=0)
+    with np.errstate(invalid='ignore'):
+        mean = np.nansum(values, axis=0) / counts
+        spread = np.sqrt(np.nansum((values - mean) ** 2, axis=0) / counts)
+    value_percentiles = np.full((len(percentiles),) + values.shape[1:],
+                                np.nan)
+    has_values = counts > 0
+    if has_values.any():
+        value_percentiles[:, has_values] = np.nanpercentile(
+            values[:, has_values], percentiles, axis=0)
+    return (counts, mean.astype(np.float32), spread.astype(np.float32),
+            value_percentiles.astype(np.float32))
+
+
+def iter_ensemble_stats(members, comids=None, percentiles=(10, 50, 90),
+                        consistent_comid_order=True):
+    """Yields ensemble statistics for each valid time, in order.
+
+    Args:
+        members: List of members, each a list of netCDF filenames sorted by
+            valid time, e.g., as returned by group_members. Files can have .nc
+            or .gz extension.
+        comids: (Optional) List or numpy array of integers representing COMIDs
+            for the rivers to include. If None, all rivers are used in the same
+            order as the first file of the first member.
+        percentiles: (Optional) Sequence of percentiles from 0 to 100.
+        consistent_comid_order: (Optional) True if the order of COMIDs in all
+            files is the same; False otherwise.
+
+    Yields:
+        Dict with date (valid output datetime), members (number of members
+        with a file for this time), mean and spread (float32 arrays sized by
+        number of rivers) and percentiles (float32 array sized by (number of
+        percentiles, number of rivers)), NaN where all members are missing.
+    """
+
+    members = [list(m) for m in members if len(m)]
+    if not members:
+        return
+    comids, _ = nwm._prepare_comids(members[0], comids)
+
+    state = {'indices': None}
+
+    def read(nc_file):
+        indices = state['indices'] if consistent_comid_order else None
+        date, q, indices = nwm._read_q_from_file(nc_file, comids, indices)
+        state['indices'] = indices
+        return date, np.ma.getdata(q).astype(np.float32)
+
+    # The next unused time step of each member.
+    positions = [0] * len(members)
+    pending = [read(m[0]) for m in members]
+    while any(p is not None for p in pending):
+        date = min(p[0] for p in pending if p is not None)
+        current = [m for m, p in enumerate(pending)
+                   if p is not None and p[0] == date]
+        q = np.array([pending[m][1] for m in current])
+        for m in current:
+            pending[m] = None
+            positions[m] += 1
+            if positions[m] < len(members[m]):
+                pending[m] = read(members[m][positions[m]])
+        _, mean, spread, value_percentiles = _stats(q, percentiles)
+        yield {'date': date,
+               'members': len(current),
+               'mean': mean,
+               'spread': spread,
+               'percentiles': value_percentiles}
+
+
+def ensemble_stats(members, comids=None, percentiles=(10, 50, 90),
+                   consistent_comid_order=True):
+    """Returns ensemble statistics for all valid times as arrays.
+
+    Arguments are as for iter_ensemble_stats. The results for all valid times
+    are held in memory; to write statistics for many rivers to a file instead,
+    use combine_ensemble_files.
+
+    Returns:
+        Dict with dates (list of valid output datetimes), members (int array
+        of the number of members at each time), mean and spread (float32
+        arrays sized by (number of times, number of rivers)) and percentiles
+        (float32 array sized by (number of percentiles, number of times,
+        number of rivers)).
+    """
+
+    dates = []
+    counts = []
+    means = []
+    spreads = []
+    values = []
+    for step in iter_ensemble_stats(members, comids, percentiles,
+                                    consistent_comid_order):
+        dates.append(step['date'])
+        counts.append(step['members'])
+        means.append(step['mean'])
+        spreads.append(step['spread'])
+        values.append(step['percentiles'])
+    return {'dates': dates,
+            'members': np.array(counts, np.int32),
+            'mean': np.array(means),
+            'spread': np.array(spreads),
+            'percentiles': np.array(values).transpose(1, 0, 2)}
+
+
+def combine_ensemble_files(members, output_file, comids=None,
+                           percentiles=(10, 50, 90),
+                           consistent_comid_order=True, zlib=False,
+                           complevel=4):
+    """Writes ensemble statistics for each valid time to a netCDF file.
+
+    Statistics are written one valid time at a time, so memory use depends on
+    the number of rivers and members rather than the number of times.
+
+    Args:
+        members: List of members, as for iter_ensemble_stats.
+        output_file: The output netCDF file.
+        comids: (Optional) COMIDs to include, as for iter_ensemble_stats.
+        percentiles: (Optional) Sequence of percentiles from 0 to 100.
+        consistent_comid_order: (Optional) True if the order of COMIDs in all
+            files is the same; False otherwise.
+        zlib: (Optional) True if statistics should be compressed.
+        complevel: (Optional) Compression level from 1 to 9 if zlib is True.
+    """
+
+    members = [list(m) for m in members if len(m)]
+    if not members:
+        raise Exception('No files to combine')
+    comids, num_rivers = nwm._prepare_comids(members[0], comids)
+
+    with Dataset(output_file, 'w') as nc:
+        nc.createDimension('time', None)
+        nc.createDimension('station', num_rivers)
+        nc.createDimension('percentile', len(percentiles))
+
+        time_var = nc.createVariable('time', 'i', ('time',))
+        time_var.long_name = 'time'
+        time_var.standard_name = 'time'
+
+        if comids is not None:
+            comid_var = nc.createVariable('station_id', 'i', ('station',))
+            comid_var[:] = comids
+            comid_var.long_name = 'Station id'
+
+        percentile_var = nc.createVariable('percentile', 'f4',
+                                           ('percentile',))
+        percentile_var.long_name = 'Percentile of ensemble members'
+        percentile_var[:] = percentiles
+
+        count_var = nc.createVariable('member_count', 'i', ('time',))
+        count_var.long_name = 'Number of ensemble members'
+
+        q_vars = {}
+        for name, long_name, dimensions in [
+                ('mean', 'Ensemble Mean River Flow', ('time', 'station')),
+                ('spread', 'Ensemble Standard Deviation of River Flow',
+                 ('time', 'station')),
+                ('percentiles', 'Ensemble Percentiles of River Flow',
+                 ('percentile', 'time', 'station'))]:
+            var = nc.createVariable('streamflow_' + name, 'f4', dimensions,
+                                    zlib=zlib, complevel=complevel)
+            var.long_name = long_name
+            var.units = 'meter^3 / sec'
+            q_vars[name] = var
+
+        seconds_since_date = None
+        for i, step in enumerate(iter_ensemble_stats(
+                members, comids, percentiles, consistent_comid_order)):
+            if seconds_since_date is None:
+                seconds_since_date = step['date']
+                time_string = seconds_since_date.strftime('%Y-%m-%d %H:%M %Z')
+                time_var.units = 'seconds since {0}'.format(time_string)
+            time_var[i] = (step['date'] - seconds_since_date).total_seconds()
+            count_var[i] = step['members']
+            q_vars['mean'][i] = step['mean']
+            q_vars['spread'][i] = step['spread']
+            q_vars['percentiles'][:, i] = step['percentiles']
+
+
+def series_stats(series, percentiles=(10, 50, 90)):
+    """Returns ensemble statistics of series downloaded from HydroShare.
+
+    Args:
+        series: Stacked series as returned by nwm.get_streamflow with
+            stack_members=True, with 'values' sized by (number of members,
+            number of dates). Missing values (NaN) are ignored.
+        percentiles: (Optional) Sequence of percentiles from 0 to 100.
+
+    Returns:
+        Dict with dates (as in series), members (number of members with a
+        value at each date), mean and spread (float32 arrays sized by number
+        of dates) and percentiles (float32 array sized by (number of
+        percentiles, number of dates)).
+    """
+
+    counts, mean, spread, value_percentiles = _stats(series['values'],
+                                                     percentiles)
+    return {'dates': series['dates'],
+            'members': counts,
+            'mean': mean,
+            'spread': spread,
+            'percentiles': value_percentiles}
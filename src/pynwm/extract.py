@@ -0,0 +1,130 @@
+#!/usr/bin/python2
+"""Extracts streamflow for a set of rivers from many files into one table.
+
+Calling nwm.read_q_for_comids for each of hundreds of analysis files returns
+one dict per file that must be stitched together. This module reads all of
+the files in one pass, looking COMIDs up once, and returns a single table
+with a row per time step and a column per COMID, or streams the rows straight
+to a CSV file so very long histories never have to fit in memory.
+
+Example:
+    >>> from pynwm import extract
+    >>> comids = [5671187, 5670795]
+    >>> table = extract.extract_table(analysis_files, comids)
+    >>> table['dates'][0], table['values'][0]
+    >>> extract.extract_to_csv(analysis_files, comids, 'gages.csv')
+"""
+
+import numpy as np
+
+from pynwm import nwm
+
+
+def _to_datetime64(date):
+    """Returns a datetime64 in UTC without time zone for a datetime."""
+
+    if date.tzinfo is not None:
+        date = date.replace(tzinfo=None) - date.utcoffset()
+    return np.datetime64(date, 's')
+
+
+def _prepare_comids(nc_files, comids):
+    """Returns COMIDs as a numpy array, or all COMIDs of the first file.
+
+    Raises:
+        ValueError: comids is empty and the first file has no station_id
+            variable to name the columns.
+    """
+
+    comids, num_rivers = nwm._prepare_comids(nc_files, comids)
+    if comids is None:
+        raise ValueError('No COMIDs given and {0} has no station_id'.format(
+            nc_files[0]))
+    return np.ma.getdata(comids), num_rivers
+
+
+def extract_table(nc_files, comids, consistent_comid_order=True,
+                  workers=None, sort=True):
+    """Reads streamflow for a set of rivers from many files.
+
+    Args:
+        nc_files: List of netCDF filenames. Files can have .nc or .gz
+            extension.
+        comids: List or numpy array of integers representing COMIDs of the
+            rivers to extract. If None or empty, all rivers of the first file
+            are extracted.
+        consistent_comid_order: (Optional) True if the order of COMIDs in all
+            files is the same, so COMIDs are only looked up once; False
+            otherwise.
+        workers: (Optional) Number of processes used to unzip and read files
+            in parallel. If None or 1, files are read one at a time.
+        sort: (Optional) True if rows should be sorted by date; False to keep
+            the order of nc_files.
+
+    Returns:
+        Dict with dates (numpy datetime64 array of valid times in UTC), comids
+        (numpy array of COMIDs, the table's columns) and values (float32
+        array sized by (number of dates, number of COMIDs), NaN where values
+        are missing).
+
+    Raises:
+        ValueError: comids is empty and the first file has no station_id.
+    """
+
+    comids, num_rivers = _prepare_comids(nc_files, comids)
+    dates = np.empty(len(nc_files), 'datetime64[s]')
+    values = np.empty((len(nc_files), num_rivers), np.float32)
+    q_iter = nwm._iter_q_from_files(nc_files, comids, consistent_comid_order,
+                                    workers)
+    for i, (date, q) in enumerate(q_iter):
+        dates[i] = _to_datetime64(date)
+        values[i] = q
+    if sort:
+        order = np.argsort(dates, kind='mergesort')
+        dates = dates[order]
+        values = values[order]
+    return {'dates': dates, 'comids': comids, 'values': values}
+
+
+def extract_to_csv(nc_files, comids, output_file, consistent_comid_order=True,
+                   workers=None, value_format='%.6g'):
+    """Writes streamflow for a set of rivers from many files to a CSV file.
+
+    Rows are written as each file is read, in the order of nc_files, so sort
+    the files first if rows should be in date order. The first column is the
+    valid time in ISO 8601 format (UTC) and the header names each COMID.
+    Missing values are written as empty cells.
+
+    Args:
+        nc_files: List of netCDF filenames. Files can have .nc or .gz
+            extension.
+        comids: List or numpy array of integers representing COMIDs of the
+            rivers to extract. If None or empty, all rivers of the first file
+            are extracted.
+        output_file: Filename of the CSV file to write.
+        consistent_comid_order: (Optional) True if the order of COMIDs in all
+            files is the same; False otherwise.
+        workers: (Optional) Number of processes used to unzip and read files
+            in parallel. If None or 1, files are read one at a time.
+        value_format: (Optional) printf style format of streamflow values.
+
+    Returns:
+        Number of rows written, not counting the header.
+
+    Raises:
+        ValueError: comids is empty and the first file has no station_id.
+    """
+
+    comids, _ = _prepare_comids(nc_files, comids)
+    rows = 0
+    with open(output_file, 'w') as f:
+        f.write('datetime,{0}\n'.format(','.join(str(c) for c in comids)))
+        q_iter = nwm._iter_q_from_files(nc_files, comids,
+                                        consistent_comid_order, workers)
+        for date, q in q_iter:
+            cells = ['' if np.isnan(value) else value_format % value
+                     for value in q]
+            f.write('{0}Z,{1}\n'.format(_to_datetime64(date),
+                                        ','.join(cells)))
+            rows += 1
+    return rows
@@ -0,0 +1,173 @@
+#!/usr/bin/python2
+"""Records where time goes in pynwm's network, file and index operations.
+
+Stages such as HTTP requests, unzipping, netCDF reads, COMID index builds and
+date parsing are timed, and counters record bytes downloaded and cache hits.
+Each measurement is sent as an event dict to the sinks that were added:
+a StatsSink to total them, a LoggingSink to log them, or any callable.
+
+Instrumentation is off until enable is called. While off, each instrumented
+stage costs one function call and a flag check.
+
+Work done in worker processes (workers > 1) is not reported to sinks in the
+calling process.
+
+Example:
+    >>> from pynwm import instrument, nwm
+    >>> stats = instrument.StatsSink()
+    >>> instrument.enable(stats)
+    >>> nwm.combine_files(files, 'combined.nc', comids)
+    >>> instrument.disable()
+    >>> for name, s in sorted(stats.stages.iteritems()):
+            print name, s['count'], s['seconds']
+    >>> stats.counters['bytes_unzipped']
+"""
+
+import logging
+import threading
+import time
+
+enabled = False
+_sinks = []
+
+
+def add_sink(sink):
+    """Adds a sink, a callable taking one event dict.
+
+    Stage events have type 'stage', name and seconds. Counter events have
+    type 'counter', name and value.
+    """
+
+    _sinks.append(sink)
+
+
+def remove_sink(sink):
+    """Removes a sink added by add_sink."""
+
+    _sinks.remove(sink)
+
+
+def enable(sink=None):
+    """Turns instrumentation on, optionally adding a sink first."""
+
+    global enabled
+    if sink is not None:
+        add_sink(sink)
+    enabled = True
+
+
+def disable():
+    """Turns instrumentation off. Sinks are kept for the next enable."""
+
+    global enabled
+    enabled = False
+
+
+def _emit(event):
+    for sink in _sinks:
+        sink(event)
+
+
+class _Stage(object):
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _emit({'type': 'stage', 'name': self.name,
+               'seconds': time.time() - self.start})
+
+
+class _NullStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+
+_null_stage = _NullStage()
+
+
+def stage(name):
+    """Returns a context manager that times the code it wraps.
+
+    Example:
+        >>> with instrument.stage('gunzip'):
+                ncfiles.gunzip(gz, out)
+    """
+
+    if not enabled:
+        return _null_stage
+    return _Stage(name)
+
+
+def count(name, value=1):
+    """Adds value to a counter, e.g., count('bytes_downloaded', 1024)."""
+
+    if enabled:
+        _emit({'type': 'counter', 'name': name, 'value': value})
+
+
+class StatsSink(object):
+    """Sink that totals events in memory.
+
+    Attributes:
+        stages: Dict of stage name to dict of count, seconds (total) and
+            max_seconds.
+        counters: Dict of counter name to total value.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Clears all totals."""
+
+        with self._lock:
+            self.stages = {}
+            self.counters = {}
+
+    def __call__(self, event):
+        with self._lock:
+            if event['type'] == 'stage':
+                stats = self.stages.get(event['name'])
+                if stats is None:
+                    stats = {'count': 0, 'seconds': 0.0, 'max_seconds': 0.0}
+                    self.stages[event['name']] = stats
+                stats['count'] += 1
+                stats['seconds'] += event['seconds']
+                stats['max_seconds'] = max(stats['max_seconds'],
+                                           event['seconds'])
+            else:
+                self.counters[event['name']] = (
+                    self.counters.get(event['name'], 0) + event['value'])
+
+
+class LoggingSink(object):
+    """Sink that logs each event.
+
+    Args:
+        logger: (Optional) Logger to use. Defaults to the 'pynwm' logger.
+        level: (Optional) Logging level of messages.
+    """
+
+    def __init__(self, logger=None, level=logging.DEBUG):
+        self.logger = logger or logging.getLogger('pynwm')
+        self.level = level
+
+    def __call__(self, event):
+        if event['type'] == 'stage':
+            self.logger.log(self.level, '%s took %.6f s', event['name'],
+                            event['seconds'])
+        else:
+            self.logger.log(self.level, '%s += %s', event['name'],
+                            event['value'])
@@ -0,0 +1,150 @@
+#!/usr/bin/python2
+"""Helpers for working with National Water Model result files on disk.
+
+NOAA distributes model results as gzipped netCDF files. netCDF4 cannot read
+gzipped files directly, so they are decompressed to a temporary file first.
+Decompression is done in fixed-size chunks so memory use does not depend on
+the size of the file, and each temporary file gets a unique name so concurrent
+processes reading the same file never overwrite each other.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+import gzip
+import os
+import re
+import shutil
+import tempfile
+
+from dateutil import parser as date_parser
+import pytz
+
+from pynwm import instrument
+
+_chunk_size = 1024 * 1024
+_filename_pattern = re.compile(
+    r'nwm\.(?:[0-9]{8}\.)?t(?P<cycle>[0-9]{2})z\.(?P<product>[a-z_]+?)'
+    r'\.channel_rt(?:_(?P<member>[0-9]+))?'
+    r'\.(?P<step_type>f|tm)(?P<step>[0-9]+)\.')
+_date_pattern = re.compile(r'nwm\.(?P<date>[0-9]{8})[./]')
+_valid_time_format = '%Y-%m-%d_%H:%M:%S'
+
+
+def gunzip(gz_filename, out_filename, chunk_size=_chunk_size):
+    """Decompresses a gzip file to a new file in bounded-size chunks.
+
+    Args:
+        gz_filename: Filename of the gzipped input file.
+        out_filename: Filename for the decompressed output file.
+        chunk_size: (Optional) Number of bytes decompressed at a time.
+    """
+
+    with instrument.stage('gunzip'):
+        with gzip.open(gz_filename, 'rb') as zipped:
+            with open(out_filename, 'wb') as unzipped:
+                shutil.copyfileobj(zipped, unzipped, chunk_size)
+                instrument.count('bytes_unzipped', unzipped.tell())
+
+
+@contextmanager
+def unzipped(nc_file):
+    """Provides a readable netCDF filename for a .nc or .gz file.
+
+    Files ending in .gz are decompressed to a uniquely named file in the
+    system temporary folder, which is removed when the context exits. Other
+    files are passed through unchanged.
+
+    Args:
+        nc_file: Filename of a netCDF file, which may be gzipped.
+
+    Yields:
+        Filename of an uncompressed netCDF file.
+
+    Example:
+        >>> gz_file = 'nwm.t00z.short_range.channel_rt.f001.conus.nc.gz'
+        >>> with ncfiles.unzipped(gz_file) as f:
+                with Dataset(f, 'r') as nc:
+                    print nc.model_output_valid_time
+    """
+
+    if nc_file[-3:] != '.gz':
+        yield nc_file
+        return
+    suffix = '_' + os.path.basename(nc_file)[:-3]
+    fd, tmpfile = tempfile.mkstemp(suffix=suffix)
+    os.close(fd)
+    try:
+        gunzip(nc_file, tmpfile)
+        yield tmpfile
+    finally:
+        if os.path.isfile(tmpfile):
+            os.remove(tmpfile)
+
+
+def parse_valid_time(text):
+    """Returns a model_output_valid_time string as UTC datetime.
+
+    Valid times are written as e.g. 2016-09-28_06:00:00, which is parsed with
+    a fixed format. Other formats fall back to the slower dateutil parser.
+
+    Args:
+        text: Value of a model_output_valid_time attribute.
+
+    Returns:
+        Timezone-aware datetime in UTC.
+    """
+
+    with instrument.stage('parse_valid_time'):
+        try:
+            date = datetime.strptime(text, _valid_time_format)
+        except ValueError:
+            date = date_parser.parse(text.replace('_', ' '))
+    return date.replace(tzinfo=pytz.utc)
+
+
+def read_valid_time(nc):
+    """Returns the model_output_valid_time of an open dataset as UTC datetime.
+
+    Args:
+        nc: Open netCDF4 Dataset of a model result file.
+
+    Returns:
+        Timezone-aware datetime in UTC.
+    """
+
+    return parse_valid_time(nc.model_output_valid_time)
+
+
+def parse_filename(filename):
+    """Returns the model product and time step described by a filename.
+
+    Works with NOAA filenames, e.g.,
+    nwm.20160928/long_range_mem1/nwm.t00z.long_range.channel_rt_1.f006.conus.nc.gz
+    and HydroShare filenames, e.g.,
+    analysis_assim-nwm.20160526.t00z.analysis_assim.channel_rt.tm00.conus.nc_georeferenced.nc
+
+    Args:
+        filename: Filename, optionally including the folders containing it.
+
+    Returns:
+        Dict with product (e.g., 'long_range'), date (forecast date string in
+        YYYYMMDD format, or None if the filename and folders do not include
+        it), cycle (hour of the day the model was run, as int), member (long
+        range member as int, or None) and forecast_hour (hours after the cycle,
+        as int; analysis files count back from the cycle and are 0 or
+        negative). Returns None if the filename is not a channel file.
+    """
+
+    match = _filename_pattern.search(os.path.basename(filename))
+    if not match:
+        return None
+    date_match = _date_pattern.search(filename)
+    step = int(match.group('step'))
+    member = match.group('member')
+    if match.group('step_type') == 'tm':
+        step = -step
+    return {'product': match.group('product'),
+            'date': date_match.group('date') if date_match else None,
+            'cycle': int(match.group('cycle')),
+            'member': int(member) if member else None,
+            'forecast_hour': step}
@@ -10,18 +10,50 @@ series retrieval functionality, so this script is most useful if you want the
 latest model results for a given time stamp across several river features.
 """
 
+import ftplib
 from ftplib import FTP
+import logging
+from multiprocessing.pool import ThreadPool
 import os
-import gzip
+import threading
 import urllib
 
+from pynwm import instrument
+from pynwm import ncfiles
+
 _ftp_url = 'ftpprd.ncep.noaa.gov'
+_ftp_port = 21
 _root_folder = '/pub/data/nccf/com/nwm/prod/'
 _long_range_products = ['long_range_mem1', 'long_range_mem2',
                         'long_range_mem3', 'long_range_mem4']
 _all_products = (['analysis_assim', 'short_range', 'medium_range'] +
                  _long_range_products)
 
+# Hours between model cycles and the last time step of each cycle. A product
+# folder is complete once the last time step of the last cycle of the day is
+# present.
+_product_schedules = {'analysis_assim': (1, 'tm00'),
+                      'short_range': (1, 'f015'),
+                      'medium_range': (6, 'f240')}
+_product_schedules.update({p: (6, 'f720') for p in _long_range_products})
+
+# Channel filenames listed in each FTP folder, and the folders known to be
+# complete, which are not listed again while their date folder is available.
+_folder_listings = {}
+_complete_folders = set()
+_listing_lock = threading.Lock()
+
+_logger = logging.getLogger('pynwm')
+
+
+def _connect():
+    """Returns an FTP connection logged in to NOAA's server."""
+
+    ftp = FTP()
+    ftp.connect(_ftp_url, _ftp_port)
+    ftp.login()
+    return ftp
+
 
 def get_datefolders():
     """Returns a list of available folders from NOAA's FTP server.
@@ -33,10 +65,244 @@ def get_datefolders():
         List of folder names, e.g., ['nwm.20160927', 'nwm.20160928']
     """
 
-    ftp = FTP(_ftp_url)
-    ftp.login()
+    ftp = _connect()
     ftp.cwd(_root_folder)
-    return sorted(ftp.nlst())
+    datefolders = sorted(ftp.nlst())
+    ftp.quit()
+    return datefolders
+
+
+def _get_products(products):
+    """Returns NOAA product folder names for the products given."""
+
+    if not products:
+        return list(_all_products)
+    elif isinstance(products, basestring):
+        products = {products.lower()}
+    else:
+        products = {p.lower() for p in products}
+    if 'long_range' in products:
+        products.remove('long_range')
+        products |= set(_long_range_products)
+    return [p for p in _all_products if p in products]
+
+
+def _is_folder_complete(product, filenames):
+    cycle_hours, last_step = _product_schedules[product]
+    last_cycle = 24 - cycle_hours
+    for filename in filenames:
+        parsed = ncfiles.parse_filename(filename)
+        if (parsed and parsed['cycle'] == last_cycle and
+                '.{0}.'.format(last_step) in filename):
+            return True
+    return False
+
+
+def _list_folders(folders, workers):
+    """Lists channel files in FTP folders using parallel connections.
+
+    Returns:
+        Dict of folder to list of filenames, or to None if the folder could
+        not be listed.
+    """
+
+    local = threading.local()
+    connections = []
+    connections_lock = threading.Lock()
+
+    def list_folder(folder):
+        try:
+            ftp = getattr(local, 'ftp', None)
+            if ftp is None:
+                ftp = _connect()
+                local.ftp = ftp
+                with connections_lock:
+                    connections.append(ftp)
+            with instrument.stage('ftp_list'):
+                ftp.cwd(folder)
+                filenames = ftp.nlst()
+            return folder, [f for f in filenames if 'channel' in f]
+        except ftplib.all_errors as ex:
+            _logger.warning('Could not list %s: %r', folder, ex)
+            # The connection may be unusable, so the next folder listed by
+            # this thread opens a new one.
+            ftp = getattr(local, 'ftp', None)
+            if ftp is not None:
+                local.ftp = None
+                with connections_lock:
+                    connections.remove(ftp)
+                ftp.close()
+            return folder, None
+
+    pool = ThreadPool(max(1, min(workers, len(folders))))
+    try:
+        listings = dict(pool.map(list_folder, folders))
+    finally:
+        pool.close()
+        pool.join()
+        for ftp in connections:
+            try:
+                ftp.quit()
+            except ftplib.all_errors:
+                ftp.close()
+    return listings
+
+
+def _forget_removed_folders(available):
+    """Drops kept listings of date folders no longer on the server.
+
+    Must be called holding _listing_lock.
+    """
+
+    for folder in list(_folder_listings):
+        if folder[len(_root_folder):].split('/')[0] not in available:
+            del _folder_listings[folder]
+            _complete_folders.discard(folder)
+
+
+def _list_listings(datefolders, products, workers):
+    """Returns current listings of product folders, using the kept listings.
+
+    The date folders on the server are listed first, so folders NOAA has
+    removed are forgotten and not listed, even if they were complete.
+
+    Returns:
+        Dict of folder to tuple of datefolder, product and list of filenames,
+        or None if the folder could not be listed or its date folder is not
+        on the server.
+    """
+
+    available = set(get_datefolders())
+    if not datefolders:
+        datefolders = available
+    elif isinstance(datefolders, basestring):
+        datefolders = [datefolders]
+    datefolders = sorted({f.lower() for f in datefolders})
+    products = _get_products(products)
+
+    folders = {}
+    for datefolder in datefolders:
+        for product in products:
+            folder = '{0}{1}/{2}'.format(_root_folder, datefolder, product)
+            folders[folder] = (datefolder, product)
+
+    with _listing_lock:
+        _forget_removed_folders(available)
+        to_list = [f for f in sorted(folders) if f not in _complete_folders and
+                   folders[f][0] in available]
+    listings = _list_folders(to_list, workers) if to_list else {}
+    with _listing_lock:
+        for folder, filenames in listings.iteritems():
+            if filenames is None:
+                continue
+            _folder_listings[folder] = filenames
+            if _is_folder_complete(folders[folder][1], filenames):
+                _complete_folders.add(folder)
+        return {f: folders[f] + (_folder_listings.get(f),) for f in folders}
+
+
+def _to_records(listings, seen=None):
+    """Returns records of listed files sorted by path.
+
+    Args:
+        listings: Dict as returned by _list_listings.
+        seen: (Optional) Dict of folder to set of filenames to leave out.
+    """
+
+    records = []
+    for folder, (datefolder, product, filenames) in listings.iteritems():
+        filenames = filenames or []
+        if seen is not None:
+            filenames = set(filenames) - seen.get(folder, set())
+        for filename in filenames:
+            record = ncfiles.parse_filename(
+                '{0}/{1}'.format(datefolder, filename))
+            if record is None:
+                continue
+            record['path'] = '{0}/{1}'.format(folder, filename)
+            record['datefolder'] = datefolder
+            record['folder_product'] = product
+            records.append(record)
+    return sorted(records, key=lambda r: r['path'])
+
+
+def crawl(datefolders=None, products=None, workers=4):
+    """Returns records describing model result files on NOAA's FTP server.
+
+    Folders are listed over several FTP connections at once. Listings are
+    kept between calls, and folders whose last cycle is complete are not
+    listed again until their date folder is removed from the server.
+
+    Args:
+        datefolders: (Optional) List of datefolders or string of a single
+            date folder to crawl, e.g., ['nwm.20160927', 'nwm.20160928'].
+            If not provided, all available date folders are crawled.
+        products: (Optional) List of NWM products or string of a single
+            product to find, as for list_files. If not provided, all products
+            are returned.
+        workers: (Optional) Number of FTP connections used at once.
+
+    Returns:
+        List of dicts sorted by path. Each dict includes path (filename
+        including FTP directory), datefolder, folder_product (e.g.,
+        'long_range_mem1'), and the product, date, cycle, member and
+        forecast_hour parsed from the filename by ncfiles.parse_filename.
+    """
+
+    return _to_records(_list_listings(datefolders, products, workers))
+
+
+class Crawler(object):
+    """Crawls NOAA's FTP server, remembering the files it has returned.
+
+    Folder listings are shared with crawl and other crawlers, but the files
+    already returned are kept by each crawler, so new_only is not affected by
+    other callers.
+
+    Attributes:
+        products: List of NOAA product folder names crawled.
+        workers: Number of FTP connections used at once.
+    """
+
+    def __init__(self, products=None, workers=4):
+        """Creates a crawler.
+
+        Args:
+            products: (Optional) List of NWM products or string of a single
+                product to find, as for list_files. If not provided, all
+                products are crawled.
+            workers: (Optional) Number of FTP connections used at once.
+        """
+
+        self.products = _get_products(products)
+        self.workers = workers
+        self._seen = {}
+
+    def crawl(self, datefolders=None, new_only=False):
+        """Returns records describing model result files, as for crawl.
+
+        Args:
+            datefolders: (Optional) List of datefolders or string of a single
+                date folder to crawl. If not provided, all available date
+                folders are crawled.
+            new_only: (Optional) True if only files not returned by earlier
+                calls of this crawler should be returned.
+        """
+
+        listings = _list_listings(datefolders, self.products, self.workers)
+        records = _to_records(listings, self._seen if new_only else None)
+        for folder, (_, _, filenames) in listings.iteritems():
+            if filenames:
+                self._seen.setdefault(folder, set()).update(filenames)
+        return records
+
+
+def clear_listing_cache():
+    """Forgets folder listings kept by crawl."""
+
+    with _listing_lock:
+        _folder_listings.clear()
+        _complete_folders.clear()
 
 
 def list_files(datefolders=None, products=None):
@@ -68,38 +334,7 @@ def list_files(datefolders=None, products=None):
         List of filenames including directory of available files.
     """
 
-    if not datefolders:
-        datefolders = get_datefolders()
-    elif type(datefolders) is str:
-        datefolders = [datefolders]
-    datefolders = sorted({f.lower() for f in datefolders})
-    if not products:
-        products = _all_products
-    elif type(products) is str:
-        products = [products.lower()]
-    else:
-        products = {p.lower() for p in products}
-    if 'long_range' in products:
-        products.remove('long_range')
-        products |= set(_long_range_products)
-    products = [p for p in products if p in _all_products]
-
-    ftp = FTP(_ftp_url)
-    ftp.login()
-    ftp.cwd(_root_folder)
-    all_files = []
-    for datefolder in datefolders:
-        for product in products:
-            folder = '{0}/{1}/{2}'.format(_root_folder, datefolder, product)
-            try:
-                ftp.cwd(folder)
-                files = ['{0}/{1}'.format(folder, f) for f in ftp.nlst()
-                         if 'channel' in f]
-                all_files.extend(files)
-            except Exception as ex:
-                print str(ex)
-            break
-    return all_files
+    return [record['path'] for record in crawl(datefolders, products)]
 
 
 def get_latest_analysis_filename():
@@ -113,8 +348,7 @@ def get_latest_analysis_filename():
         Filename, including FTP directory, of the file.
     """
 
-    ftp = FTP(_ftp_url)
-    ftp.login()
+    ftp = _connect()
     ftp.cwd(_root_folder)
 
     filename = None
@@ -148,8 +382,6 @@ def get_latest_analysis_file(output_folder):
     zip_filename = os.path.join(output_folder, uri.split('/')[-1])
     urllib.urlretrieve(uri, zip_filename)
     nc_filename = zip_filename[:-3]
-    with gzip.open(zip_filename, 'rb') as zipped:
-        with open(nc_filename, 'wb') as unzipped:
-            unzipped.write(zipped.read())
+    ncfiles.gunzip(zip_filename, nc_filename)
     os.remove(zip_filename)
     return nc_filename
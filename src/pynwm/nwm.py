@@ -33,26 +33,58 @@ API into the National Water Model archive.
 """
 
 from datetime import datetime, timedelta
-import gzip
 import json
+import multiprocessing
+from multiprocessing.sharedctypes import RawArray
 import os
+from multiprocessing.pool import ThreadPool
 import re
-import tempfile
 import urllib
 from urllib2 import HTTPError
 
 from dateutil import parser as date_parser
 import pytz
-from netCDF4 import Dataset
+from netCDF4 import Dataset, default_fillvals
 import numpy as np
 
+from pynwm import cache
+from pynwm import comid_index
+from pynwm import connections
+from pynwm import instrument
+from pynwm import ncfiles
+from pynwm import reductions as reduction_stats
 
-def get_latest_analysis_filename():
-    uri = ('https://apps.hydroshare.org/apps/nwm-data-explorer/api/'
+_hydroshare_url = 'https://apps.hydroshare.org/apps/'
+
+# File lists and folder contents from HydroShare. Set listing_cache.ttl to
+# change how long responses are reused, or listing_cache.cache_dir to share
+# them between processes.
+listing_cache = cache.TTLCache(ttl=300)
+
+
+def _get_listing(uri):
+    """Returns response text for a HydroShare listing, using listing_cache."""
+
+    response = listing_cache.get(uri)
+    if response is None:
+        instrument.count('listing_cache_misses')
+        response = connections.get(uri)
+        listing_cache.set(uri, response)
+    else:
+        instrument.count('listing_cache_hits')
+    return response
+
+
+def _get_analysis_filenames():
+    """Returns names of analysis and assimilation files on HydroShare."""
+
+    uri = (_hydroshare_url + 'nwm-data-explorer/api/'
            'GetFileList/?config=analysis_assim&geom=channel')
-    response = urllib.urlopen(uri).read()
-    files = json.loads(response)
-    return files[-1]
+    return json.loads(_get_listing(uri))
+
+
+def get_latest_analysis_filename():
+    return _get_analysis_filenames()[-1]
 
 
 def get_latest_analysis_file(output_folder):
@@ -69,7 +101,7 @@ def get_latest_analysis_file(output_folder):
     """
 
     filename = get_latest_analysis_filename()
-    uri = ('https://apps.hydroshare.org/apps/nwm-data-explorer/api/'
+    uri = (_hydroshare_url + 'nwm-data-explorer/api/'
            'GetFile?file={0}').format(filename)
     output_filename = os.path.join(output_folder, filename)
     urllib.urlretrieve(uri, output_filename)
@@ -84,10 +116,7 @@ def _get_date_from_analysis_filename(filename):
 def get_analysis_bounding_dates():
     """Returns dates of earliest and latest available analysis files."""
 
-    uri = ('https://apps.hydroshare.org/apps/nwm-data-explorer/api/'
-           'GetFileList/?config=analysis_assim&geom=channel')
-    response = urllib.urlopen(uri).read()
-    files = json.loads(response)
+    files = _get_analysis_filenames()
     start_date = _get_date_from_analysis_filename(files[0])
     end_date = _get_date_from_analysis_filename(files[-1])
     return start_date, end_date
@@ -127,35 +156,47 @@ def get_latest_forecast_date(product):
     suffix_pattern = valid_products[product]['suffix_pattern']
     max_time_step = valid_products[product]['max_time_step']
 
-    # Get possible dates for which forecasts are available
-    uri_template = ('https://apps.hydroshare.org/apps/nwm-data-explorer/'
-                    'files_explorer/get-folder-contents/?selection_path=%2F'
-                    'projects%2Fwater%2Fnwm%2Fdata%2F{0}%3Ffolder&query_type='
-                    'filesystem')
-    uri = uri_template.format(product)
-    response = urllib.urlopen(uri).read()
-    possible_dates = re.findall(r'\>([0-9]+)\<', response)
-
     # If last time step is available, consider the forecast complete
-    pattern_template = (r'\>(nwm.t[0-9]+z.{product}.channel_rt{suffix}.'
-                        'f{max_time_step}.conus.nc_georeferenced.nc)\<')
+    pattern_template = (r'nwm.t[0-9]+z.{product}.channel_rt{suffix}.'
+                        'f{max_time_step}.conus.nc_georeferenced.nc$')
     pattern = pattern_template.format(
         product=product, suffix=suffix_pattern, max_time_step=max_time_step)
 
-    for folder_date in reversed(possible_dates):
-        uri = uri_template.format(product + '%2F' + folder_date)
-        response = urllib.urlopen(uri).read()
-        matches = re.findall(pattern, response)
+    for folder_date in reversed(_list_forecast_dates(product)):
+        matches = [f for f in _list_forecast_folder(product, folder_date)
+                   if re.match(pattern, f)]
         if product == 'long_range' and len(matches) == 16:
             return date_parser.parse(folder_date)
         elif product != 'long_range' and len(matches):
             return date_parser.parse(folder_date + 't' + matches[-1][5:7])
 
 
-def _get_netcdf_data_response_to_json(uri, response):
+def _get_forecast_folder_uri(path):
+    uri_template = (_hydroshare_url + 'nwm-data-explorer/'
+                    'files_explorer/get-folder-contents/?selection_path=%2F'
+                    'projects%2Fwater%2Fnwm%2Fdata%2F{0}%3Ffolder&query_type='
+                    'filesystem')
+    return uri_template.format(path)
+
+
+def _list_forecast_dates(product):
+    """Returns forecast date folder names on HydroShare, e.g., '20160928'."""
+
+    response = _get_listing(_get_forecast_folder_uri(product))
+    return re.findall(r'\>([0-9]+)\<', response)
+
+
+def _list_forecast_folder(product, folder_date):
+    """Returns filenames in a HydroShare forecast date folder."""
+
+    uri = _get_forecast_folder_uri(product + '%2F' + folder_date)
+    response = _get_listing(uri)
+    return re.findall(r'\>(nwm\.t[^<>]+)\<', response)
+
+
+def _get_netcdf_data_response_to_json(uri, text):
     """Loads JSON from response to HydroShare get-netcdf-data request."""
 
-    text = response.read()
     if 'Internal Server Error' in text:
         raise HTTPError(uri, 500, 'Internal Server Error', None, None)
     response_obj = json.loads(text)
@@ -169,8 +210,12 @@ def _get_netcdf_data_response_to_json(uri, response):
     return data
 
 
-def _unpack_series(json_data, product):
-    """Returns a list of time series from HydroShare get-netcdf-data JSON."""
+def _unpack_series(json_data, product, as_arrays=False):
+    """Returns a list of time series from HydroShare get-netcdf-data JSON.
+
+    If as_arrays is True, dates are a numpy datetime64 array in UTC and values
+    are a float32 array, both built without per-element Python objects.
+    """
 
     if product == 'analysis_assim':
         time_step_hrs = 1
@@ -193,13 +238,19 @@ def _unpack_series(json_data, product):
         if not len(sim_result[1]):
             raise ValueError('Empty result set. Try adjusting input '
                              'parameters')
-        model_init_time = datetime.utcfromtimestamp(sim_result[0][0]).replace(
-            tzinfo=pytz.utc)
-        start_date = model_init_time + timedelta(hours=offset_hrs)
         value_count = len(sim_result[1])
         series_count = len(sim_result) - 2
-        dates = [start_date + timedelta(hours=i*time_step_hrs)
-                 for i in range(value_count)]
+        if as_arrays:
+            start_date = np.datetime64(
+                int(sim_result[0][0]) + offset_hrs * 3600, 's')
+            dates = start_date + (np.arange(value_count) *
+                                  np.timedelta64(time_step_hrs, 'h'))
+        else:
+            model_init_time = datetime.utcfromtimestamp(
+                sim_result[0][0]).replace(tzinfo=pytz.utc)
+            start_date = model_init_time + timedelta(hours=offset_hrs)
+            dates = [start_date + timedelta(hours=i*time_step_hrs)
+                     for i in range(value_count)]
 
         label = sim_result[-1]
 
@@ -209,13 +260,56 @@ def _unpack_series(json_data, product):
             else:
                 name = product
 
+            if as_arrays:
+                value_list = np.array(value_list, dtype=np.float32)
             series_list.append({'name': name,
                                 'dates': dates,
                                 'values': value_list})
     return series_list
 
 
-def get_streamflow(product, comid, sim_datetime_utc=None, timezone=None):
+def _stack_series(series_list, product):
+    """Combines array series into one series with a members x time array.
+
+    Members that start at different times, such as long range lag runs, are
+    aligned on the union of their dates, with NaN where a member has no value.
+    """
+
+    dates = np.unique(np.concatenate([s['dates'] for s in series_list]))
+    values = np.empty((len(series_list), len(dates)), dtype=np.float32)
+    values.fill(np.nan)
+    for i, series in enumerate(series_list):
+        values[i, np.searchsorted(dates, series['dates'])] = series['values']
+    return {'name': product,
+            'members': [s['name'] for s in series_list],
+            'dates': dates,
+            'values': values}
+
+
+def _localize_datetime64(dates, tz):
+    """Shifts a UTC datetime64 array to local wall-clock time in tz.
+
+    A single offset is applied when the series does not cross a daylight
+    saving transition, which is true for all but a few series a year.
+    """
+
+    if not len(dates):
+        return dates
+
+    def offset(date64):
+        seconds = int(date64.astype('datetime64[s]').astype(np.int64))
+        utc = datetime.utcfromtimestamp(seconds).replace(tzinfo=pytz.utc)
+        return int(utc.astimezone(tz).utcoffset().total_seconds())
+
+    first = offset(dates[0])
+    if first == offset(dates[-1]):
+        return dates + np.timedelta64(first, 's')
+    offsets = np.array([offset(d) for d in dates]).astype('timedelta64[s]')
+    return dates + offsets
+
+
+def get_streamflow(product, comid, sim_datetime_utc=None, timezone=None,
+                   as_arrays=False, stack_members=False):
     """Downloads time seies from National Water Model for a given river.
 
     Downloads streamflow time series for a given river feature using the
@@ -234,6 +328,14 @@ def get_streamflow(product, comid, sim_datetime_utc=None, timezone=None):
         timezone: (Optional) Text or timezone instance describing time zone if
             time series should be temporally shifted, e.g., 'America/Chicago'.
             Otherwise, UTC time as returned from HydroShare is used.
+        as_arrays: (Optional) True if each series should have dates as a
+            numpy datetime64 array and values as a float32 array instead of
+            lists. Array dates carry no time zone; they are local wall-clock
+            time if timezone is given, otherwise UTC.
+        stack_members: (Optional) True if all series should be combined into
+            a single array series, with 'values' sized by (number of members,
+            number of dates) and 'members' listing member names. Implies
+            as_arrays. Useful for long_range ensembles.
 
     Returns:
         A list of dicts representing time series. Each series includes name,
@@ -243,6 +345,13 @@ def get_streamflow(product, comid, sim_datetime_utc=None, timezone=None):
          'dates': ['2016-06-02 01:00:00+00:00', '2016-06-02 02:00:00+00:00']
          'values': [257.2516, 1295.7293]}
 
+        With stack_members, the list holds a single series. For example:
+
+        {'name': 'long_range',
+         'members': ['Member 1 t00z', 'Member 2 t00z', ...],
+         'dates': array(['2016-06-19T06:00:00', ...], dtype='datetime64[s]'),
+         'values': array([[140.3379, ...], ...], dtype=float32)}
+
     Raises:
         HTTPError: An error occurred accessing data from the Web service.
         ValueError: Service request returned no data, likely due to invalid
@@ -272,47 +381,153 @@ def get_streamflow(product, comid, sim_datetime_utc=None, timezone=None):
         16-06-21 21 	105.781
     """
 
+    sim_datetime_utc = _get_sim_datetime(product, sim_datetime_utc)
+    return _get_streamflow_series(product, comid, sim_datetime_utc, timezone,
+                                  as_arrays, stack_members)
+
+
+def _get_sim_datetime(product, sim_datetime_utc):
+    """Returns the simulation datetime to request, looking it up if None."""
+
     if sim_datetime_utc is None and product == 'analysis_assim':
         sim_datetime_utc = get_analysis_bounding_dates()[0]
     elif sim_datetime_utc is None:
         sim_datetime_utc = get_latest_forecast_date(product)
     elif isinstance(sim_datetime_utc, basestring):
         sim_datetime_utc = date_parser.parse(sim_datetime_utc)
+    return sim_datetime_utc
+
+
+def _get_streamflow_series(product, comid, sim_datetime_utc, timezone,
+                           as_arrays=False, stack_members=False):
+    """Requests and unpacks series for one COMID and simulation datetime."""
+
     start_date = sim_datetime_utc.strftime('%Y-%m-%d')
     start_time = sim_datetime_utc.strftime('%H')
     end_date = (datetime.now() + timedelta(days=2)).strftime('%Y-%m-%d')
 
     uri_template = (
-        'https://apps.hydroshare.org/apps/nwm-forecasts/get-netcdf-data?'
+        _hydroshare_url + 'nwm-forecasts/get-netcdf-data?'
         'config={0}&geom=channel_rt&variable=streamflow&comid={1}&'
         'startDate={2}&time={3}&lag=00z%2C06z%2C12z%2C18z&endDate={4}')
     uri = uri_template.format(product, comid, start_date, start_time, end_date)
-    response = urllib.urlopen(uri)
-    json_data = _get_netcdf_data_response_to_json(uri, response)
-    series_list = _unpack_series(json_data, product)
+    response = connections.get(uri)
+    with instrument.stage('parse_json'):
+        json_data = _get_netcdf_data_response_to_json(uri, response)
+    as_arrays = as_arrays or stack_members
+    series_list = _unpack_series(json_data, product, as_arrays)
+    if stack_members:
+        series_list = [_stack_series(series_list, product)]
 
     if timezone is not None:
         if isinstance(timezone, basestring):
             tz = pytz.timezone(timezone)
         else:
             tz = timezone
+        # Series from the same simulation share one dates list or array, so
+        # each distinct one is converted only once.
+        converted = {}
         for series in series_list:
-            series['dates'] = [d.astimezone(tz) for d in series['dates']]
+            key = id(series['dates'])
+            if key not in converted:
+                if as_arrays:
+                    converted[key] = _localize_datetime64(series['dates'], tz)
+                else:
+                    converted[key] = [d.astimezone(tz)
+                                      for d in series['dates']]
+            series['dates'] = converted[key]
 
     return series_list
 
 
+def get_streamflow_many(product, comids, sim_datetime_utc=None, timezone=None,
+                        as_arrays=False, stack_members=False, workers=8):
+    """Downloads time series from National Water Model for several rivers.
+
+    Works like get_streamflow, but the simulation datetime is looked up only
+    once and requests for the COMIDs are made concurrently over reused
+    keep-alive connections. A failed request for one COMID does not stop
+    requests for the others.
+
+    Args:
+        product: String indicating model product. Valid values are:
+            analysis_assim, short_range, medium_range, long_range
+        comids: List of National Hydrography Dataset identifiers of the river
+            features.
+        sim_datetime_utc: (Optional) Date and time when the model simulation
+            was run. If None, then earliest available result datetime is used
+            if product is analysis_assim, and most current complete forecast is
+            used for all other products.
+        timezone: (Optional) Text or timezone instance describing time zone if
+            time series should be temporally shifted, e.g., 'America/Chicago'.
+            Otherwise, UTC time as returned from HydroShare is used.
+        as_arrays: (Optional) True if each series should have dates as a
+            numpy datetime64 array and values as a float32 array instead of
+            lists. Array dates carry no time zone; they are local wall-clock
+            time if timezone is given, otherwise UTC.
+        stack_members: (Optional) True if all series should be combined into
+            a single array series, with 'values' sized by (number of members,
+            number of dates) and 'members' listing member names. Implies
+            as_arrays. Useful for long_range ensembles.
+        workers: (Optional) Maximum number of requests made at the same time.
+
+    Returns:
+        A dict keyed by COMID. Each value is a dict with 'series', the list of
+        time series as returned by get_streamflow, and 'error', the exception
+        raised while getting that COMID. One of the two is always None. For
+        example:
+
+        {5671187: {'series': [{'name': 'short_range', ...}], 'error': None},
+         5670795: {'series': None, 'error': HTTPError()}}
+
+    Raises:
+        HTTPError: An error occurred looking up the simulation datetime.
+
+    Example:
+        >>> comids = [5671187, 5670795]
+        >>> results = nwm.get_streamflow_many('short_range', comids)
+        >>> for comid, result in results.iteritems():
+                if result['error'] is None:
+                    print comid, result['series'][0]['values'][:2]
+    """
+
+    sim_datetime_utc = _get_sim_datetime(product, sim_datetime_utc)
+
+    def get_one(comid):
+        try:
+            series_list = _get_streamflow_series(
+                product, comid, sim_datetime_utc, timezone, as_arrays,
+                stack_members)
+            return comid, {'series': series_list, 'error': None}
+        except Exception as ex:
+            return comid, {'series': None, 'error': ex}
+
+    comids = list(comids)
+    if not comids:
+        return {}
+    pool = ThreadPool(max(1, min(workers, len(comids))))
+    try:
+        results = pool.map(get_one, comids)
+    finally:
+        pool.close()
+        pool.join()
+    return dict(results)
+
+
 def _get_comid_indices(find_comids, nc_comids):
+    """Returns row positions of find_comids within the nc_comids array.
+
+    The sort of nc_comids is cached by comid_index, so files sharing the same
+    station_id layout are only sorted once.
+    """
+
     if type(find_comids) != 'numpy.ndarray':
         find_comids = np.array(find_comids)
-    sorted_index = nc_comids.argsort()
-    sorted_nc_comids = nc_comids[sorted_index]
-    found_index_sorted = np.searchsorted(sorted_nc_comids, find_comids)
-    index = sorted_index[found_index_sorted]
-    return index
+    index = comid_index.get_comid_index(nc_comids)
+    return index.indices(find_comids)
 
 
-def read_q_for_comids(nc_filename, comids):
+def read_q_for_comids(nc_filename, comids, variables=None):
     """Reads streamflow for a set of COMID identifiers in a given file.
 
     Reads streamflow in cubic meters per second for each river represented by
@@ -323,6 +538,9 @@ def read_q_for_comids(nc_filename, comids):
         nc_filename: Filename of input netCDF file of model results.
         comids: List or numpy array of integers representing COMIDs for the
             rivers whose streamflow value is to be returned.
+        variables: (Optional) List of names of other variables to read for
+            the same rivers, e.g., ['streamflow', 'velocity', 'q_lateral'].
+            COMIDs are looked up once for all of them.
 
     Returns:
         A dictionary with a 'flows' array of streamflow values in cubic meters
@@ -332,12 +550,19 @@ def read_q_for_comids(nc_filename, comids):
         {'flows': [10.3, 283.2, 3.6],
          'datetime': datetime.datetime(2016, 6, 21, 15, 0, tzinfo=<UTC>)}
 
+        If variables is given, 'values' is a dictionary of variable name to
+        array of values in the same order as the input COMIDs, and 'flows' is
+        only included if variables includes streamflow.
+
     Example:
         >>> filename = 'example_file.nc'
         >>> comids = [5671187, 5670795]
         >>> result = nwm.read_q_for_comids(filename, comids)
         >>> print('COMID {0}: {1} cms'.format(comids[0], result['flows'][0]))
         COMID 5671187: 3.16675 cms
+        >>> result = nwm.read_q_for_comids(filename, comids,
+                                           ['streamflow', 'velocity'])
+        >>> result['values']['velocity']
     """
 
     result = {}
@@ -349,16 +574,88 @@ def read_q_for_comids(nc_filename, comids):
         comids = np.array(comids)
 
     with Dataset(nc_filename, 'r') as nc:
-        date = date_parser.parse(nc.model_output_valid_time.replace('_', ' '))
-        date = date.replace(tzinfo=pytz.utc)
+        date = ncfiles.read_valid_time(nc)
         result['datetime'] = date
         nc_comids = nc.variables['station_id'][:]
-        nc_q = nc.variables['streamflow']
         indices = _get_comid_indices(comids, nc_comids)
-        result['flows'] = nc_q[indices]
+        if variables is None:
+            with instrument.stage('read_netcdf'):
+                result['flows'] = nc.variables['streamflow'][indices]
+            return result
+        result['values'] = {}
+        for name in variables:
+            with instrument.stage('read_netcdf'):
+                result['values'][name] = nc.variables[name][indices]
+        if 'streamflow' in result['values']:
+            result['flows'] = result['values']['streamflow']
     return result
 
 
+def _plan_row_reads(index, max_gap=4096, max_block=262144):
+    """Groups row positions into a few contiguous reads.
+
+    Reading a variable at many scattered positions can make netCDF read far
+    more than needed. Instead, positions are sorted and split into runs of
+    rows, merging runs separated by at most max_gap rows, so each run is read
+    once with a plain slice of at most max_block rows.
+
+    Args:
+        index: Numpy array of row positions, in the order values are wanted.
+        max_gap: (Optional) Largest number of unwanted rows read to avoid
+            starting a new read.
+        max_block: (Optional) Largest number of rows read at once, which
+            bounds the size of the read buffer.
+
+    Returns:
+        Tuple of the order that sorts index, the sorted positions, and a list
+        of (start, stop, first, last) runs, where rows start to stop are read
+        to fill sorted positions first to last.
+    """
+
+    order = np.argsort(index, kind='mergesort')
+    sorted_index = index[order]
+    if not len(sorted_index):
+        return order, sorted_index, []
+
+    # Split where the gap between positions is too large, then split each
+    # piece into spans of max_block rows.
+    gap_break = np.concatenate(([True], np.diff(sorted_index) > max_gap))
+    piece = np.cumsum(gap_break) - 1
+    piece_start = sorted_index[gap_break][piece]
+    block = (sorted_index - piece_start) // max_block
+    run_break = gap_break.copy()
+    run_break[1:] |= block[1:] != block[:-1]
+    firsts = np.flatnonzero(run_break)
+    lasts = np.append(firsts[1:], len(sorted_index))
+    runs = [(sorted_index[first], sorted_index[last - 1] + 1, first, last)
+            for first, last in zip(firsts, lasts)]
+    return order, sorted_index, runs
+
+
+def _read_rows(var, plan):
+    """Reads a variable at the row positions of a plan from _plan_row_reads.
+
+    Values have the type returned by reading the variable, which for packed
+    variables is the unpacked type rather than the stored one.
+
+    Returns:
+        Masked array of values in the order of the planned index.
+    """
+
+    order, sorted_index, runs = plan
+    if not runs:
+        return var[:0]
+    sorted_values = None
+    for start, stop, first, last in runs:
+        block = var[start:stop]
+        if sorted_values is None:
+            sorted_values = np.ma.empty(len(sorted_index), dtype=block.dtype)
+        sorted_values[first:last] = block[sorted_index[first:last] - start]
+    values = np.ma.empty(len(sorted_index), dtype=sorted_values.dtype)
+    values[order] = sorted_values
+    return values
+
+
 def subset_channel_file(in_nc_filename, out_nc_filename, comids,
                         just_streamflow_var=False, include_id_var=True):
     """Extracts a subset of data from an input channel file to a new file.
@@ -403,6 +700,7 @@ def subset_channel_file(in_nc_filename, out_nc_filename, comids,
             vars_to_include.remove('station_id')
         nc_comids = in_nc.variables['station_id'][:]
         index = _get_comid_indices(comids, nc_comids)
+        plan = _plan_row_reads(index)
         with Dataset(out_nc_filename, 'w', format=in_nc.data_model) as out_nc:
             out_nc.setncatts({k: in_nc.getncattr(k) for k in in_nc.ncattrs()})
 
@@ -420,14 +718,328 @@ def subset_channel_file(in_nc_filename, out_nc_filename, comids,
                     attributes = {k: var.getncattr(k) for k in var.ncattrs()
                                   if k not in attrs_to_exclude}
                     out_var.setncatts(attributes)
-                    if name == 'time':
-                        out_var[:] = var[:]
+                    if 'station' in var.dimensions:
+                        out_var[:] = _read_rows(var, plan)
                     else:
-                        out_var[:] = var[index]
+                        out_var[:] = var[:]
+
+
+def _read_q_from_file(nc_file, comids, indices=None, raw=False,
+                      variables=None):
+    """Reads valid time and streamflow from a single .nc or .gz file.
+
+    Values are returned as a plain numpy array rather than a masked array, so
+    no mask is built for each time step. Missing values are NaN, unless raw is
+    True. If variables is given, each variable is read using the same indices.
+
+    Args:
+        nc_file: Filename of a netCDF file, which may be gzipped.
+        comids: Numpy array of COMIDs to read, or None to read all rivers.
+        indices: (Optional) Row positions of comids within the file. If None,
+            positions are looked up from the file's station_id variable.
+        raw: (Optional) True if values should be returned as stored in the
+            file, without applying scale_factor and add_offset. Missing values
+            are then the stored _FillValue or missing_value, as returned by
+            read_streamflow_packing.
+        variables: (Optional) List of names of variables to read instead of
+            streamflow.
+
+    Returns:
+        Tuple of valid output datetime, streamflow array (or list of arrays in
+        the order of variables, if given), and the indices used (None if
+        comids is None).
+    """
+
+    with ncfiles.unzipped(nc_file) as path, Dataset(path, 'r') as nc:
+        date = ncfiles.read_valid_time(nc)
+        if comids is not None and indices is None:
+            if 'station_id' not in nc.variables:
+                m = ('COMIDs provided, but index to COMIDs cannot be '
+                     'built because {0} has no station_id variable')
+                raise Exception(m.format(nc_file))
+            nc_comids = nc.variables['station_id'][:]
+            indices = _get_comid_indices(comids, nc_comids)
+        values = []
+        for name in variables or ['streamflow']:
+            var = nc.variables[name]
+            var.set_auto_maskandscale(False)
+            with instrument.stage('read_netcdf'):
+                value = var[:] if comids is None else var[indices]
+            instrument.count('bytes_read', value.nbytes)
+            if not raw:
+                value = _to_float(value, _get_packing(var))
+            values.append(value)
+    q = values if variables is not None else values[0]
+    return date, q, indices
+
+
+# State shared with worker processes of build_streamflow_cube and
+# combine_files. It is set by _init_cube_worker when each process in the pool
+# starts.
+_cube_worker = {}
+
+
+def _init_cube_worker(comids, consistent_comid_order, raw=False,
+                      shared_qs=None, shape=None, dtypes=None, variables=None):
+    if shared_qs is not None:
+        _cube_worker['out_qs'] = [
+            np.frombuffer(shared_q, dtype).reshape(shape)
+            for shared_q, dtype in zip(shared_qs, dtypes)]
+    else:
+        _cube_worker['out_qs'] = None
+    _cube_worker['comids'] = comids
+    _cube_worker['consistent_comid_order'] = consistent_comid_order
+    _cube_worker['raw'] = raw
+    _cube_worker['variables'] = variables
+    _cube_worker['indices'] = None
+
+
+def _read_q_in_worker(args):
+    """Reads one file in a worker process.
+
+    If the pool was given shared arrays, values are written into them and
+    None is returned in their place.
+    """
+
+    i, nc_file = args
+    variables = _cube_worker['variables']
+    date, q, indices = _read_q_from_file(
+        nc_file, _cube_worker['comids'], _cube_worker['indices'],
+        _cube_worker['raw'], variables)
+    if _cube_worker['consistent_comid_order']:
+        _cube_worker['indices'] = indices
+    if _cube_worker['out_qs'] is not None:
+        values = q if variables is not None else [q]
+        for out_q, value in zip(_cube_worker['out_qs'], values):
+            out_q[i] = value
+        q = None
+    return i, date, q
+
+
+def _read_q_in_parallel(nc_files, comids, consistent_comid_order, num_rivers,
+                        workers, dtype=np.float64, raw=False, variables=None):
+    """Returns streamflow array and dates of files read by a process pool.
+
+    If variables is given, dtype is a list with the data type of each variable
+    and a list of arrays is returned in place of the streamflow array.
+    """
+
+    shape = (len(nc_files), num_rivers)
+    dtypes = [np.dtype(d) for d in (dtype if variables is not None
+                                    else [dtype])]
+    shared_qs = [RawArray('b', shape[0] * shape[1] * d.itemsize)
+                 for d in dtypes]
+    pool = multiprocessing.Pool(
+        workers, _init_cube_worker,
+        (comids, consistent_comid_order, raw, shared_qs, shape, dtypes,
+         variables))
+    dates = [None] * len(nc_files)
+    try:
+        for i, date, _ in pool.imap_unordered(_read_q_in_worker,
+                                              enumerate(nc_files)):
+            dates[i] = date
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+    out_qs = [np.frombuffer(shared_q, d).reshape(shape)
+              for shared_q, d in zip(shared_qs, dtypes)]
+    return (out_qs if variables is not None else out_qs[0]), dates
+
+
+def _iter_q_from_files(nc_files, comids, consistent_comid_order,
+                       workers=None, raw=False, variables=None):
+    """Yields valid time and streamflow of each file, in order.
+
+    Only a few files are held in memory at a time. If workers is more than
+    one, files are read ahead by a process pool. If variables is given, a list
+    of arrays is yielded in place of streamflow.
+    """
+
+    if workers is not None and workers > 1 and len(nc_files) > 1:
+        pool = multiprocessing.Pool(
+            min(workers, len(nc_files)), _init_cube_worker,
+            (comids, consistent_comid_order, raw, None, None, None,
+             variables))
+        try:
+            for _, date, q in pool.imap(_read_q_in_worker,
+                                        enumerate(nc_files)):
+                yield date, q
+            pool.close()
+        except BaseException:
+            pool.terminate()
+            raise
+        finally:
+            pool.join()
+    else:
+        indices = None
+        for nc_file in nc_files:
+            if not consistent_comid_order:
+                indices = None
+            date, q, indices = _read_q_from_file(nc_file, comids, indices,
+                                                 raw, variables)
+            yield date, q
+
+
+def _get_packing(var):
+    """Returns how values of an open netCDF variable are stored."""
+
+    attributes = var.ncattrs()
+    packing = {'dtype': var.dtype, 'scale_factor': 1.0, 'add_offset': 0.0,
+               '_FillValue': None, 'missing_value': None}
+    for name in ('scale_factor', 'add_offset', '_FillValue',
+                 'missing_value'):
+        if name in attributes:
+            packing[name] = var.getncattr(name)
+    return packing
+
+
+def _get_description(var):
+    """Returns the long_name and units attributes of an open variable."""
+
+    return dict((attribute, var.getncattr(attribute))
+                for attribute in ('long_name', 'units')
+                if attribute in var.ncattrs())
+
+
+def _read_layout(nc_files, comids, variables=(), raw=False, describe=False):
+    """Returns COMIDs and how variables are stored, opening one file once.
+
+    The first file is only opened if comids is empty, raw is True or describe
+    is True.
+
+    Returns:
+        Tuple of COMID array (None if comids is empty and the first file has no
+        station_id variable), number of rivers, list of packing dicts as
+        returned by read_streamflow_packing (None unless raw) and list of
+        long_name and units dicts (None unless describe), both in the order
+        of variables.
+    """
+
+    if comids is not None and len(comids) > 0:
+        if type(comids[0]) is str:
+            comids = [int(comid) for comid in comids]
+        comids = np.asarray(comids)
+        num_rivers = len(comids)
+        if not raw and not describe:
+            return comids, num_rivers, None, None
+    else:
+        comids = None
+        num_rivers = None
+    packings = descriptions = None
+    with ncfiles.unzipped(nc_files[0]) as path, Dataset(path, 'r') as nc:
+        if num_rivers is None:
+            num_rivers = len(nc.variables['streamflow'])
+            if 'station_id' in nc.variables:
+                comids = nc.variables['station_id'][:]
+        if raw:
+            packings = [_get_packing(nc.variables[name])
+                        for name in variables]
+        if describe:
+            descriptions = [_get_description(nc.variables[name])
+                            for name in variables]
+    return comids, num_rivers, packings, descriptions
+
+
+def _prepare_comids(nc_files, comids):
+    """Returns COMIDs as a numpy array, or all COMIDs of the first file.
+
+    Returns:
+        Tuple of COMID array (None if comids is empty and the first file has no
+        station_id variable) and number of rivers.
+    """
+
+    return _read_layout(nc_files, comids)[:2]
+
+
+def read_streamflow_packing(nc_file, variable='streamflow'):
+    """Returns how streamflow values are stored in a file.
+
+    Some model files store streamflow as integers that are multiplied by
+    scale_factor and added to add_offset when read. Use this to unpack values
+    read with raw=True, e.g., q * packing['scale_factor'].
+
+    Args:
+        nc_file: Filename of a netCDF file, which may be gzipped.
+        variable: (Optional) Name of the variable to describe, e.g.,
+            'velocity'.
+
+    Returns:
+        Dict with dtype (numpy dtype of stored values), scale_factor (1.0 if
+        not packed), add_offset (0.0 if not packed), _FillValue and
+        missing_value (None if not set). Stored values equal to _FillValue or
+        missing_value are missing.
+    """
+
+    with ncfiles.unzipped(nc_file) as path, Dataset(path, 'r') as nc:
+        return _get_packing(nc.variables[variable])
+
+
+def _missing(values, packing):
+    """Returns a boolean array of stored values that are missing.
+
+    Values are missing if equal to _FillValue or missing_value, or, if the
+    variable has no _FillValue, to the netCDF default fill value of its type,
+    as when netCDF4 masks values.
+    """
+
+    fill_values = []
+    if packing['_FillValue'] is not None:
+        fill_values.append(packing['_FillValue'])
+    else:
+        default_fill = default_fillvals.get(packing['dtype'].str[1:])
+        if default_fill is not None:
+            fill_values.append(default_fill)
+    if packing['missing_value'] is not None:
+        fill_values.extend(np.atleast_1d(packing['missing_value']))
+    missing = np.zeros(np.shape(values), bool)
+    for fill_value in fill_values:
+        missing |= values == np.array(fill_value, packing['dtype'])
+    return missing
+
+
+def _to_float(values, packing, dtype=None):
+    """Returns stored values scaled as netCDF4 does, with NaN where missing.
+
+    Args:
+        values: Numpy array of values as stored in the file.
+        packing: Dict as returned by read_streamflow_packing.
+        dtype: (Optional) Numpy float type of the result. If None, the type
+            netCDF4 would return is used, or float64 for unscaled integers.
+    """
+
+    missing = _missing(values, packing)
+    q = values
+    scale_factor = packing['scale_factor']
+    add_offset = packing['add_offset']
+    if scale_factor != 1.0 and add_offset != 0.0:
+        q = q * scale_factor + add_offset
+    elif scale_factor != 1.0:
+        q = q * scale_factor
+    elif add_offset != 0.0:
+        q = q + add_offset
+    if dtype is not None:
+        q = q.astype(dtype, copy=q is values)
+    elif q.dtype.kind != 'f':
+        q = q.astype(np.float64)
+    if missing.any():
+        if q is values:
+            q = q.copy()
+        q[missing] = np.nan
+    return q
+
+
+def _unpack(q, packing):
+    """Returns raw streamflow values scaled to float32, NaN where missing."""
+
+    return _to_float(q, packing, np.float32)
 
 
 def build_streamflow_cube(nc_files, comids=None, consistent_comid_order=True,
-                          compute_max=True):
+                          compute_max=True, workers=None, dtype=np.float64,
+                          raw=False, variables=None):
     """Reads streamflow from several files into a single array.
 
     Reads streamflow from several files into a single array. Each file from the
@@ -439,8 +1051,8 @@ def build_streamflow_cube(nc_files, comids=None, consistent_comid_order=True,
 
     Args:
         nc_files: List of netCDF filenames. Files can have .nc or .gz
-            extension. Zipped files are unzipped to a temporary folder and
-            deleted after use.
+            extension. Zipped files are unzipped in chunks to a uniquely named
+            temporary file and deleted after use.
         comids: (Optional) List or numpy array of integers representing COMIDs
             for the rivers whose streamflow value is to be returned. If None,
             all rivers are used in the same order as the first file provided.
@@ -449,10 +1061,24 @@ def build_streamflow_cube(nc_files, comids=None, consistent_comid_order=True,
             processing a bit.
         compute_max: (Optional) True if maximum streamflow for each river
             should be returned as an additional array; False otherwise.
+        workers: (Optional) Number of processes used to unzip and read files
+            in parallel. If None or 1, files are read one at a time in this
+            process. Results are identical either way.
+        dtype: (Optional) Numpy data type of the streamflow array. Use
+            np.float32, the type streamflow is usually stored as, to halve
+            memory use.
+        raw: (Optional) True if streamflow should be returned as stored in
+            the files, without applying scale_factor and add_offset. The
+            array then has the stored data type and dtype is ignored. Use
+            read_streamflow_packing to unpack values.
+        variables: (Optional) List of names of variables to read in one pass
+            over the files, e.g., ['streamflow', 'velocity']. If given, the
+            streamflow array and max streamflow array in the result are
+            replaced by dicts of variable name to array.
 
     Returns:
         Tuple consisting of:
-            streamflow array (float)
+            streamflow array (dtype, or the stored type if raw)
             time array (int)
             datetime object for the valid output time of the first file
             array of maximum streamflow for each river (float), or None
@@ -461,75 +1087,65 @@ def build_streamflow_cube(nc_files, comids=None, consistent_comid_order=True,
         array uses an int data type to be compatible with netCDF. The time
         values are the total number of seconds between the valid output time
         for a given file and the valid output time of the first file. The max
-        streamflow array is sized by (number of rivers).
+        streamflow array is sized by (number of rivers). Missing values are
+        NaN, or the stored _FillValue if raw, and are left out of the max.
 
     Example:
         >>> file_pattern = 'nwm.t00z.short_range.channel_rt.f00{0}.conus.nc.gz'
         >>> files = [file_pattern.format(i + 1) for i in range(15)]
         >>> comids = [5671187, 5670795]
         >>> q, t, since_date, max_q = nwm.build_streamflow_cube(files, comids)
+        >>> values, t, since_date, max_values = nwm.build_streamflow_cube(
+                files, comids, variables=['streamflow', 'velocity'])
+        >>> values['velocity'].shape
     """
 
     if not len(nc_files):
         return
-    if comids is not None and len(comids) > 0:
-        if type(comids[0]) is str:
-            comids = [int(comid) for comid in comids]
-        if type(comids) != 'numpy.ndarray':
-            comids = np.array(comids)
-        num_rivers = len(comids)
+    names = variables or ['streamflow']
+    comids, num_rivers, packings, _ = _read_layout(nc_files, comids, names,
+                                                   raw)
+    if raw:
+        dtypes = [packing['dtype'] for packing in packings]
     else:
-        comids = None
-        with Dataset(nc_files[0], 'r') as nc:
-            num_rivers = len(nc.variables['streamflow'])
-            if 'station_id' in nc.variables:
-                comids = nc.variables['station_id'][:]
+        dtypes = [dtype] * len(names)
 
-    tmpdir = tempfile.gettempdir()
-    tmpfile = None
-    indices = None
-    seconds_since_date = None
-    out_q = np.zeros((len(nc_files), num_rivers))
+    if workers is not None and workers > 1 and len(nc_files) > 1:
+        out_qs, dates = _read_q_in_parallel(
+            nc_files, comids, consistent_comid_order, num_rivers,
+            min(workers, len(nc_files)), dtypes, raw, names)
+    else:
+        dates = []
+        out_qs = [np.zeros((len(nc_files), num_rivers), d) for d in dtypes]
+        q_iter = _iter_q_from_files(nc_files, comids, consistent_comid_order,
+                                    raw=raw, variables=names)
+        for i, (date, values) in enumerate(q_iter):
+            for out_q, value in zip(out_qs, values):
+                out_q[i] = value
+            dates.append(date)
+
+    seconds_since_date = dates[0]
     out_t = np.zeros((len(nc_files), ), np.int)
-
-    no_station_msg = ('COMIDs provided, but index to COMIDs cannot be built'
-                      'because {0} has no station_id variable')
-    for i, nc_file in enumerate(nc_files):
-        if nc_file[-3:] == '.gz':
-            tmpfile = os.path.join(tmpdir, os.path.basename(nc_file)[:-3])
-            with gzip.open(nc_file, 'rb') as z, open(tmpfile, 'wb') as uz:
-                uz.write(z.read())
-            nc_file = tmpfile
-        with Dataset(nc_file, 'r') as nc:
-            date = date_parser.parse(
-                nc.model_output_valid_time.replace('_', ' '))
-            date = date.replace(tzinfo=pytz.utc)
-            if not seconds_since_date:
-                seconds_since_date = date
-            out_t[i] = (date - seconds_since_date).total_seconds()
-            if comids is None:
-                out_q[i] = nc.variables['streamflow'][:]
-            else:
-                if indices is None or not consistent_comid_order:
-                    if 'station_id' not in nc.variables:
-                        raise Exception(no_station_msg.format(nc_file))
-                    nc_comids = nc.variables['station_id'][:]
-                    indices = _get_comid_indices(comids, nc_comids)
-                out_q[i] = nc.variables['streamflow'][indices]
-
-        if tmpfile and os.path.isfile(tmpfile):
-            os.remove(tmpfile)
+    for i, date in enumerate(dates):
+        out_t[i] = (date - seconds_since_date).total_seconds()
 
     if compute_max:
-        max_q = np.amax(out_q, axis=0)
+        # fmax ignores NaN, so only rivers missing at every time are NaN.
+        max_qs = [np.fmax.reduce(out_q, axis=0) for out_q in out_qs]
     else:
-        max_q = None
+        max_qs = None
 
-    return out_q, out_t, seconds_since_date, max_q
+    if variables is None:
+        return (out_qs[0], out_t, seconds_since_date,
+                max_qs[0] if max_qs else None)
+    return (dict(zip(names, out_qs)), out_t, seconds_since_date,
+            dict(zip(names, max_qs)) if max_qs else None)
 
 
 def combine_files(nc_files, output_file, comids=None,
-                  consistent_comid_order=True, compute_max=True):
+                  consistent_comid_order=True, compute_max=True, workers=None,
+                  zlib=False, complevel=4, shuffle=True, chunksizes=None,
+                  reductions=None, raw=False, variables=None):
     """Combines streamflow from several files into a single netCDF file.
 
     Each file from the National Water Model represents a single time step. This
@@ -538,10 +1154,13 @@ def combine_files(nc_files, output_file, comids=None,
     subset the data. Note that if you want to combine files in their entirety,
     you may want to try the external utilities NCO and ncrcat instead.
 
+    Files are read and written one time step at a time, so memory use depends
+    on the number of rivers rather than the number of files.
+
     Args:
         nc_files: List of netCDF filenames. Files can have .nc or .gz
-            extension. Zipped files are unzipped to a temporary folder and
-            deleted after use.
+            extension. Zipped files are unzipped in chunks to a uniquely named
+            temporary file and deleted after use.
         output_file: The output netCDF file.
         comids: (Optional) List or numpy array of integers representing COMIDs
             for the rivers whose streamflow value is to be returned. If None,
@@ -551,6 +1170,32 @@ def combine_files(nc_files, output_file, comids=None,
             processing a bit.
         compute_max: (Optional) True if maximum streamflow for each river
             should be included as an additional array; False otherwise.
+        workers: (Optional) Number of processes used to unzip and read files
+            in parallel. If None or 1, files are read one at a time.
+        zlib: (Optional) True if the streamflow variable should be compressed.
+        complevel: (Optional) Compression level from 1 to 9 if zlib is True.
+        shuffle: (Optional) True if the HDF5 shuffle filter should be applied
+            before compression, which usually improves compression of floats.
+        chunksizes: (Optional) Tuple of (time steps, rivers) per chunk of the
+            streamflow variable. Smaller time chunks favor reading all rivers
+            at one time; smaller river chunks favor reading one river over all
+            times. If None and zlib is True, chunks of up to 16 time steps by
+            16384 rivers (1 MB) are used, which keeps both kinds of reads
+            fast. If None and zlib is False, the variable is not chunked.
+        reductions: (Optional) List of reductions.Reduction objects computed
+            while files are read, e.g., [reductions.Mean(),
+            reductions.TimeOfPeak()]. Each result is written as a variable
+            sized by station and named by the reduction's name.
+        raw: (Optional) True if streamflow should be copied as stored in the
+            files, keeping its data type, scale_factor, add_offset and
+            _FillValue, instead of being converted to float32. Packed integer
+            values are never unpacked, except for computing reductions.
+        variables: (Optional) List of names of variables to combine in one
+            pass over the files, e.g., ['streamflow', 'velocity',
+            'q_lateral']. Each is written as a variable sized by time and
+            station with the long_name and units of the first file. The max
+            streamflow and reductions are computed from streamflow, so they
+            are left out if variables does not include it.
 
     Example:
         >>> file_pattern = 'nwm.t00z.short_range.channel_rt.f00{0}.conus.nc.gz'
@@ -563,38 +1208,94 @@ def combine_files(nc_files, output_file, comids=None,
     if not nc_files:
         raise Exception('No files to combine')
 
-    q, t, seconds_since_date, max_q = build_streamflow_cube(
-        nc_files, comids, consistent_comid_order)
-    time_string = seconds_since_date.strftime('%Y-%m-%d %H:%M %Z')
-    time_units = 'seconds since {0}'.format(time_string)
-    num_rivers = len(q[0])
-    if comids is None:
-        with Dataset(nc_files[0], 'r') as nc:
-            if 'station_id' in nc.variables:
-                comids = nc.variables['station_id'][:]
+    names = variables or ['streamflow']
+    comids, num_rivers, packings, descriptions = _read_layout(
+        nc_files, comids, names, raw, variables is not None)
+    packings = packings or [None] * len(names)
+    num_times = len(nc_files)
+    if chunksizes is None and zlib:
+        chunksizes = (min(num_times, 16), min(num_rivers, 16384))
+    # Chunks are written whole to avoid compressing a chunk again every time
+    # another time step is added to it.
+    block_size = chunksizes[0] if chunksizes else 1
 
     with Dataset(output_file, 'w') as nc:
-        nc.createDimension('time', len(nc_files))
+        nc.createDimension('time', num_times)
         nc.createDimension('station', num_rivers)
 
         time_var = nc.createVariable('time', 'i', ('time',))
         time_var.long_name = 'time'
         time_var.standard_name = 'time'
-        time_var.units = time_units
-        time_var[:] = t
 
         if comids is not None:
             comid_var = nc.createVariable('station_id', 'i', ('station',))
             comid_var[:] = comids
             comid_var.long_name = 'Station id'
 
-        q_var = nc.createVariable('streamflow', 'f4', ('time', 'station'))
-        q_var.long_name = 'River Flow'
-        q_var.units = 'meter^3 / sec'
-        q_var[:] = q
-
-        if compute_max:
-            max_var = nc.createVariable('max_streamflow', 'f4', ('station',))
-            max_var.long_name = 'Maximum River Flow'
-            max_var.units = 'meter^3 / sec'
-            max_var[:] = max_q
+        if variables is None:
+            descriptions = [{'long_name': 'River Flow',
+                             'units': 'meter^3 / sec'}]
+        q_vars = []
+        for name, description, packing in zip(names, descriptions,
+                                              packings):
+            q_dtype = packing['dtype'] if raw else np.float32
+            fill_value = packing['_FillValue'] if raw else None
+            if chunksizes:
+                q_var = nc.createVariable(
+                    name, q_dtype, ('time', 'station'), zlib=zlib,
+                    complevel=complevel, shuffle=shuffle,
+                    chunksizes=chunksizes, fill_value=fill_value)
+            else:
+                q_var = nc.createVariable(name, q_dtype, ('time', 'station'),
+                                          fill_value=fill_value)
+            for attribute in ('long_name', 'units'):
+                if attribute in description:
+                    q_var.setncattr(attribute, description[attribute])
+            if raw:
+                if packing['scale_factor'] != 1.0:
+                    q_var.scale_factor = packing['scale_factor']
+                if packing['add_offset'] != 0.0:
+                    q_var.add_offset = packing['add_offset']
+                q_var.set_auto_maskandscale(False)
+            q_vars.append(q_var)
+
+        reductions = list(reductions or [])
+        if 'streamflow' in names:
+            q_position = names.index('streamflow')
+            if compute_max:
+                reductions.insert(0, reduction_stats.Max())
+        elif reductions:
+            raise ValueError('Reductions need streamflow in variables')
+
+        seconds_since_date = None
+        blocks = [np.zeros((block_size, num_rivers), q_var.dtype)
+                  for q_var in q_vars]
+        block_start = 0
+        q_iter = _iter_q_from_files(nc_files, comids, consistent_comid_order,
+                                    workers, raw, names)
+        for i, (date, values) in enumerate(q_iter):
+            if seconds_since_date is None:
+                seconds_since_date = date
+                time_string = seconds_since_date.strftime('%Y-%m-%d %H:%M %Z')
+                time_var.units = 'seconds since {0}'.format(time_string)
+            time_var[i] = (date - seconds_since_date).total_seconds()
+            if reductions:
+                q = values[q_position]
+                reduction_q = _unpack(q, packings[q_position]) if raw else q
+                for reduction in reductions:
+                    reduction.update(date, reduction_q)
+            for block, value in zip(blocks, values):
+                block[i - block_start] = value
+            if i + 1 - block_start == block_size or i + 1 == num_times:
+                with instrument.stage('write_netcdf'):
+                    for q_var, block in zip(q_vars, blocks):
+                        q_var[block_start:i + 1] = block[:i + 1 - block_start]
+                block_start = i + 1
+
+        for reduction in reductions:
+            var = nc.createVariable(reduction.name, reduction.dtype,
+                                    ('station',))
+            if reduction.long_name:
+                var.long_name = reduction.long_name
+            var.units = reduction.units or time_var.units
+            var[:] = reduction.result()
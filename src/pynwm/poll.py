@@ -0,0 +1,262 @@
+#!/usr/bin/python2
+"""Finds model cycles that completed since the last time they were checked.
+
+Checking for new results on a schedule usually means listing every available
+file and reprocessing the latest forecast, even when nothing has changed. A
+Poller instead remembers, for each product, the latest model cycle already
+handled (its high-water mark) and returns only complete cycles newer than it.
+Marks are saved in a JSON file so they survive restarts.
+
+A cycle is complete once its last expected time step is available, the same
+rule used by nwm.get_latest_forecast_date.
+
+Example:
+    >>> from pynwm import poll
+    >>> poller = poll.Poller(['short_range'], 'poll_state.json')
+    >>> for cycle in poller.watch(interval=600):
+            print cycle['product'], cycle['date'], len(cycle['files'])
+"""
+
+from datetime import datetime
+import json
+import os
+import tempfile
+import time
+
+from pynwm import download
+from pynwm import ncfiles
+from pynwm import noaa_nwm
+from pynwm import nwm
+
+
+def _last_forecast_hour(product):
+    """Returns forecast_hour of the last time step of a product's cycles."""
+
+    step = noaa_nwm._product_schedules[product][1]
+    if step.startswith('tm'):
+        return -int(step[2:])
+    return int(step[1:])
+
+
+def _cycle_key(date, cycle):
+    return '{0}{1:02d}'.format(date, cycle)
+
+
+class Poller(object):
+    """Tracks the latest model cycle handled for each product.
+
+    Attributes:
+        products: List of products polled, e.g., ['short_range',
+            'long_range_mem1']. Long range members are tracked separately.
+        source: 'noaa' to poll NOAA's FTP server, or 'hydroshare' to poll the
+            HydroShare archive.
+        state_file: JSON file where marks are saved, or None if marks are only
+            kept in memory.
+        marks: Dict of product to the latest cycle handled, as a YYYYMMDDHH
+            string.
+    """
+
+    def __init__(self, products=None, state_file=None, source='noaa',
+                 workers=4):
+        """Creates a poller, loading saved marks from state_file if present.
+
+        Args:
+            products: (Optional) List of products or string of a single
+                product to poll, as for noaa_nwm.list_files. If not provided,
+                all products are polled.
+            state_file: (Optional) JSON file where marks are saved.
+            source: (Optional) 'noaa' or 'hydroshare'.
+            workers: (Optional) Number of FTP connections used at once when
+                polling NOAA.
+        """
+
+        if source not in ('noaa', 'hydroshare'):
+            raise ValueError('source must be noaa or hydroshare')
+        self.products = noaa_nwm._get_products(products)
+        if not self.products:
+            raise ValueError('No valid products: {0}'.format(products))
+        self.source = source
+        self.state_file = state_file
+        self.workers = workers
+        self.marks = {}
+        if state_file and os.path.isfile(state_file):
+            with open(state_file, 'r') as f:
+                self.marks = json.load(f)
+
+    def _save(self):
+        if not self.state_file:
+            return
+        folder = os.path.dirname(os.path.abspath(self.state_file))
+        fd, tmp_filename = tempfile.mkstemp(suffix='.json', dir=folder)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.marks, f, indent=2, sort_keys=True)
+        os.rename(tmp_filename, self.state_file)
+
+    def _list_noaa(self):
+        """Returns dicts of product and path for available channel files."""
+
+        # Folders older than every mark cannot hold new cycles.
+        oldest = min([self.marks.get(p, '') for p in self.products])
+        datefolders = [d for d in noaa_nwm.get_datefolders()
+                       if d[4:12] >= oldest[:8]]
+        if not datefolders:
+            return []
+        records = noaa_nwm.crawl(datefolders, self.products, self.workers)
+        for record in records:
+            record['product'] = record['folder_product']
+        return records
+
+    def _list_hydroshare(self):
+        """Returns dicts of product and path for available channel files."""
+
+        records = []
+        if 'analysis_assim' in self.products:
+            for filename in nwm._get_analysis_filenames():
+                record = ncfiles.parse_filename(filename)
+                if record:
+                    record['path'] = filename
+                    records.append(record)
+
+        forecast_products = set(self.products) - {'analysis_assim'}
+        for product in ('short_range', 'medium_range', 'long_range'):
+            if not any(p.startswith(product) for p in forecast_products):
+                continue
+            oldest = min([self.marks.get(p, '') for p in forecast_products
+                          if p.startswith(product)])
+            for folder_date in nwm._list_forecast_dates(product):
+                if folder_date < oldest[:8]:
+                    continue
+                for filename in nwm._list_forecast_folder(product,
+                                                          folder_date):
+                    # Name files as HydroShare's GetFileList does.
+                    path = '{0}-nwm.{1}.{2}'.format(product, folder_date,
+                                                    filename[4:])
+                    record = ncfiles.parse_filename(path)
+                    if record is None:
+                        continue
+                    if record['member']:
+                        record['product'] = 'long_range_mem{0}'.format(
+                            record['member'])
+                    if record['product'] in forecast_products:
+                        record['path'] = path
+                        records.append(record)
+        return records
+
+    def new_cycles(self):
+        """Returns complete cycles newer than each product's mark.
+
+        Marks are not changed; call mark for each cycle once it is handled.
+
+        Returns:
+            List of dicts sorted by date, each with product, date (datetime of
+            the model cycle in UTC), key (YYYYMMDDHH string), member (long
+            range member as int, or None) and files (filenames sorted by time
+            step, as accepted by download.download_files).
+        """
+
+        if self.source == 'noaa':
+            records = self._list_noaa()
+        else:
+            records = self._list_hydroshare()
+
+        cycles = {}
+        for record in records:
+            if record['product'] not in self.products or not record['date']:
+                continue
+            key = _cycle_key(record['date'], record['cycle'])
+            if key <= self.marks.get(record['product'], ''):
+                continue
+            cycles.setdefault((record['product'], key), []).append(record)
+
+        complete = []
+        for (product, key), cycle_records in cycles.iteritems():
+            last_hour = _last_forecast_hour(product)
+            if not any(r['forecast_hour'] == last_hour
+                       for r in cycle_records):
+                continue
+            cycle_records.sort(key=lambda r: r['forecast_hour'])
+            complete.append({
+                'product': product,
+                'date': datetime.strptime(key, '%Y%m%d%H'),
+                'key': key,
+                'member': cycle_records[0]['member'],
+                'files': [r['path'] for r in cycle_records]})
+        return sorted(complete, key=lambda c: (c['key'], c['product']))
+
+    def mark(self, cycle):
+        """Records that a cycle was handled and saves the marks.
+
+        Args:
+            cycle: Dict returned by new_cycles.
+        """
+
+        if cycle['key'] > self.marks.get(cycle['product'], ''):
+            self.marks[cycle['product']] = cycle['key']
+            self._save()
+
+    def watch(self, interval=600, max_polls=None):
+        """Yields complete cycles as they arrive.
+
+        Each cycle is marked once the caller asks for the next one, so a cycle
+        whose processing raises an exception is returned again by the next
+        poller using the same state_file.
+
+        Args:
+            interval: (Optional) Seconds to wait between polls.
+            max_polls: (Optional) Number of polls before stopping. If not
+                provided, polls forever.
+
+        Yields:
+            Cycle dicts as returned by new_cycles, oldest first.
+        """
+
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            if polls:
+                time.sleep(interval)
+            polls += 1
+            for cycle in self.new_cycles():
+                yield cycle
+                self.mark(cycle)
+
+
+def combine_new_cycles(poller, download_folder, output_folder, comids=None,
+                       workers=4, keep_downloads=False, **kwargs):
+    """Downloads each new complete cycle and combines it into one file.
+
+    Args:
+        poller: Poller to take new cycles from. Each cycle is marked once its
+            combined file is written.
+        download_folder: Folder where model files are downloaded.
+        output_folder: Folder where combined files are written, named like
+            short_range.2016092800.nc.
+        comids: (Optional) COMIDs to include, as for nwm.combine_files.
+        workers: (Optional) Number of files downloaded at the same time.
+        keep_downloads: (Optional) True if downloaded model files should be
+            kept after combining.
+        **kwargs: Other arguments passed to nwm.combine_files, e.g., zlib.
+
+    Returns:
+        List of combined filenames, oldest first.
+    """
+
+    if not os.path.isdir(output_folder):
+        os.makedirs(output_folder)
+    output_files = []
+    for cycle in poller.new_cycles():
+        results = download.download_files(cycle['files'], download_folder,
+                                          workers=workers)
+        failed = [r for r in results if r['status'] == 'failed']
+        if failed:
+            raise IOError('Could not download {0}: {1}'.format(
+                failed[0]['source'], failed[0]['error']))
+        nc_files = [r['filename'] for r in results]
+        output_file = os.path.join(output_folder, '{0}.{1}.nc'.format(
+            cycle['product'], cycle['key']))
+        nwm.combine_files(nc_files, output_file, comids, **kwargs)
+        if not keep_downloads:
+            for nc_file in nc_files:
+                os.remove(nc_file)
+        poller.mark(cycle)
+        output_files.append(output_file)
+    return output_files
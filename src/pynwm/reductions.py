@@ -0,0 +1,211 @@
+#!/usr/bin/python2
+"""Statistics of each river computed one time step at a time.
+
+Each reduction is given the streamflow of every river for one time step after
+another, keeping only an array or two sized by the number of rivers, and
+returns a value per river at the end. This keeps memory use independent of
+the number of time steps. Pass reductions to nwm.combine_files to have each
+one written as a variable, or to cube.StreamflowCube.reduce.
+
+Missing values are NaN and are left out of every statistic; a river missing
+at every time step gets NaN.
+
+To add a statistic, subclass Reduction and implement update and result.
+
+Example:
+    >>> from pynwm import nwm, reductions
+    >>> stats = [reductions.Min(), reductions.Mean(), reductions.TimeOfPeak(),
+                 reductions.ExceedanceCount(two_year_flows,
+                                            'hours_above_2yr')]
+    >>> nwm.combine_files(files, 'combined.nc', comids, reductions=stats)
+"""
+
+import numpy as np
+
+
+class Reduction(object):
+    """Base class of statistics computed over time for each river.
+
+    Attributes:
+        name: Name of the netCDF variable the result is written to.
+        long_name: Description written as the variable's long_name.
+        units: Units of the result, or None if in the time units of the
+            output file.
+        dtype: netCDF data type of the result.
+    """
+
+    long_name = None
+    units = 'meter^3 / sec'
+    dtype = 'f4'
+
+    def __init__(self, name):
+        self.name = name
+
+    def update(self, date, q):
+        """Adds one time step.
+
+        Args:
+            date: Valid output datetime of the time step.
+            q: Numpy array of streamflow for each river.
+        """
+
+        raise NotImplementedError
+
+    def result(self):
+        """Returns a numpy array with the statistic for each river."""
+
+        raise NotImplementedError
+
+
+class Max(Reduction):
+    """Maximum streamflow."""
+
+    long_name = 'Maximum River Flow'
+
+    def __init__(self, name='max_streamflow'):
+        super(Max, self).__init__(name)
+        self._max = None
+
+    def update(self, date, q):
+        if self._max is None:
+            self._max = np.array(q, np.float32)
+        else:
+            np.fmax(self._max, q, out=self._max)
+
+    def result(self):
+        return self._max
+
+
+class Min(Reduction):
+    """Minimum streamflow."""
+
+    long_name = 'Minimum River Flow'
+
+    def __init__(self, name='min_streamflow'):
+        super(Min, self).__init__(name)
+        self._min = None
+
+    def update(self, date, q):
+        if self._min is None:
+            self._min = np.array(q, np.float32)
+        else:
+            np.fmin(self._min, q, out=self._min)
+
+    def result(self):
+        return self._min
+
+
+class Mean(Reduction):
+    """Mean streamflow over all time steps."""
+
+    long_name = 'Mean River Flow'
+
+    def __init__(self, name='mean_streamflow'):
+        super(Mean, self).__init__(name)
+        self._sum = None
+        self._count = None
+
+    def update(self, date, q):
+        if self._sum is None:
+            self._sum = np.zeros(len(q), np.float64)
+            self._count = np.zeros(len(q), np.int32)
+        present = ~np.isnan(q)
+        self._sum[present] += q[present]
+        self._count += present
+
+    def result(self):
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self._sum / self._count).astype(np.float32)
+
+
+class TimeOfPeak(Reduction):
+    """Time of maximum streamflow, in seconds since the first time step.
+
+    If the maximum occurs more than once, the earliest time is used. Rivers
+    missing at every time step get zero.
+    """
+
+    long_name = 'Time of Maximum River Flow'
+    units = None
+    dtype = 'i'
+
+    def __init__(self, name='time_of_max_streamflow'):
+        super(TimeOfPeak, self).__init__(name)
+        self._first_date = None
+        self._max = None
+        self._seconds = None
+
+    def update(self, date, q):
+        if self._first_date is None:
+            self._first_date = date
+            self._max = np.array(q, np.float32)
+            self._seconds = np.zeros(len(q), np.int32)
+            return
+        with np.errstate(invalid='ignore'):
+            higher = (q > self._max) | (np.isnan(self._max) & ~np.isnan(q))
+        self._max[higher] = q[higher]
+        self._seconds[higher] = (date - self._first_date).total_seconds()
+
+    def result(self):
+        return self._seconds
+
+
+class ExceedanceCount(Reduction):
+    """Number of time steps with streamflow above a threshold.
+
+    Args:
+        thresholds: Threshold for every river, as a number or a numpy array
+            in the order of the rivers, e.g., two-year return period flows.
+        name: (Optional) Name of the output variable.
+    """
+
+    long_name = 'Number of Time Steps Above Threshold'
+    units = '1'
+    dtype = 'i'
+
+    def __init__(self, thresholds, name='exceedance_count'):
+        super(ExceedanceCount, self).__init__(name)
+        self.thresholds = np.asarray(thresholds)
+        self._count = None
+
+    def update(self, date, q):
+        if self._count is None:
+            self._count = np.zeros(len(q), np.int32)
+        with np.errstate(invalid='ignore'):
+            self._count += q > self.thresholds
+
+    def result(self):
+        return self._count
+
+
+class MaxRateOfRise(Reduction):
+    """Largest increase in streamflow per hour between consecutive steps.
+
+    Rivers that never rise have a value of zero or less. Only steps with
+    values at both times are compared.
+    """
+
+    long_name = 'Maximum Rate of Rise of River Flow'
+    units = 'meter^3 / sec / hour'
+
+    def __init__(self, name='max_rate_of_rise'):
+        super(MaxRateOfRise, self).__init__(name)
+        self._previous_date = None
+        self._previous_q = None
+        self._max_rate = None
+
+    def update(self, date, q):
+        if self._previous_date is not None:
+            hours = (date - self._previous_date).total_seconds() / 3600.0
+            rate = (q - self._previous_q) / hours
+            if self._max_rate is None:
+                self._max_rate = rate.astype(np.float32)
+            else:
+                np.fmax(self._max_rate, rate, out=self._max_rate)
+        self._previous_date = date
+        self._previous_q = np.array(q, np.float32)
+
+    def result(self):
+        if self._max_rate is None:
+            return np.zeros(len(self._previous_q), np.float32)
+        return self._max_rate
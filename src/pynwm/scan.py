@@ -0,0 +1,274 @@
+#!/usr/bin/python2
+"""Scans model result files for their metadata without reading streamflow.
+
+Selecting the files of a time range from an archive of tens of thousands of
+files only needs each file's valid time, product and cycle, which can
+usually be worked out from the filename and the folder it is in. Files are
+only opened when the filename is not enough, e.g., a NOAA file copied out of
+its nwm.YYYYMMDD folder, or when the number of stations is requested.
+
+Opening a file reads only its header. The header of a netCDF classic file is
+read from the start of the file, so a gzipped classic file is decompressed
+only as far as the end of its header. netCDF4 (HDF5) files are opened with
+netCDF4, which needs gzipped files to be unzipped first.
+
+Example:
+    >>> from pynwm import scan
+    >>> records = scan.scan_files(glob.glob('archive/*/*.nc.gz'))
+    >>> june = scan.select_files(records, '2016-06-01', '2016-07-01',
+                                 product='analysis_assim')
+    >>> q, t, since_date, max_q = nwm.build_streamflow_cube(
+            [r['filename'] for r in june])
+"""
+
+from datetime import datetime, timedelta
+import gzip
+# datetime.strptime imports _strptime on first use, which fails in a thread
+# while another thread holds the import lock (Python issue 7980).
+import _strptime
+from multiprocessing.pool import ThreadPool
+import struct
+
+from dateutil import parser as date_parser
+from netCDF4 import Dataset
+import pytz
+
+from pynwm import instrument
+from pynwm import ncfiles
+
+_station_dimensions = ('station', 'feature_id')
+
+# netCDF classic format tags and the size in bytes of each data type.
+_nc_dimension = 10
+_nc_attribute = 12
+_type_sizes = {1: 1, 2: 1, 3: 2, 4: 4, 5: 4, 6: 8, 7: 1, 8: 2, 9: 4, 10: 8,
+               11: 8}
+_type_formats = {1: 'b', 3: 'h', 4: 'i', 5: 'f', 6: 'd', 7: 'B', 8: 'H',
+                 9: 'I', 10: 'q', 11: 'Q'}
+
+
+class _HeaderReader(object):
+    """Reads big-endian values from the start of a netCDF classic file."""
+
+    def __init__(self, f, version):
+        self._f = f
+        self._count_format = '>q' if version == 5 else '>i'
+        self._count_size = 8 if version == 5 else 4
+
+    def read(self, size):
+        data = self._f.read(size)
+        if len(data) != size:
+            raise ValueError('Truncated netCDF header')
+        return data
+
+    def int(self):
+        return struct.unpack('>i', self.read(4))[0]
+
+    def count(self):
+        return struct.unpack(self._count_format,
+                             self.read(self._count_size))[0]
+
+    def name(self):
+        size = self.count()
+        name = self.read(size)
+        self.read(-size % 4)
+        return name
+
+    def values(self):
+        nc_type = self.int()
+        size = self.count()
+        if nc_type not in _type_sizes:
+            raise ValueError('Unknown netCDF type {0}'.format(nc_type))
+        nbytes = size * _type_sizes[nc_type]
+        data = self.read(nbytes)
+        self.read(-nbytes % 4)
+        if nc_type == 2:
+            return data.rstrip('\0')
+        values = struct.unpack('>{0}{1}'.format(size, _type_formats[nc_type]),
+                               data)
+        return values[0] if size == 1 else list(values)
+
+    def list_header(self, tag):
+        """Returns the number of elements of a list, or 0 if it is absent."""
+
+        list_tag = self.int()
+        size = self.count()
+        if list_tag not in (0, tag) or (list_tag == 0 and size != 0):
+            raise ValueError('Malformed netCDF header')
+        return size
+
+
+def _read_classic_header(f):
+    """Returns dimensions and global attributes of a netCDF classic file.
+
+    Args:
+        f: File object positioned at the start of the file.
+
+    Returns:
+        Tuple of dict of dimension name to length (None for the unlimited
+        dimension) and dict of global attribute name to value, or None if the
+        file is not a netCDF classic file.
+    """
+
+    magic = f.read(4)
+    if (len(magic) != 4 or magic[:3] != 'CDF' or
+            magic[3] not in '\x01\x02\x05'):
+        return None
+    reader = _HeaderReader(f, ord(magic[3]))
+    reader.count()  # Number of records.
+    dimensions = {}
+    for _ in range(reader.list_header(_nc_dimension)):
+        name = reader.name()
+        dimensions[name] = reader.count() or None
+    attributes = {}
+    for _ in range(reader.list_header(_nc_attribute)):
+        name = reader.name()
+        attributes[name] = reader.values()
+    return dimensions, attributes
+
+
+def _station_count(dimensions):
+    for name in _station_dimensions:
+        if name in dimensions:
+            return dimensions[name]
+    return None
+
+
+def read_header(nc_file):
+    """Reads the valid time and number of stations from a file's header.
+
+    Args:
+        nc_file: Filename of a netCDF file, which may be gzipped.
+
+    Returns:
+        Dict with valid_time (timezone-aware datetime in UTC, or None if the
+        file has no model_output_valid_time attribute) and station_count
+        (number of rivers, or None if the file has no station dimension).
+    """
+
+    opener = gzip.open if nc_file[-3:] == '.gz' else open
+    with instrument.stage('read_header'):
+        with opener(nc_file, 'rb') as f:
+            header = _read_classic_header(f)
+        if header is None:
+            with ncfiles.unzipped(nc_file) as path, Dataset(path, 'r') as nc:
+                dimensions = dict((name, len(dim)) for name, dim
+                                  in nc.dimensions.iteritems())
+                attributes = dict((name, nc.getncattr(name))
+                                  for name in nc.ncattrs())
+        else:
+            dimensions, attributes = header
+    valid_time = attributes.get('model_output_valid_time')
+    if valid_time is not None:
+        valid_time = ncfiles.parse_valid_time(valid_time)
+    return {'valid_time': valid_time,
+            'station_count': _station_count(dimensions)}
+
+
+def _valid_time_from_name(parsed):
+    """Returns the valid time described by a parsed filename, or None."""
+
+    if parsed is None or parsed['date'] is None:
+        return None
+    date = datetime.strptime(parsed['date'], '%Y%m%d')
+    return (date + timedelta(hours=parsed['cycle'] + parsed['forecast_hour'])
+            ).replace(tzinfo=pytz.utc)
+
+
+def scan_file(nc_file, station_count=False):
+    """Returns the metadata of one file. See scan_files."""
+
+    parsed = ncfiles.parse_filename(nc_file)
+    record = {'filename': nc_file,
+              'product': None,
+              'date': None,
+              'cycle': None,
+              'member': None,
+              'forecast_hour': None,
+              'valid_time': _valid_time_from_name(parsed),
+              'station_count': None}
+    if parsed is not None:
+        record.update(parsed)
+    if record['valid_time'] is None or station_count:
+        header = read_header(nc_file)
+        record['station_count'] = header['station_count']
+        if header['valid_time'] is not None:
+            record['valid_time'] = header['valid_time']
+    return record
+
+
+def scan_files(nc_files, station_count=False, workers=None):
+    """Returns the metadata of many model result files.
+
+    The valid time is worked out from the filename when it includes the
+    forecast date, either in the name itself (HydroShare) or in an
+    nwm.YYYYMMDD folder (NOAA). Other files are opened to read the
+    model_output_valid_time attribute from their header.
+
+    Args:
+        nc_files: List of netCDF filenames, optionally including the folders
+            containing them. Files can have .nc or .gz extension.
+        station_count: (Optional) True if every file's header should be read
+            to find its number of stations; False to open files only when
+            their valid time cannot be worked out from the filename.
+        workers: (Optional) Number of threads reading headers at once. If None
+            or 1, files are read one at a time.
+
+    Returns:
+        List of dicts in the order of nc_files, with filename, product, date
+        (forecast date string in YYYYMMDD format), cycle, member,
+        forecast_hour (as returned by ncfiles.parse_filename; None if the
+        filename does not follow NWM conventions), valid_time (timezone-aware
+        datetime in UTC, or None if it could not be found) and station_count
+        (number of rivers, or None if the header was not read).
+    """
+
+    nc_files = list(nc_files)
+    if workers is None or workers <= 1 or len(nc_files) <= 1:
+        return [scan_file(f, station_count) for f in nc_files]
+    pool = ThreadPool(min(workers, len(nc_files)))
+    try:
+        return pool.map(lambda f: scan_file(f, station_count), nc_files)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _to_utc(date):
+    """Returns a datetime, date string, or None as UTC datetime."""
+
+    if isinstance(date, basestring):
+        date = date_parser.parse(date)
+    if date is not None and date.tzinfo is None:
+        date = date.replace(tzinfo=pytz.utc)
+    return date
+
+
+def select_files(records, start_date=None, end_date=None, product=None):
+    """Selects scanned files within a time range, sorted by valid time.
+
+    Args:
+        records: List of dicts as returned by scan_files.
+        start_date: (Optional) Earliest valid time to include, as datetime or
+            string. Dates without a time zone are taken as UTC.
+        end_date: (Optional) Valid times before this are included.
+        product: (Optional) Product name, e.g., 'analysis_assim', or sequence
+            of product names to include.
+
+    Returns:
+        List of the records selected, sorted by valid time, then product,
+        cycle and member. Records without a valid time are left out.
+    """
+
+    start_date = _to_utc(start_date)
+    end_date = _to_utc(end_date)
+    if isinstance(product, basestring):
+        product = [product]
+    selected = [r for r in records
+                if r['valid_time'] is not None and
+                (start_date is None or r['valid_time'] >= start_date) and
+                (end_date is None or r['valid_time'] < end_date) and
+                (product is None or r['product'] in product)]
+    selected.sort(key=lambda r: (r['valid_time'], r['product'], r['date'],
+                                 r['cycle'], r['member'], r['filename']))
+    return selected
@@ -0,0 +1,258 @@
+#!/usr/bin/python2
+"""Finds COMIDs of rivers within an area.
+
+HydroShare's georeferenced files include the latitude and longitude of every
+river. SpatialIndex groups rivers into grid cells of a fixed size in degrees,
+so rivers in a bounding box, within a distance of a point, or inside a polygon
+are found by looking only at the cells the area overlaps. The COMIDs returned
+can be passed to nwm.read_q_for_comids, nwm.subset_channel_file,
+nwm.build_streamflow_cube and the other functions that take COMIDs.
+
+The index can be saved next to other cached data as a .npz file and is only
+rebuilt when the file's stations or coordinates change.
+
+Example:
+    >>> from pynwm import nwm, spatial
+    >>> index = spatial.SpatialIndex.from_file(georeferenced_file,
+                                               cache_dir='index_cache')
+    >>> comids = index.radius(-97.68, 30.51, 25)  # km around Round Rock, TX
+    >>> result = nwm.read_q_for_comids(model_file, comids)
+"""
+
+import hashlib
+import os
+import tempfile
+
+from netCDF4 import Dataset
+import numpy as np
+
+from pynwm import ncfiles
+
+_earth_radius_km = 6371.0088
+_km_per_degree = np.pi * _earth_radius_km / 180
+
+
+class SpatialIndex(object):
+    """Grid of river locations for fast area queries.
+
+    Attributes:
+        cell_size: Width and height of grid cells in degrees.
+        comids: Numpy array of COMIDs in the order of the file the index was
+            built from.
+    """
+
+    def __init__(self, comids, latitudes, longitudes, cell_size=0.25):
+        """Builds an index from river locations.
+
+        Args:
+            comids: List or numpy array of COMIDs.
+            latitudes: Latitude of each river in degrees.
+            longitudes: Longitude of each river in degrees.
+            cell_size: (Optional) Width and height of grid cells in degrees.
+                Smaller cells make small queries faster but use more memory.
+        """
+
+        self.cell_size = float(cell_size)
+        self.comids = np.ma.getdata(np.asarray(comids))
+        latitudes = np.ma.filled(np.ma.asarray(latitudes, np.float64),
+                                 np.nan)
+        longitudes = np.ma.filled(np.ma.asarray(longitudes, np.float64),
+                                  np.nan)
+        located = np.flatnonzero(np.isfinite(latitudes) &
+                                 np.isfinite(longitudes))
+        if len(located):
+            self._lat0 = np.floor(latitudes[located].min())
+            self._lon0 = np.floor(longitudes[located].min())
+            rows = ((latitudes[located] - self._lat0) //
+                    self.cell_size).astype(np.int64)
+            cols = ((longitudes[located] - self._lon0) //
+                    self.cell_size).astype(np.int64)
+            self._num_rows = rows.max() + 1
+            self._num_cols = cols.max() + 1
+        else:
+            self._lat0 = self._lon0 = 0.0
+            rows = cols = np.zeros(0, np.int64)
+            self._num_rows = self._num_cols = 0
+        cells = rows * self._num_cols + cols
+        order = np.argsort(cells, kind='mergesort')
+
+        # Rivers sorted by cell, with the rivers of cell c at positions
+        # _cell_starts[c] to _cell_starts[c + 1].
+        self._positions = located[order]
+        self._lats = latitudes[self._positions]
+        self._lons = longitudes[self._positions]
+        self._cell_starts = np.searchsorted(
+            cells[order], np.arange(self._num_rows * self._num_cols + 1))
+
+    @classmethod
+    def from_file(cls, nc_file, cell_size=0.25, cache_dir=None):
+        """Builds or loads the index for a georeferenced channel file.
+
+        Args:
+            nc_file: Filename of a netCDF file with station_id, latitude and
+                longitude variables, e.g., a file from HydroShare. The file
+                can have .nc or .gz extension.
+            cell_size: (Optional) Width and height of grid cells in degrees.
+            cache_dir: (Optional) Folder where indices are saved as .npz
+                files and loaded from when the stations and coordinates match.
+
+        Returns:
+            SpatialIndex of the file's rivers.
+        """
+
+        with ncfiles.unzipped(nc_file) as path, Dataset(path, 'r') as nc:
+            comids = np.ma.getdata(nc.variables['station_id'][:])
+            latitudes = nc.variables['latitude'][:]
+            longitudes = nc.variables['longitude'][:]
+        if not cache_dir:
+            return cls(comids, latitudes, longitudes, cell_size)
+
+        digest = hashlib.sha1()
+        for values in (comids, latitudes, longitudes):
+            values = np.ma.getdata(values)
+            digest.update(str(values.dtype))
+            digest.update(np.ascontiguousarray(values).data)
+        digest.update(repr(float(cell_size)))
+        filename = os.path.join(cache_dir, 'spatial_index_{0}.npz'.format(
+            digest.hexdigest()))
+        if os.path.isfile(filename):
+            try:
+                return cls.load(filename)
+            except (IOError, ValueError, KeyError):
+                pass
+        index = cls(comids, latitudes, longitudes, cell_size)
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        index.save(filename)
+        return index
+
+    def save(self, filename):
+        """Saves the index as a .npz file."""
+
+        folder = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(suffix='.npz', dir=folder)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, comids=self.comids, positions=self._positions,
+                     lats=self._lats, lons=self._lons,
+                     cell_starts=self._cell_starts,
+                     grid=np.array([self.cell_size, self._lat0, self._lon0,
+                                    self._num_rows, self._num_cols]))
+        os.rename(tmp_filename, filename)
+
+    @classmethod
+    def load(cls, filename):
+        """Loads an index saved by save."""
+
+        with np.load(filename) as data:
+            index = cls.__new__(cls)
+            index.comids = data['comids']
+            index._positions = data['positions']
+            index._lats = data['lats']
+            index._lons = data['lons']
+            index._cell_starts = data['cell_starts']
+            cell_size, lat0, lon0, num_rows, num_cols = data['grid']
+        index.cell_size = float(cell_size)
+        index._lat0 = lat0
+        index._lon0 = lon0
+        index._num_rows = int(num_rows)
+        index._num_cols = int(num_cols)
+        return index
+
+    def _candidates(self, min_lon, min_lat, max_lon, max_lat):
+        """Returns sorted positions of rivers in cells overlapping a box."""
+
+        row0 = max(int((min_lat - self._lat0) // self.cell_size), 0)
+        row1 = min(int((max_lat - self._lat0) // self.cell_size),
+                   self._num_rows - 1)
+        col0 = max(int((min_lon - self._lon0) // self.cell_size), 0)
+        col1 = min(int((max_lon - self._lon0) // self.cell_size),
+                   self._num_cols - 1)
+        if row0 > row1 or col0 > col1:
+            return np.zeros(0, np.int64)
+        # The cells of a row within the box are stored together.
+        starts = self._cell_starts[np.arange(row0, row1 + 1) *
+                                   self._num_cols + col0]
+        stops = self._cell_starts[np.arange(row0, row1 + 1) *
+                                  self._num_cols + col1 + 1]
+        return np.concatenate([np.arange(start, stop)
+                               for start, stop in zip(starts, stops)])
+
+    def _select(self, candidates, inside):
+        """Returns COMIDs of candidates inside an area, in file order."""
+
+        return self.comids[np.sort(self._positions[candidates[inside]])]
+
+    def bbox(self, min_lon, min_lat, max_lon, max_lat):
+        """Returns COMIDs of rivers within a bounding box.
+
+        Args:
+            min_lon: Western edge in degrees longitude.
+            min_lat: Southern edge in degrees latitude.
+            max_lon: Eastern edge in degrees longitude.
+            max_lat: Northern edge in degrees latitude.
+
+        Returns:
+            Numpy array of COMIDs, in the order of the indexed file.
+        """
+
+        candidates = self._candidates(min_lon, min_lat, max_lon, max_lat)
+        lats = self._lats[candidates]
+        lons = self._lons[candidates]
+        inside = ((lats >= min_lat) & (lats <= max_lat) &
+                  (lons >= min_lon) & (lons <= max_lon))
+        return self._select(candidates, inside)
+
+    def radius(self, lon, lat, km):
+        """Returns COMIDs of rivers within a distance of a point.
+
+        Args:
+            lon: Longitude of the point in degrees.
+            lat: Latitude of the point in degrees.
+            km: Great circle distance in kilometers.
+
+        Returns:
+            Numpy array of COMIDs, in the order of the indexed file.
+        """
+
+        dlat = km / _km_per_degree
+        max_abs_lat = min(abs(lat) + dlat, 89.9)
+        dlon = min(dlat / np.cos(np.radians(max_abs_lat)), 180.0)
+        candidates = self._candidates(lon - dlon, lat - dlat,
+                                      lon + dlon, lat + dlat)
+        lat1 = np.radians(lat)
+        lat2 = np.radians(self._lats[candidates])
+        dlat_r = lat2 - lat1
+        dlon_r = np.radians(self._lons[candidates] - lon)
+        a = (np.sin(dlat_r / 2) ** 2 +
+             np.cos(lat1) * np.cos(lat2) * np.sin(dlon_r / 2) ** 2)
+        distances = 2 * _earth_radius_km * np.arcsin(np.sqrt(a))
+        return self._select(candidates, distances <= km)
+
+    def polygon(self, vertices):
+        """Returns COMIDs of rivers inside a polygon.
+
+        Args:
+            vertices: Sequence of (longitude, latitude) pairs outlining the
+                polygon, e.g., a basin boundary. The polygon is closed
+                automatically.
+
+        Returns:
+            Numpy array of COMIDs, in the order of the indexed file.
+        """
+
+        vertices = np.asarray(vertices, np.float64)
+        xs = vertices[:, 0]
+        ys = vertices[:, 1]
+        candidates = self._candidates(xs.min(), ys.min(), xs.max(), ys.max())
+        lons = self._lons[candidates]
+        lats = self._lats[candidates]
+
+        # Count crossings of a ray cast east from each river.
+        inside = np.zeros(len(candidates), bool)
+        for x1, y1, x2, y2 in zip(xs, ys, np.roll(xs, -1), np.roll(ys, -1)):
+            if y1 == y2:
+                continue
+            spans = (y1 > lats) != (y2 > lats)
+            crossing = x1 + (lats - y1) * (x2 - x1) / (y2 - y1)
+            inside ^= spans & (lons < crossing)
+        return self._select(candidates, inside)
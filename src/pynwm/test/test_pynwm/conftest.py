@@ -0,0 +1,278 @@
+"""Generated model files and local server stand-ins shared by the tests."""
+
+import BaseHTTPServer
+from datetime import datetime, timedelta
+import gzip
+import logging
+import os
+import shutil
+import SocketServer
+import threading
+import urlparse
+
+from netCDF4 import Dataset
+import numpy as np
+from pyftpdlib.authorizers import DummyAuthorizer
+from pyftpdlib.handlers import FTPHandler
+from pyftpdlib.ioloop import IOLoop
+from pyftpdlib.servers import ThreadedFTPServer
+import pytest
+
+from pynwm import connections
+from pynwm import noaa_nwm
+from pynwm import nwm
+
+STATION_IDS = np.array([5671187, 5670795, 101, 7, 5781000, 42, 9000001,
+                        313, 5670000, 88], np.int32)
+FIRST_VALID_TIME = datetime(2016, 6, 21, 1)
+FILL_VALUE = -999900
+JSON_FOLDER = os.path.join(os.path.dirname(__file__), '..', '..', '..', '..',
+                           'data', 'json_responses')
+SCALE_FACTOR = 0.01
+
+
+def make_channel_file(filename, station_ids, valid_time, seed=0,
+                      packed=False, masked=()):
+    """Writes a short range channel file for one time step.
+
+    Args:
+        filename: Filename of the new file.
+        station_ids: COMIDs in the order they are stored.
+        valid_time: Valid output datetime.
+        seed: Seed of the random streamflow values.
+        packed: True to store streamflow and velocity as int32 with a
+            scale_factor, as NOAA files do; False to store float32.
+        masked: Positions of rivers whose values are missing.
+    """
+
+    rs = np.random.RandomState(seed)
+    with Dataset(filename, 'w') as nc:
+        nc.model_output_valid_time = valid_time.strftime('%Y-%m-%d_%H:%M:%S')
+        nc.createDimension('station', len(station_ids))
+        nc.createDimension('time', 1)
+        time_var = nc.createVariable('time', 'i', ('time',))
+        time_var.units = 'seconds since 2016-06-21 00:00 UTC'
+        time_var[:] = int((valid_time - datetime(2016, 6, 21)).total_seconds())
+        for name, units in [('streamflow', 'meter^3 / sec'),
+                            ('velocity', 'meter/sec')]:
+            if packed:
+                var = nc.createVariable(name, 'i4', ('station',),
+                                        fill_value=FILL_VALUE)
+                var.scale_factor = SCALE_FACTOR
+                var.add_offset = 0.0
+            else:
+                var = nc.createVariable(name, 'f4', ('station',))
+            var.units = units
+            var.long_name = name.title()
+            values = np.round(rs.uniform(0, 500, len(station_ids)), 2)
+            values = np.ma.array(values, mask=np.zeros(len(values), bool))
+            values[list(masked)] = np.ma.masked
+            var[:] = values
+        id_var = nc.createVariable('station_id', 'i', ('station',))
+        id_var[:] = station_ids
+
+
+def gzip_file(filename):
+    with open(filename, 'rb') as f, gzip.open(filename + '.gz', 'wb') as gz:
+        shutil.copyfileobj(f, gz)
+    return filename + '.gz'
+
+
+def make_forecast(folder, count=4, packed=False, gz=False, masked=(),
+                  permute_at=None):
+    """Writes the files of a short range forecast and returns their names.
+
+    Args:
+        folder: Folder for the files.
+        count: Number of time steps.
+        packed: True to store values as scaled integers.
+        gz: True to gzip the files.
+        masked: Positions of rivers with missing values in every file.
+        permute_at: (Optional) Position of a file whose stations are stored
+            in a different order.
+    """
+
+    files = []
+    for i in range(count):
+        filename = str(folder.join(
+            'nwm.t00z.short_range.channel_rt.f{0:03d}.conus.nc'.format(
+                i + 1)))
+        station_ids = STATION_IDS
+        if i == permute_at:
+            station_ids = STATION_IDS[::-1]
+        make_channel_file(filename, station_ids,
+                          FIRST_VALID_TIME + timedelta(hours=i), seed=i,
+                          packed=packed, masked=masked)
+        files.append(gzip_file(filename) if gz else filename)
+    return files
+
+
+@pytest.fixture
+def forecast_files(tmpdir):
+    return make_forecast(tmpdir)
+
+
+@pytest.fixture
+def packed_files(tmpdir):
+    return make_forecast(tmpdir, packed=True, masked=[0])
+
+
+@pytest.fixture
+def make_files(tmpdir):
+    """Returns make_forecast writing to a temporary folder."""
+
+    return lambda **kwargs: make_forecast(tmpdir, **kwargs)
+
+
+class _HydroShareHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Serves saved HydroShare responses, redirects and proxied requests.
+
+    get-netcdf-data returns the error JSON for COMID 1 and the 500 error page
+    for COMID 2.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body='', headers=()):
+        self.send_response(status)
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_file(self, name, status=200):
+        with open(os.path.join(JSON_FOLDER, name)) as f:
+            self._send(status, f.read())
+
+    def do_GET(self):
+        path = self.path
+        if path.startswith('http://'):
+            self.server.proxied.append(
+                (path, self.headers.get('Proxy-Authorization')))
+            path = urlparse.urlunsplit(
+                ('', '') + urlparse.urlsplit(path)[2:])
+        parts = urlparse.urlsplit(path)
+        query = urlparse.parse_qs(parts.query)
+        if parts.path.endswith('/get-netcdf-data'):
+            comid = query['comid'][0]
+            if comid == '1':
+                self._send_file('get-netcdf-data_error.json')
+            elif comid == '2':
+                self._send_file('get-netcdf-dadta_500_error.html', 500)
+            else:
+                self._send_file(
+                    'get-netcdf-data_{0}.json'.format(query['config'][0]))
+        elif parts.path.rstrip('/').endswith('/GetFileList'):
+            self._send_file('analysis_file_list.json')
+        elif parts.path == '/redirect':
+            self._send(302, headers=[('Location', query['to'][0])])
+        elif parts.path == '/loop':
+            self._send(302, headers=[('Location', '/loop')])
+        elif parts.path == '/moved':
+            self._send(301, 'moved')
+        elif parts.path == '/hello':
+            self._send(200, 'hello')
+        else:
+            self._send(404, 'not found')
+
+
+class _ThreadedHTTPServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture
+def hydroshare(monkeypatch):
+    """Points nwm at a local HydroShare stand-in and returns the server.
+
+    The server's url attribute is its base URI, and proxied lists the URI
+    and Proxy-Authorization header of requests made through it as a proxy.
+    """
+
+    server = _ThreadedHTTPServer(('127.0.0.1', 0), _HydroShareHandler)
+    server.proxied = []
+    server.url = 'http://127.0.0.1:{0}/'.format(server.server_address[1])
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setattr(nwm, '_hydroshare_url', server.url + 'apps/')
+    for name in ('http_proxy', 'https_proxy', 'no_proxy', 'HTTP_PROXY',
+                 'HTTPS_PROXY', 'NO_PROXY'):
+        monkeypatch.delenv(name, raising=False)
+    nwm.listing_cache.invalidate()
+    yield server
+    server.shutdown()
+    server.server_close()
+    connections.default_pool.close()
+    nwm.listing_cache.invalidate()
+
+
+def make_noaa_tree(root):
+    """Writes empty model files as laid out on NOAA's FTP server.
+
+    Both nwm.20160927 and nwm.20160928 have analysis_assim files (channel and
+    land) for every cycle and long range files for every cycle and member.
+    Short range is complete on the 27th, but only has cycles 0 to 12 on the
+    28th. There is no medium_range folder.
+
+    Returns:
+        Local folder matching noaa_nwm._root_folder.
+    """
+
+    prod = root.join(*noaa_nwm._root_folder.strip('/').split('/'))
+    for datefolder in ('nwm.20160927', 'nwm.20160928'):
+        folder = prod.join(datefolder)
+        for cycle in range(24):
+            for kind in ('channel_rt', 'land'):
+                folder.join('analysis_assim').ensure(
+                    'nwm.t{0:02d}z.analysis_assim.{1}.tm00.conus.nc.gz'.format(
+                        cycle, kind))
+            if datefolder == 'nwm.20160928' and cycle > 12:
+                continue
+            for hour in range(1, 16):
+                folder.join('short_range').ensure(
+                    'nwm.t{0:02d}z.short_range.channel_rt.f{1:03d}.conus.nc.gz'
+                    .format(cycle, hour))
+        for cycle in (0, 6, 12, 18):
+            for member in range(1, 5):
+                for hour in (6, 720):
+                    folder.join('long_range_mem{0}'.format(member)).ensure(
+                        'nwm.t{0:02d}z.long_range.channel_rt_{1}.f{2:03d}'
+                        '.conus.nc.gz'.format(cycle, member, hour))
+    return prod
+
+
+@pytest.fixture
+def noaa_ftp(tmpdir, monkeypatch):
+    """Points noaa_nwm at a local FTP server of make_noaa_tree files.
+
+    Returns:
+        Local folder matching noaa_nwm._root_folder.
+    """
+
+    logging.getLogger('pyftpdlib').setLevel(logging.ERROR)
+    root = tmpdir.mkdir('ftp')
+    prod = make_noaa_tree(root)
+    authorizer = DummyAuthorizer()
+    authorizer.add_anonymous(str(root))
+
+    class Handler(FTPHandler):
+        pass
+    Handler.authorizer = authorizer
+    # ThreadedFTPServer shares its IOLoop and exit event between instances,
+    # so stopping the server of another test would stop this one.
+    server = ThreadedFTPServer(('127.0.0.1', 0), Handler, IOLoop())
+    server._exit = threading.Event()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    monkeypatch.setattr(noaa_nwm, '_ftp_url', '127.0.0.1')
+    monkeypatch.setattr(noaa_nwm, '_ftp_port', server.address[1])
+    noaa_nwm.clear_listing_cache()
+    yield prod
+    server.close_all()
+    noaa_nwm.clear_listing_cache()
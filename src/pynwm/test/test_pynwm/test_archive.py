@@ -0,0 +1,76 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
+
+from pynwm import archive
+from pynwm import nwm
+
+COMIDS = [88, 42, 5671187, 7, 313]
+
+
+def _expected(files, comids):
+    """Returns streamflow of files read by nwm, sized by (rivers, times)."""
+
+    return nwm.build_streamflow_cube(
+        files, comids, consistent_comid_order=False)[0].T.astype(np.float32)
+
+
+def test_ingest_is_idempotent(make_files, tmpdir):
+    files = make_files(count=6, packed=True, masked=[5], permute_at=3)
+    filename = str(tmpdir.join('history.nc'))
+    with archive.StreamflowArchive.create(filename, COMIDS,
+                                          station_chunk=2,
+                                          time_chunk=4) as history:
+        assert history.ingest(files[2:5], batch_size=2) == 3
+        assert history.ingest(files[::-1], batch_size=4) == 3
+        assert history.ingest(files) == 0
+    with archive.StreamflowArchive(filename, 'a') as history:
+        assert history.ingest(files + files) == 0
+        assert len(history.times) == 6
+
+        times, q = history.query(COMIDS)
+    assert_array_equal(times, np.arange(
+        np.datetime64('2016-06-21T01:00', 's'),
+        np.datetime64('2016-06-21T07:00', 's'), np.timedelta64(1, 'h')))
+    expected = _expected(files, COMIDS)
+    # Station 42 is missing except in the file with stations reversed.
+    assert_array_equal(np.isnan(q[1]), [True] * 3 + [False] + [True] * 2)
+    assert_array_equal(q, expected)
+
+
+def test_query_time_range_and_comids(make_files, tmpdir):
+    files = make_files(count=5)
+    filename = str(tmpdir.join('history.nc'))
+    with archive.StreamflowArchive.create(filename, COMIDS) as history:
+        history.ingest(files[::-1])
+    expected = _expected(files, COMIDS)
+
+    with archive.StreamflowArchive(filename) as history:
+        times, q = history.query([7, 88, 7], '2016-06-21 02:00',
+                                 '2016-06-21T04:00')
+        assert_array_equal(times, np.array(
+            ['2016-06-21T02:00', '2016-06-21T03:00', '2016-06-21T04:00'],
+            'datetime64[s]'))
+        assert_array_equal(q, expected[[3, 0, 3], 1:4])
+
+        times, q = history.query(313, start_date='2016-06-21 04:30')
+        assert_array_equal(q, expected[4, 4:])
+        times, q = history.query(np.array([42]), end_date='2016-06-21 01:00')
+        assert_array_equal(q, expected[[1], :1])
+        times, q = history.query([42, 88], '2016-06-22')
+        assert len(times) == 0 and q.shape == (2, 0)
+        with pytest.raises(ValueError):
+            history.query([42, 43])
+
+
+def test_duplicate_comids(make_files, tmpdir):
+    files = make_files(count=3)
+    filename = str(tmpdir.join('history.nc'))
+    comids = [42, 7, 42, 88]
+    with archive.StreamflowArchive.create(filename, comids) as history:
+        assert history.ingest(files) == 3
+    with archive.StreamflowArchive(filename) as history:
+        assert_array_equal(history.comids, comids)
+        assert history.rows([42])[0] in (0, 2)
+        times, q = history.query([42, 88, 42])
+        assert_array_equal(q, _expected(files, [42, 88, 42]))
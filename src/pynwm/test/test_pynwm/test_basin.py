@@ -0,0 +1,87 @@
+from datetime import datetime
+
+import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
+
+from pynwm import basin
+from pynwm import nwm
+
+COMIDS = [42, 5671187, 7]
+
+
+def test_create_append_and_read(tmpdir):
+    filename = str(tmpdir.join('basin.nwmb'))
+    with basin.BasinStore.create(filename, COMIDS) as store:
+        assert len(store) == 0
+        times, q = store.read()
+        assert len(times) == 0 and q.shape == (0, 3)
+        store.append(datetime(2016, 6, 21, 1), [1.5, 2.5, 3.5])
+        store.append('2016-06-21 02:00', [4.5, np.nan, 6.5])
+        with pytest.raises(ValueError):
+            store.append(datetime(2016, 6, 21, 2), [1, 2, 3])
+        with pytest.raises(ValueError):
+            store.append(datetime(2016, 6, 21, 3), [1, 2])
+        assert len(store) == 2
+
+    with basin.BasinStore(filename) as store:
+        assert_array_equal(store.comids, COMIDS)
+        assert_array_equal(store.times, np.array(
+            ['2016-06-21T01:00', '2016-06-21T02:00'], 'datetime64[s]'))
+        times, q = store.read()
+        assert_array_equal(q, [[1.5, 2.5, 3.5], [4.5, np.nan, 6.5]])
+        times, q = store.read('2016-06-21 01:30', comids=[7, 42])
+        assert_array_equal(times, np.array(['2016-06-21T02:00'],
+                                           'datetime64[s]'))
+        assert_array_equal(q, [[6.5, 4.5]])
+        times, q = store.read(end_date='2016-06-21 01:00', comids=5671187)
+        assert_array_equal(q, [2.5])
+        with pytest.raises(ValueError):
+            store.read(comids=[42, 43])
+        with pytest.raises(IOError):
+            store.append(datetime(2016, 6, 21, 3), [1, 2, 3])
+
+
+def test_reopen_drops_incomplete_record(tmpdir):
+    filename = str(tmpdir.join('basin.nwmb'))
+    with basin.BasinStore.create(filename, COMIDS) as store:
+        store.append(datetime(2016, 6, 21, 1), [1, 2, 3])
+    with open(filename, 'ab') as f:
+        f.write('partial')
+    with basin.BasinStore(filename) as reader:
+        assert len(reader) == 1
+        with basin.BasinStore(filename, 'a') as store:
+            store.append(datetime(2016, 6, 21, 2), [4, 5, 6])
+        # Records appended by another store are read without reopening.
+        assert_array_equal(reader.read()[1], [[1, 2, 3], [4, 5, 6]])
+        assert len(reader) == 2
+
+
+def test_not_a_basin_store(tmpdir):
+    filename = str(tmpdir.join('other.bin'))
+    with open(filename, 'wb') as f:
+        f.write('NOTBASIN' + '\0' * 16)
+    with pytest.raises(ValueError):
+        basin.BasinStore(filename)
+    with pytest.raises(ValueError):
+        basin.BasinStore(filename, 'w')
+
+
+def test_ingest_files_once(make_files, tmpdir):
+    files = make_files(count=4, packed=True, masked=[5], permute_at=2)
+    filename = str(tmpdir.join('basin.nwmb'))
+    with basin.BasinStore.create(filename, COMIDS) as store:
+        assert store.ingest(files[:3]) == 3
+    with basin.BasinStore(filename, 'a') as store:
+        assert store.ingest(files) == 1
+        assert store.ingest(files) == 0
+        assert len(store) == 4
+
+    expected = nwm.build_streamflow_cube(files, COMIDS,
+                                         consistent_comid_order=False)[0]
+    with basin.BasinStore(filename) as store:
+        times, q = store.read()
+    # Station 42 is masked except in the file with stations reversed.
+    assert_array_equal(np.isnan(q[:, 0]), [True, True, False, True])
+    assert_array_equal(q, expected.astype(np.float32))
+    assert times[0] == np.datetime64('2016-06-21T01:00', 's')
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+import os
+
+from pynwm import cache
+
+
+class _Clock(object):
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _use_clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache.time, 'time', clock)
+    return clock
+
+
+def test_expiry(monkeypatch):
+    clock = _use_clock(monkeypatch)
+    ttl_cache = cache.TTLCache(ttl=60)
+    assert ttl_cache.get('listing') is None
+    ttl_cache.set('listing', '["a.nc"]')
+    clock.now += 59
+    assert ttl_cache.get('listing') == '["a.nc"]'
+    clock.now += 1
+    assert ttl_cache.get('listing') is None
+    assert (ttl_cache.hits, ttl_cache.misses) == (1, 2)
+    ttl_cache.set('listing', '["a.nc", "b.nc"]')
+    assert ttl_cache.get('listing') == '["a.nc", "b.nc"]'
+    ttl_cache.reset_counters()
+    assert (ttl_cache.hits, ttl_cache.misses) == (0, 0)
+
+
+def test_invalidate(tmpdir):
+    ttl_cache = cache.TTLCache(cache_dir=str(tmpdir))
+    for key in ('a', 'b', 'c'):
+        ttl_cache.set(key, key * 2)
+    tmpdir.join('other.json').write('{}')
+    ttl_cache.invalidate('a')
+    assert ttl_cache.get('a') is None and ttl_cache.get('b') == 'bb'
+    assert len(tmpdir.listdir()) == 3
+    ttl_cache.invalidate()
+    assert ttl_cache.get('b') is None and ttl_cache.get('c') is None
+    assert [p.basename for p in tmpdir.listdir()] == ['other.json']
+    ttl_cache.invalidate('missing')
+    cache.TTLCache().invalidate()
+
+
+def test_disk_round_trip(tmpdir, monkeypatch):
+    clock = _use_clock(monkeypatch)
+    cache_dir = str(tmpdir.join('cache'))
+    writer = cache.TTLCache(ttl=60, cache_dir=cache_dir)
+    writer.set(u'GetFileList/?config=é', 'listing é')
+    writer.set('plain', u'unicode value ü')
+
+    clock.now += 30
+    reader = cache.TTLCache(ttl=60, cache_dir=cache_dir)
+    value = reader.get('GetFileList/?config=é')
+    assert value == 'listing é' and type(value) is str
+    assert reader.get(u'GetFileList/?config=é') == 'listing é'
+    value = reader.get(u'plain')
+    assert value == 'unicode value ü' and type(value) is str
+    assert reader.hits == 3
+
+    # A newer value from another process replaces an expired one.
+    clock.now += 40
+    writer.set('plain', 'newer')
+    assert reader.get('plain') == 'newer'
+    clock.now += 60
+    assert reader.get('plain') is None
+    assert len(os.listdir(cache_dir)) == 2
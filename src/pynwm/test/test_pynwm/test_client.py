@@ -0,0 +1,24 @@
+from urllib2 import HTTPError
+
+import pytest
+
+from pynwm import client
+from pynwm import connections
+
+
+def test_client_runs_requests_in_background(hydroshare):
+    max_idle = connections.default_pool.max_idle
+    finished = []
+    with client.HydroShareClient(max_concurrency=max_idle * 2,
+                                 timeout=30) as c:
+        requests = [c.get_streamflow('short_range', comid,
+                                     '2016-06-21 16:00')
+                    for comid in (5671187, 2)]
+        requests[0].add_done_callback(finished.append)
+        series = requests[0].result()
+        assert series[0]['name'] == 'short_range'
+        assert isinstance(requests[1].exception(), HTTPError)
+        with pytest.raises(HTTPError):
+            requests[1].result()
+    assert finished == [requests[0]]
+    assert connections.default_pool.max_idle == max_idle
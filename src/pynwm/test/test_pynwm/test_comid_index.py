@@ -0,0 +1,99 @@
+from multiprocessing.pool import ThreadPool
+import os
+
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from pynwm import comid_index
+
+
+def _station_ids(seed, count=1000):
+    return np.random.RandomState(seed).permutation(count).astype(np.int32)
+
+
+def test_indices():
+    nc_comids = _station_ids(0)
+    index = comid_index.ComidIndex(nc_comids)
+    comids = [5, 999, 0, 5]
+    assert_array_equal(nc_comids[index.indices(comids)], comids)
+    assert len(index) == 1000
+
+
+def test_lru_eviction():
+    cache = comid_index.ComidIndexCache(max_size=2)
+    a, b, c = _station_ids(0), _station_ids(1), _station_ids(2)
+    index_a = cache.get(a)
+    cache.get(b)
+    assert cache.get(a) is index_a
+    cache.get(c)
+    fingerprints = [comid_index.fingerprint_station_ids(ids)
+                    for ids in (a, b, c)]
+    # b was used least recently, so it was evicted.
+    assert list(cache._indices) == [fingerprints[0], fingerprints[2]]
+    assert (cache.hits, cache.misses) == (1, 3)
+    cache.get(b)
+    assert list(cache._indices) == [fingerprints[2], fingerprints[1]]
+    assert (cache.hits, cache.misses) == (1, 4)
+    cache.clear()
+    cache.get(c)
+    assert (cache.hits, cache.misses) == (1, 5)
+
+
+def test_changed_comids_get_new_index():
+    cache = comid_index.ComidIndexCache()
+    nc_comids = _station_ids(0)
+    index = cache.get(nc_comids)
+    assert cache.get(nc_comids.copy()) is index
+    assert cache.get(nc_comids.astype(np.int64)) is not index
+
+    changed = nc_comids.copy()
+    changed[nc_comids == 7] = 5000
+    changed_index = cache.get(changed)
+    assert changed_index is not index
+    assert changed_index.fingerprint != index.fingerprint
+    assert_array_equal(changed[changed_index.indices([5000, 8])], [5000, 8])
+    assert (cache.hits, cache.misses) == (1, 3)
+
+
+def test_sidecar_reload(tmpdir):
+    cache_dir = str(tmpdir.join('cache'))
+    nc_comids = _station_ids(0)
+    index = comid_index.ComidIndexCache(cache_dir=cache_dir).get(nc_comids)
+    filename = os.path.join(cache_dir, 'comid_index_{0}.npy'.format(
+        index.fingerprint))
+    assert os.listdir(cache_dir) == [os.path.basename(filename)]
+
+    cache = comid_index.ComidIndexCache(cache_dir=cache_dir)
+    loaded = cache.get(nc_comids)
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert_array_equal(loaded.sorted_index, index.sorted_index)
+    assert_array_equal(loaded.indices([3, 4]), index.indices([3, 4]))
+    assert cache.get(nc_comids) is loaded
+
+    # The order is read from the sidecar rather than sorted again.
+    np.save(filename, index.sorted_index[::-1])
+    cache = comid_index.ComidIndexCache(cache_dir=cache_dir)
+    assert_array_equal(cache.get(nc_comids).sorted_index,
+                       index.sorted_index[::-1])
+
+    # A sidecar of the wrong length is rebuilt.
+    np.save(filename, np.arange(10))
+    cache = comid_index.ComidIndexCache(cache_dir=cache_dir)
+    assert_array_equal(cache.get(nc_comids).sorted_index, index.sorted_index)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert len(np.load(filename)) == 1000
+
+
+def test_counts_from_threads():
+    cache = comid_index.ComidIndexCache(max_size=3)
+    layouts = [_station_ids(seed) for seed in range(4)]
+    pool = ThreadPool(8)
+    try:
+        indices = pool.map(lambda i: cache.get(layouts[i % 4]), range(200))
+    finally:
+        pool.close()
+        pool.join()
+    assert cache.hits + cache.misses == 200
+    for i, index in enumerate(indices):
+        assert index.fingerprint == comid_index.fingerprint_station_ids(
+            layouts[i % 4])
@@ -0,0 +1,55 @@
+import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
+
+from pynwm import cube
+from pynwm import ncfiles
+from pynwm import nwm
+from pynwm import reductions
+
+
+@pytest.mark.parametrize('gz', [False, True])
+def test_cube_matches_build_streamflow_cube(make_files, gz):
+    files = make_files(packed=True, gz=gz, masked=[0, 4])
+    expected = nwm.build_streamflow_cube(files, compute_max=False,
+                                         dtype=np.float32)[0]
+    assert np.isnan(expected[0, 0])
+    with cube.StreamflowCube(files) as c:
+        assert_array_equal(c[:], expected)
+        assert_array_equal(c[0, [1, 2, 3]], expected[0, [1, 2, 3]])
+        assert_array_equal(c[0, 1:4], expected[0, 1:4])
+        assert_array_equal(c[:, [4, 0, 9]], expected[:, [4, 0, 9]])
+        assert_array_equal(c.max(axis=0), expected.max(axis=0))
+
+
+def test_cube_subset_matches_build_streamflow_cube(make_files):
+    files = make_files(packed=True, masked=[0], permute_at=2)
+    comids = [5670795, 5671187, 9000001]
+    expected = nwm.build_streamflow_cube(
+        files, comids, consistent_comid_order=False, compute_max=False,
+        dtype=np.float32)[0]
+    with cube.StreamflowCube(files, consistent_comid_order=False) as c:
+        q = c.subset(comids)
+        assert_array_equal(q[:], expected)
+        assert_array_equal(q[:, [2, 0]], expected[:, [2, 0]])
+        assert np.all(expected[:, 0] > 0)
+
+
+def test_cube_reduce_unzips_each_file_once(make_files, monkeypatch):
+    files = make_files(count=6, gz=True)
+    gunzipped = []
+    gunzip = ncfiles.gunzip
+
+    def counting_gunzip(zip_filename, nc_filename):
+        gunzipped.append(zip_filename)
+        gunzip(zip_filename, nc_filename)
+
+    monkeypatch.setattr(ncfiles, 'gunzip', counting_gunzip)
+    q = nwm.build_streamflow_cube(files, dtype=np.float32)[0]
+    del gunzipped[:]
+    with cube.StreamflowCube(files) as c:
+        result = c.reduce([reductions.Mean(), reductions.TimeOfPeak()])
+    assert sorted(gunzipped) == sorted(files)
+    assert np.allclose(result['mean_streamflow'], q.mean(axis=0))
+    assert np.array_equal(result['time_of_max_streamflow'],
+                          q.argmax(axis=0) * 3600)
@@ -0,0 +1,56 @@
+import gzip
+
+from pynwm import download
+from pynwm import noaa_nwm
+
+FOLDER = 'nwm.20160928/short_range'
+NAMES = ['nwm.t00z.short_range.channel_rt.f001.conus.nc.gz',
+         'nwm.t00z.short_range.channel_rt.f002.conus.nc.gz']
+
+
+def _write_gz(noaa_ftp, name, data):
+    with gzip.open(str(noaa_ftp.join(FOLDER, name)), 'wb') as f:
+        f.write(data)
+
+
+def _paths(names):
+    return ['{0}{1}/{2}'.format(noaa_nwm._root_folder, FOLDER, name)
+            for name in names]
+
+
+def test_download_files_decompress(noaa_ftp, tmpdir):
+    for i, name in enumerate(NAMES):
+        _write_gz(noaa_ftp, name, 'model output {0}'.format(i) * 1000)
+    out = tmpdir.mkdir('out')
+    results = download.download_files(_paths(NAMES), str(out), workers=2,
+                                      decompress=True)
+    assert [r['status'] for r in results] == ['downloaded', 'downloaded']
+    for i, result in enumerate(results):
+        assert result['filename'] == str(out.join(NAMES[i][:-3]))
+        with open(result['filename']) as f:
+            assert f.read() == 'model output {0}'.format(i) * 1000
+    assert sorted(f.basename for f in out.listdir()) == sorted(
+        name[:-3] for name in NAMES)
+
+    results = download.download_files(_paths(NAMES), str(out),
+                                      decompress=True)
+    assert [r['status'] for r in results] == ['skipped', 'skipped']
+
+
+def test_download_files_failure_drops_connection(noaa_ftp, tmpdir,
+                                                 monkeypatch):
+    _write_gz(noaa_ftp, NAMES[0], 'model output')
+    dropped = []
+    drop = download._FtpConnections.drop
+
+    def recording_drop(self, host, port):
+        dropped.append((host, port))
+        drop(self, host, port)
+
+    monkeypatch.setattr(download._FtpConnections, 'drop', recording_drop)
+    paths = _paths(['missing.nc.gz', NAMES[0]])
+    results = download.download_files(paths, str(tmpdir), workers=1)
+    assert [r['status'] for r in results] == ['failed', 'downloaded']
+    assert dropped == [('127.0.0.1', noaa_nwm._ftp_port)]
+    with gzip.open(results[1]['filename']) as f:
+        assert f.read() == 'model output'
@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+import os
+
+from netCDF4 import Dataset
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+import pytz
+
+from pynwm import ensemble
+
+
+def _write_member_file(folder, init_time, member, hour, q):
+    """Writes a long range channel file without a date folder."""
+
+    filename = os.path.join(folder, (
+        'nwm.t{0:02d}z.long_range.channel_rt_{1}.f{2:03d}.conus.nc'.format(
+            init_time.hour, member, hour)))
+    valid_time = init_time + timedelta(hours=hour)
+    with Dataset(filename, 'w') as nc:
+        nc.model_output_valid_time = valid_time.strftime('%Y-%m-%d_%H:%M:%S')
+        nc.createDimension('station', len(q))
+        var = nc.createVariable('streamflow', 'i4', ('station',),
+                                fill_value=-999900)
+        var.scale_factor = 0.01
+        var[:] = np.ma.masked_invalid(q)
+        nc.createVariable('station_id', 'i', ('station',))[:] = [7, 42, 313]
+    return filename
+
+
+def test_group_members_across_days(tmpdir):
+    folder = str(tmpdir)
+    day1 = datetime(2016, 6, 21, 18)
+    day2 = datetime(2016, 6, 22, 18)
+    q = [1.0, 2.0, 3.0]
+    # The same cycle hour, member and forecast hour on two days, in folders
+    # without the date.
+    files = [_write_member_file(str(tmpdir.mkdir('later')), day2, 1, 6, q),
+             _write_member_file(folder, day1, 1, 12, q),
+             _write_member_file(folder, day1, 1, 6, q),
+             _write_member_file(folder, day1, 2, 6, q)]
+    # The 00z cycle of the first day, from a NOAA folder.
+    noaa_folder = str(tmpdir.mkdir('nwm.20160621').mkdir('long_range_mem1'))
+    noaa_files = [
+        _write_member_file(noaa_folder, datetime(2016, 6, 21), 1, hour, q)
+        for hour in (6, 12)]
+
+    members = ensemble.group_members(files + noaa_files[::-1], workers=2)
+    assert members == [noaa_files, [files[2], files[1]], [files[3]],
+                       [files[0]]]
+
+
+def test_ensemble_stats_ignore_missing_values(tmpdir):
+    folder = str(tmpdir)
+    init_time = datetime(2016, 6, 21)
+    nan = np.nan
+    # Member by hour by river; the third river is missing at hour 6.
+    values = [[[1.0, 10.0, nan], [2.0, 20.0, 5.0]],
+              [[3.0, nan, nan], [4.0, 40.0, 6.0]],
+              [[8.0, 30.0, nan]]]
+    members = [[_write_member_file(folder, init_time, m + 1, 6 * (h + 1), q)
+                for h, q in enumerate(hours)]
+               for m, hours in enumerate(values)]
+
+    stats = ensemble.ensemble_stats(members, [7, 42, 313],
+                                    percentiles=[0, 50, 100])
+    assert stats['dates'] == [datetime(2016, 6, 21, 6, tzinfo=pytz.utc),
+                              datetime(2016, 6, 21, 12, tzinfo=pytz.utc)]
+    assert_array_equal(stats['members'], [3, 2])
+    assert_allclose(stats['mean'], [[4.0, 20.0, nan], [3.0, 30.0, 5.5]],
+                    rtol=1e-6)
+    assert_allclose(stats['spread'],
+                    [[np.sqrt(26 / 3.0), 10.0, nan], [1.0, 10.0, 0.5]],
+                    rtol=1e-6)
+    assert_allclose(stats['percentiles'][:, 0], [[1.0, 10.0, nan],
+                                                 [3.0, 20.0, nan],
+                                                 [8.0, 30.0, nan]],
+                    rtol=1e-6)
+    assert_allclose(stats['percentiles'][:, 1], [[2.0, 20.0, 5.0],
+                                                 [3.0, 30.0, 5.5],
+                                                 [4.0, 40.0, 6.0]],
+                    rtol=1e-6)
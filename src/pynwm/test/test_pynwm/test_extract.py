@@ -0,0 +1,66 @@
+import csv
+
+import numpy as np
+import pytest
+from netCDF4 import Dataset
+from numpy.testing import assert_array_equal
+
+from pynwm import extract
+
+
+def _read_expected(nc_files):
+    """Returns streamflow of the files read with netCDF4, NaN if masked."""
+
+    values = []
+    for nc_file in nc_files:
+        with Dataset(nc_file, 'r') as nc:
+            values.append(nc.variables['streamflow'][:].filled(np.nan))
+    return np.array(values, np.float32)
+
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_extract_table_missing_values(make_files, packed):
+    files = make_files(count=3, packed=packed, masked=[1])
+    expected = _read_expected(files)
+    assert np.isnan(expected[:, 1]).all()
+
+    table = extract.extract_table(files[::-1], [5670795, 5671187, 42])
+    assert_array_equal(table['comids'], [5670795, 5671187, 42])
+    assert_array_equal(table['dates'], np.array(
+        ['2016-06-21T01:00', '2016-06-21T02:00', '2016-06-21T03:00'],
+        'datetime64[s]'))
+    assert_array_equal(table['values'], expected[:, [1, 0, 5]])
+
+    table = extract.extract_table(files, None)
+    assert_array_equal(table['comids'][:3], [5671187, 5670795, 101])
+    assert_array_equal(table['values'], expected)
+
+
+def test_extract_to_csv_missing_values(make_files, tmpdir):
+    files = make_files(count=2, packed=True, masked=[1])
+    expected = _read_expected(files)
+    output_file = str(tmpdir.join('gages.csv'))
+
+    rows = extract.extract_to_csv(files, [5671187, 5670795], output_file,
+                                  value_format='%.2f')
+    assert rows == 2
+    with open(output_file) as f:
+        lines = list(csv.reader(f))
+    assert lines[0] == ['datetime', '5671187', '5670795']
+    assert lines[1] == ['2016-06-21T01:00:00Z',
+                        '{0:.2f}'.format(expected[0, 0]), '']
+    assert lines[2] == ['2016-06-21T02:00:00Z',
+                        '{0:.2f}'.format(expected[1, 0]), '']
+
+
+def test_extract_without_station_id(tmpdir):
+    filename = str(tmpdir.join('no_ids.nc'))
+    with Dataset(filename, 'w') as nc:
+        nc.model_output_valid_time = '2016-06-21_01:00:00'
+        nc.createDimension('station', 2)
+        nc.createVariable('streamflow', 'f4', ('station',))[:] = [1.5, 2.5]
+
+    with pytest.raises(ValueError):
+        extract.extract_table([filename], None)
+    with pytest.raises(ValueError):
+        extract.extract_to_csv([filename], [], str(tmpdir.join('out.csv')))
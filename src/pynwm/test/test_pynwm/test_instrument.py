@@ -0,0 +1,117 @@
+import logging
+from multiprocessing.pool import ThreadPool
+
+import pytest
+
+from pynwm import instrument
+from pynwm import nwm
+from pynwm import scan
+
+
+@pytest.fixture(autouse=True)
+def no_sinks(monkeypatch):
+    """Starts each test disabled and without sinks."""
+
+    monkeypatch.setattr(instrument, 'enabled', False)
+    monkeypatch.setattr(instrument, '_sinks', [])
+
+
+def test_disabled_emits_nothing():
+    events = []
+    instrument.add_sink(events.append)
+    with instrument.stage('gunzip'):
+        instrument.count('bytes_unzipped', 10)
+    assert events == []
+    instrument.enable()
+    instrument.count('bytes_unzipped', 10)
+    instrument.disable()
+    instrument.count('bytes_unzipped', 10)
+    assert events == [{'type': 'counter', 'name': 'bytes_unzipped',
+                       'value': 10}]
+
+
+def test_stage_and_count(monkeypatch):
+    times = iter([100.0, 100.25, 200.0, 203.0])
+    monkeypatch.setattr(instrument.time, 'time', lambda: next(times))
+    events = []
+    instrument.enable(events.append)
+    with instrument.stage('read_netcdf'):
+        instrument.count('bytes_read', 400)
+    with pytest.raises(KeyError):
+        with instrument.stage('read_netcdf'):
+            raise KeyError('streamflow')
+    instrument.remove_sink(events.append)
+    instrument.count('bytes_read')
+    assert events == [
+        {'type': 'counter', 'name': 'bytes_read', 'value': 400},
+        {'type': 'stage', 'name': 'read_netcdf', 'seconds': 0.25},
+        {'type': 'stage', 'name': 'read_netcdf', 'seconds': 3.0}]
+
+
+def test_stats_sink():
+    stats = instrument.StatsSink()
+    for seconds in (0.5, 2.0, 1.0):
+        stats({'type': 'stage', 'name': 'http', 'seconds': seconds})
+    stats({'type': 'counter', 'name': 'bytes_downloaded', 'value': 1024})
+    stats({'type': 'counter', 'name': 'bytes_downloaded', 'value': 1})
+    assert stats.stages == {'http': {'count': 3, 'seconds': 3.5,
+                                     'max_seconds': 2.0}}
+    assert stats.counters == {'bytes_downloaded': 1025}
+    stats.reset()
+    assert stats.stages == {} and stats.counters == {}
+
+
+def test_logging_sink():
+    records = []
+
+    class Handler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    logger = logging.getLogger('pynwm.test_instrument')
+    logger.setLevel(logging.DEBUG)
+    handler = Handler()
+    logger.addHandler(handler)
+    try:
+        sink = instrument.LoggingSink(logger, logging.INFO)
+        sink({'type': 'stage', 'name': 'http', 'seconds': 0.5})
+        sink({'type': 'counter', 'name': 'comid_index_hits', 'value': 1})
+    finally:
+        logger.removeHandler(handler)
+    assert [r.levelno for r in records] == [logging.INFO] * 2
+    assert [r.getMessage() for r in records] == ['http took 0.500000 s',
+                                                 'comid_index_hits += 1']
+    assert instrument.LoggingSink().logger is logging.getLogger('pynwm')
+
+
+def test_stats_from_thread_pool():
+    stats = instrument.StatsSink()
+    instrument.enable(stats)
+
+    def work(i):
+        for _ in range(100):
+            with instrument.stage('work'):
+                instrument.count('items', i)
+
+    pool = ThreadPool(8)
+    try:
+        pool.map(work, range(16))
+    finally:
+        pool.close()
+        pool.join()
+    assert stats.stages['work']['count'] == 1600
+    assert stats.counters == {'items': 100 * sum(range(16))}
+
+
+def test_stats_of_reads(make_files):
+    files = make_files(count=4, gz=True)
+    stats = instrument.StatsSink()
+    instrument.enable(stats)
+    records = scan.scan_files(files, station_count=True, workers=4)
+    assert stats.stages['read_header']['count'] == 4
+    nwm.build_streamflow_cube(files, [42, 7])
+    instrument.disable()
+    nwm.build_streamflow_cube(files, [42, 7])
+    assert stats.stages['read_netcdf']['count'] == 4
+    assert stats.counters['bytes_read'] == 4 * 2 * 4
+    assert all(r['station_count'] == 10 for r in records)
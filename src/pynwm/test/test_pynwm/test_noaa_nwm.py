@@ -0,0 +1,94 @@
+from pynwm import noaa_nwm
+
+DATEFOLDERS = ['nwm.20160927', 'nwm.20160928']
+NEW_FILE = 'nwm.t13z.short_range.channel_rt.f016.conus.nc.gz'
+
+
+def test_list_files_all_products(noaa_ftp):
+    paths = noaa_nwm.list_files(DATEFOLDERS)
+    folders = {}
+    for path in paths:
+        folder = path[len(noaa_nwm._root_folder):].split('/')[1]
+        folders[folder] = folders.get(folder, 0) + 1
+    assert folders == {'analysis_assim': 48,
+                       'short_range': 24 * 15 + 13 * 15,
+                       'long_range_mem1': 16,
+                       'long_range_mem2': 16,
+                       'long_range_mem3': 16,
+                       'long_range_mem4': 16}
+    assert all('channel' in path for path in paths)
+    assert paths == sorted(paths)
+
+
+def test_list_files_long_range(noaa_ftp):
+    paths = noaa_nwm.list_files('nwm.20160927', 'long_range')
+    assert len(paths) == 32
+    assert {p.split('/')[-2] for p in paths} == set(
+        noaa_nwm._long_range_products)
+
+
+def test_crawl_records(noaa_ftp):
+    records = noaa_nwm.crawl('nwm.20160928', 'short_range')
+    assert len(records) == 13 * 15
+    record = records[0]
+    assert record['path'] == (noaa_nwm._root_folder + 'nwm.20160928/'
+                              'short_range/nwm.t00z.short_range.channel_rt.'
+                              'f001.conus.nc.gz')
+    assert record['datefolder'] == 'nwm.20160928'
+    assert record['folder_product'] == 'short_range'
+    assert record['cycle'] == 0 and record['forecast_hour'] == 1
+
+
+def test_crawler_new_only(noaa_ftp):
+    crawler = noaa_nwm.Crawler('short_range')
+    assert len(crawler.crawl(DATEFOLDERS, new_only=True)) == 37 * 15
+    assert crawler.crawl(DATEFOLDERS, new_only=True) == []
+
+    noaa_ftp.join('nwm.20160928', 'short_range').ensure(NEW_FILE)
+    # Listing by another caller does not hide the file from this crawler.
+    other = noaa_nwm.crawl(DATEFOLDERS, 'short_range')
+    assert len(other) == 37 * 15 + 1
+    records = noaa_nwm.Crawler('short_range').crawl(DATEFOLDERS,
+                                                    new_only=True)
+    assert len(records) == 37 * 15 + 1
+    records = crawler.crawl(DATEFOLDERS, new_only=True)
+    assert [r['path'].split('/')[-1] for r in records] == [NEW_FILE]
+    assert len(crawler.crawl(DATEFOLDERS)) == 37 * 15 + 1
+
+
+def test_complete_folders_are_not_listed_again(noaa_ftp):
+    noaa_nwm.list_files(DATEFOLDERS, 'short_range')
+    # The 27th is complete, so files added to it later are not seen.
+    noaa_ftp.join('nwm.20160927', 'short_range').ensure(NEW_FILE)
+    noaa_ftp.join('nwm.20160928', 'short_range').ensure(NEW_FILE)
+    paths = noaa_nwm.list_files(DATEFOLDERS, 'short_range')
+    assert [p for p in paths if p.endswith(NEW_FILE)] == [
+        noaa_nwm._root_folder + 'nwm.20160928/short_range/' + NEW_FILE]
+
+    noaa_nwm.clear_listing_cache()
+    paths = noaa_nwm.list_files(DATEFOLDERS, 'short_range')
+    assert len([p for p in paths if p.endswith(NEW_FILE)]) == 2
+
+
+def test_removed_folders_are_forgotten(noaa_ftp):
+    crawler = noaa_nwm.Crawler('short_range')
+    assert len(crawler.crawl()) == 37 * 15
+    assert len(noaa_nwm.crawl(DATEFOLDERS, 'short_range')) == 37 * 15
+    # NOAA removes the oldest date folder, which was complete.
+    noaa_ftp.join('nwm.20160927').remove()
+    records = noaa_nwm.crawl(DATEFOLDERS, 'short_range')
+    assert len(records) == 13 * 15
+    assert {r['datefolder'] for r in records} == {'nwm.20160928'}
+    assert len(crawler.crawl()) == 13 * 15
+    assert crawler.crawl(new_only=True) == []
+    assert not any('nwm.20160927' in folder
+                   for folder in noaa_nwm._folder_listings)
+    assert not any('nwm.20160927' in folder
+                   for folder in noaa_nwm._complete_folders)
+
+
+def test_listing_errors_are_logged(noaa_ftp, caplog):
+    paths = noaa_nwm.list_files('nwm.20160927',
+                                ['medium_range', 'analysis_assim'])
+    assert len(paths) == 24
+    assert 'medium_range' in caplog.text
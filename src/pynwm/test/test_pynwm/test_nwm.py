@@ -0,0 +1,383 @@
+from urllib2 import HTTPError
+
+from netCDF4 import Dataset
+import numpy as np
+from numpy.testing import assert_array_equal
+import pytest
+
+from pynwm import ncfiles
+from pynwm import nwm
+from pynwm import reductions
+
+
+def test_subset_channel_file_packed(packed_files, tmpdir):
+    in_file = packed_files[0]
+    out_file = str(tmpdir.join('subset.nc'))
+    comids = [5671187, 101, 7, 5781000]
+    nwm.subset_channel_file(in_file, out_file, comids)
+
+    with Dataset(in_file) as nc:
+        ids = list(nc.variables['station_id'][:])
+        positions = [ids.index(c) for c in comids]
+        expected = nc.variables['streamflow'][:][positions]
+    with Dataset(out_file) as nc:
+        q_var = nc.variables['streamflow']
+        assert q_var.dtype == np.int32
+        assert np.isclose(q_var.scale_factor, 0.01)
+        q = q_var[:]
+        assert list(nc.variables['station_id'][:]) == comids
+    assert q.mask[0] and not q.mask[1:].any()
+    assert np.allclose(q[1:], expected[1:])
+    assert np.all(q[1:] > 0)
+
+
+def test_get_streamflow_many_reports_errors_per_comid(hydroshare):
+    results = nwm.get_streamflow_many('short_range', [5671187, 1, 2],
+                                      '2016-06-21 16:00', workers=3)
+    assert results[5671187]['error'] is None
+    series = results[5671187]['series'][0]
+    assert series['name'] == 'short_range'
+    assert len(series['values']) == 15
+    assert results[1]['series'] is None
+    assert isinstance(results[1]['error'], ValueError)
+    assert results[2]['series'] is None
+    assert isinstance(results[2]['error'], HTTPError)
+    assert results[2]['error'].code == 500
+
+
+def _to_datetime64(dates):
+    """Returns timezone-aware datetimes as naive datetime64 wall times."""
+
+    return np.array([d.replace(tzinfo=None) for d in dates], 'datetime64[s]')
+
+
+@pytest.mark.parametrize('product', ['short_range', 'long_range'])
+@pytest.mark.parametrize('timezone', [None, 'US/Central'])
+def test_get_streamflow_as_arrays(hydroshare, product, timezone):
+    series = nwm.get_streamflow(product, 5671187, '2016-06-19', timezone)
+    arrays = nwm.get_streamflow(product, 5671187, '2016-06-19', timezone,
+                                as_arrays=True)
+    assert len(arrays) == len(series) == (16 if product == 'long_range'
+                                          else 1)
+    for array_series, list_series in zip(arrays, series):
+        assert array_series['name'] == list_series['name']
+        assert array_series['dates'].dtype == np.dtype('datetime64[s]')
+        assert_array_equal(array_series['dates'],
+                           _to_datetime64(list_series['dates']))
+        assert array_series['values'].dtype == np.float32
+        assert_array_equal(array_series['values'],
+                           np.array(list_series['values'], np.float32))
+    if timezone:
+        # Central Daylight Time is five hours behind UTC.
+        utc = nwm.get_streamflow(product, 5671187, '2016-06-19',
+                                 as_arrays=True)
+        assert_array_equal(arrays[0]['dates'],
+                           utc[0]['dates'] - np.timedelta64(5, 'h'))
+
+
+def test_get_streamflow_stack_members(hydroshare):
+    series = nwm.get_streamflow('long_range', 5671187, '2016-06-19')
+    stacked = nwm.get_streamflow('long_range', 5671187, '2016-06-19',
+                                 stack_members=True)
+    assert len(stacked) == 1
+    stacked = stacked[0]
+    assert stacked['name'] == 'long_range'
+    assert stacked['members'] == [s['name'] for s in series]
+    assert stacked['members'][:2] == ['Member 1 t00z', 'Member 2 t00z']
+    # Lagged cycles start 6, 12 and 18 hours after the first and each have
+    # 120 six-hourly values.
+    first = np.datetime64('2016-06-19T06:00', 's')
+    assert_array_equal(stacked['dates'],
+                       first + np.arange(123) * np.timedelta64(6, 'h'))
+    assert stacked['values'].shape == (16, 123)
+    assert stacked['values'].dtype == np.float32
+    for i, member in enumerate(series):
+        lag = i // 4
+        row = stacked['values'][i]
+        assert np.isnan(row[:lag]).all() and np.isnan(row[lag + 120:]).all()
+        assert_array_equal(row[lag:lag + 120],
+                           np.array(member['values'], np.float32))
+
+    local = nwm.get_streamflow('long_range', 5671187, '2016-06-19',
+                               'US/Central', stack_members=True)[0]
+    assert_array_equal(local['dates'],
+                       stacked['dates'] - np.timedelta64(5, 'h'))
+    assert_array_equal(local['values'], stacked['values'])
+
+
+def test_stack_series_aligns_dates():
+    hours = np.datetime64('2016-06-19T00:00', 's') + np.arange(
+        6) * np.timedelta64(1, 'h')
+    stacked = nwm._stack_series(
+        [{'name': 'a', 'dates': hours[2:5],
+          'values': np.array([1, 2, 3], np.float32)},
+         {'name': 'b', 'dates': hours[[0, 1, 5]],
+          'values': np.array([4, 5, 6], np.float32)}], 'short_range')
+    assert stacked['members'] == ['a', 'b']
+    assert_array_equal(stacked['dates'], hours)
+    nan = np.nan
+    assert_array_equal(stacked['values'], [[nan, nan, 1, 2, 3, nan],
+                                           [4, 5, nan, nan, nan, 6]])
+
+
+@pytest.mark.parametrize('gz', [False, True])
+@pytest.mark.parametrize('comids', [None, [5781000, 5671187, 88]])
+def test_build_streamflow_cube_parallel_matches_serial(make_files, gz,
+                                                       comids):
+    files = make_files(count=6, gz=gz, permute_at=3)
+    serial = nwm.build_streamflow_cube(files, comids,
+                                       consistent_comid_order=False)
+    parallel = nwm.build_streamflow_cube(files, comids,
+                                         consistent_comid_order=False,
+                                         workers=2)
+    out_q, out_t, seconds_since_date, max_q = parallel
+    assert out_q.shape == (6, 10 if comids is None else 3)
+    assert np.array_equal(out_q, serial[0])
+    assert np.array_equal(out_t, serial[1])
+    assert list(out_t) == [0, 3600, 7200, 10800, 14400, 18000]
+    assert seconds_since_date == serial[2]
+    assert np.array_equal(max_q, serial[3])
+
+
+@pytest.mark.parametrize('zlib, chunksizes', [(False, None), (True, None),
+                                              (True, (3, 4))])
+def test_combine_files_matches_build_streamflow_cube(make_files, tmpdir,
+                                                     zlib, chunksizes):
+    files = make_files(count=7, gz=True)
+    comids = [5781000, 5671187, 88, 313, 7]
+    out_file = str(tmpdir.join('combined.nc'))
+    nwm.combine_files(files, out_file, comids, zlib=zlib,
+                      chunksizes=chunksizes)
+    q, t, seconds_since_date, max_q = nwm.build_streamflow_cube(files,
+                                                                comids)
+    with Dataset(out_file) as nc:
+        q_var = nc.variables['streamflow']
+        assert q_var.dtype == np.float32
+        assert np.array_equal(q_var[:], q.astype(np.float32))
+        assert list(nc.variables['time'][:]) == list(t)
+        assert nc.variables['time'].units == 'seconds since {0}'.format(
+            seconds_since_date.strftime('%Y-%m-%d %H:%M %Z'))
+        assert list(nc.variables['station_id'][:]) == comids
+        assert np.allclose(nc.variables['max_streamflow'][:], max_q)
+        assert q_var.filters()['zlib'] == zlib
+        if zlib:
+            assert q_var.chunking() == list(chunksizes or (7, 5))
+        else:
+            assert q_var.chunking() == 'contiguous'
+
+
+def test_combine_files_reductions(make_files, tmpdir):
+    files = make_files(count=6)
+    out_file = str(tmpdir.join('combined.nc'))
+    thresholds = np.full(10, 250.0)
+    nwm.combine_files(files, out_file, reductions=[
+        reductions.Min(), reductions.Mean(), reductions.TimeOfPeak(),
+        reductions.ExceedanceCount(thresholds), reductions.MaxRateOfRise()])
+    q = nwm.build_streamflow_cube(files)[0]
+    with Dataset(out_file) as nc:
+        assert np.allclose(nc.variables['max_streamflow'][:], q.max(axis=0))
+        assert np.allclose(nc.variables['min_streamflow'][:], q.min(axis=0))
+        assert np.allclose(nc.variables['mean_streamflow'][:],
+                           q.mean(axis=0))
+        time_var = nc.variables['time_of_max_streamflow']
+        assert time_var.units == nc.variables['time'].units
+        assert np.array_equal(time_var[:], q.argmax(axis=0) * 3600)
+        assert np.array_equal(nc.variables['exceedance_count'][:],
+                              (q > thresholds).sum(axis=0))
+        assert np.allclose(nc.variables['max_rate_of_rise'][:],
+                           np.diff(q, axis=0).max(axis=0))
+
+
+def test_combine_files_reductions_need_streamflow(make_files, tmpdir):
+    files = make_files(count=2)
+    with pytest.raises(ValueError):
+        nwm.combine_files(files, str(tmpdir.join('combined.nc')),
+                          reductions=[reductions.Mean()],
+                          variables=['velocity'])
+
+
+def test_build_streamflow_cube_dtype_and_raw(make_files):
+    files = make_files(packed=True, masked=[2])
+    q = nwm.build_streamflow_cube(files)[0]
+    q32, _, _, max32 = nwm.build_streamflow_cube(files, dtype=np.float32)
+    assert q.dtype == np.float64 and q32.dtype == np.float32
+    assert_array_equal(q32, q.astype(np.float32))
+    assert max32.dtype == np.float32
+    assert np.isnan(q[:, 2]).all() and np.isnan(max32[2])
+
+    raw, _, _, raw_max = nwm.build_streamflow_cube(files, raw=True,
+                                                   dtype=np.float32)
+    assert raw.dtype == np.int32 and raw_max.dtype == np.int32
+    assert np.all(raw[:, 2] == -999900)
+    packing = nwm.read_streamflow_packing(files[0])
+    assert packing['dtype'] == np.int32
+    assert np.isclose(packing['scale_factor'], 0.01)
+    assert packing['add_offset'] == 0.0
+    assert packing['_FillValue'] == -999900
+    assert packing['missing_value'] is None
+    ok = raw != packing['_FillValue']
+    assert np.allclose(raw[ok] * packing['scale_factor'], q[ok])
+
+
+def test_combine_files_raw(make_files, tmpdir):
+    files = make_files(packed=True, masked=[2])
+    out_file = str(tmpdir.join('combined.nc'))
+    nwm.combine_files(files, out_file, raw=True,
+                      reductions=[reductions.Mean()])
+    raw = nwm.build_streamflow_cube(files, raw=True)[0]
+    q = nwm.build_streamflow_cube(files)[0]
+    with Dataset(out_file) as nc:
+        q_var = nc.variables['streamflow']
+        assert q_var.dtype == np.int32
+        assert np.isclose(q_var.scale_factor, 0.01)
+        assert q_var._FillValue == -999900
+        q_var.set_auto_maskandscale(False)
+        assert np.array_equal(q_var[:], raw)
+        q_var.set_auto_maskandscale(True)
+        assert q_var[:].mask[:, 2].all()
+        assert np.allclose(q_var[:][:, [0, 1, 3]], q[:, [0, 1, 3]])
+        mean_q = nc.variables['mean_streamflow'][:]
+    expected = np.ma.mean(_read_masked(files), axis=0)
+    assert np.isnan(mean_q[2])
+    assert np.allclose(mean_q[[0, 1, 3]], expected[[0, 1, 3]])
+
+
+def _read_masked(nc_files):
+    """Returns streamflow of the files read by netCDF4 as a masked array."""
+
+    values = []
+    for nc_file in nc_files:
+        with Dataset(nc_file) as nc:
+            values.append(nc.variables['streamflow'][:])
+    return np.ma.array(values)
+
+
+def test_reductions_ignore_missing_values(make_files, tmpdir):
+    files = make_files(count=5, packed=True, masked=[3])
+    with Dataset(files[0], 'a') as nc:
+        nc.variables['streamflow'][6] = np.ma.masked
+    with Dataset(files[2], 'a') as nc:
+        nc.variables['streamflow'][5] = np.ma.masked
+    q = _read_masked(files)
+    assert q.mask[:, 3].all() and q.mask.sum() == 7
+    thresholds = np.full(10, 250.0)
+    out_file = str(tmpdir.join('combined.nc'))
+    nwm.combine_files(files, out_file, reductions=[
+        reductions.Min(), reductions.Mean(), reductions.TimeOfPeak(),
+        reductions.ExceedanceCount(thresholds), reductions.MaxRateOfRise()])
+
+    hours = np.arange(5) * 3600.0
+    with Dataset(out_file) as nc:
+        results = dict((name, nc.variables[name][:]) for name in [
+            'max_streamflow', 'min_streamflow', 'mean_streamflow',
+            'time_of_max_streamflow', 'exceedance_count',
+            'max_rate_of_rise'])
+    for name in ['max_streamflow', 'min_streamflow', 'mean_streamflow',
+                 'max_rate_of_rise']:
+        assert np.isnan(results[name][3])
+    for i in [0, 1, 2, 4, 5, 6, 7, 8, 9]:
+        ok = ~q.mask[:, i]
+        river = q.data[ok, i].astype(np.float64)
+        assert np.isclose(results['max_streamflow'][i], river.max())
+        assert np.isclose(results['min_streamflow'][i], river.min())
+        assert np.isclose(results['mean_streamflow'][i], river.mean())
+        assert (results['time_of_max_streamflow'][i] ==
+                hours[ok][river.argmax()])
+        assert results['exceedance_count'][i] == (river > 250).sum()
+        # Rates only between consecutive hours with both values.
+        rises = np.diff(q[:, i]).compressed()
+        assert np.isclose(results['max_rate_of_rise'][i], rises.max())
+    assert results['time_of_max_streamflow'][3] == 0
+    assert results['exceedance_count'][3] == 0
+
+
+def test_build_streamflow_cube_variables(make_files):
+    files = make_files(packed=True, permute_at=1)
+    comids = [88, 5671187, 42]
+    values, t, seconds_since_date, max_values = nwm.build_streamflow_cube(
+        files, comids, consistent_comid_order=False,
+        variables=['streamflow', 'velocity'])
+    q, q_t, q_since_date, max_q = nwm.build_streamflow_cube(
+        files, comids, consistent_comid_order=False)
+    assert sorted(values) == ['streamflow', 'velocity']
+    assert np.array_equal(values['streamflow'], q)
+    assert np.array_equal(max_values['streamflow'], max_q)
+    assert np.array_equal(t, q_t) and seconds_since_date == q_since_date
+    for i, nc_file in enumerate(files):
+        velocity = nwm.read_q_for_comids(
+            nc_file, comids, ['velocity'])['values']['velocity']
+        assert np.allclose(values['velocity'][i], velocity)
+    assert np.array_equal(max_values['velocity'],
+                          values['velocity'].max(axis=0))
+
+
+def test_combine_files_variables_opens_first_file_once(make_files, tmpdir,
+                                                       monkeypatch):
+    files = make_files(packed=True, gz=True)
+    gunzipped = []
+    gunzip = ncfiles.gunzip
+
+    def counting_gunzip(zip_filename, nc_filename):
+        gunzipped.append(zip_filename)
+        gunzip(zip_filename, nc_filename)
+
+    monkeypatch.setattr(ncfiles, 'gunzip', counting_gunzip)
+    out_file = str(tmpdir.join('combined.nc'))
+    nwm.combine_files(files, out_file, raw=True,
+                      variables=['streamflow', 'velocity'])
+    # Once for the COMIDs, descriptions and packing, then once per time step.
+    assert sorted(gunzipped) == sorted(files + files[:1])
+
+    values = nwm.build_streamflow_cube(files, raw=True,
+                                       variables=['streamflow', 'velocity'])[0]
+    with Dataset(out_file) as nc:
+        for name, long_name in [('streamflow', 'Streamflow'),
+                                ('velocity', 'Velocity')]:
+            var = nc.variables[name]
+            assert var.long_name == long_name
+            assert var.dtype == np.int32
+            var.set_auto_maskandscale(False)
+            assert np.array_equal(var[:], values[name])
+        assert 'max_streamflow' in nc.variables
+
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_missing_values_are_nan(make_files, tmpdir, packed):
+    files = make_files(packed=packed, masked=[3])
+    with Dataset(files[1], 'a') as nc:
+        nc.variables['streamflow'][5] = np.ma.masked
+        expected = nc.variables['streamflow'][:]
+
+    date, q, _ = nwm._read_q_from_file(files[1], None)
+    assert np.isnan(q[[3, 5]]).all()
+    ok = ~expected.mask
+    assert np.array_equal(q[ok], expected[ok])
+
+    raw = nwm._read_q_from_file(files[1], None, raw=True)[1]
+    packing = nwm.read_streamflow_packing(files[1])
+    assert np.array_equal(nwm._missing(raw, packing), expected.mask)
+
+    q, _, _, max_q = nwm.build_streamflow_cube(files, [101, 42, 7])
+    assert np.isnan(q[:, 2]).all() and np.isnan(max_q[2])
+    assert np.isnan(q[1, 1]) and np.isfinite(np.delete(q[:, 1], 1)).all()
+    assert max_q[1] == np.delete(q[:, 1], 1).max()
+
+    out_file = str(tmpdir.join('combined.nc'))
+    nwm.combine_files(files, out_file, [101, 42, 7])
+    with Dataset(out_file) as nc:
+        assert_array_equal(nc.variables['streamflow'][:],
+                           q.astype(np.float32))
+
+
+def test_read_layout_comids(forecast_files):
+    comids = np.array([42, 7], np.int32)
+    assert nwm._read_layout(forecast_files, comids)[0] is comids
+    for given in ([42, 7], ['42', '7'], (42, 7)):
+        layout = nwm._read_layout(forecast_files, given)
+        assert isinstance(layout[0], np.ndarray)
+        assert_array_equal(layout[0], [42, 7])
+        assert layout[1] == 2
+    comids, num_rivers = nwm._read_layout(forecast_files, None)[:2]
+    with Dataset(forecast_files[0]) as nc:
+        assert_array_equal(comids, nc.variables['station_id'][:])
+    assert num_rivers == 10
@@ -0,0 +1,83 @@
+import itertools
+import json
+import os
+import shutil
+
+from netCDF4 import Dataset
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from pynwm import poll
+
+SHORT_RANGE = 'nwm.t{0:02d}z.short_range.channel_rt.f{1:03d}.conus.nc.gz'
+
+
+def test_marks_round_trip(hydroshare, tmpdir):
+    state_file = str(tmpdir.join('state.json'))
+    poller = poll.Poller(['analysis_assim'], state_file, source='hydroshare')
+    cycles = poller.new_cycles()
+    assert len(cycles) == 642
+    assert [c['key'] for c in cycles] == sorted(c['key'] for c in cycles)
+    assert cycles[-1]['key'] == '2016062118'
+    assert cycles[-1]['files'] == [
+        'analysis_assim-nwm.20160621.t18z.analysis_assim.channel_rt.tm00.'
+        'conus.nc_georeferenced.nc']
+    assert not os.path.exists(state_file)
+
+    poller.mark(cycles[-2])
+    poller.mark(cycles[-3])
+    with open(state_file) as f:
+        assert json.load(f) == {'analysis_assim': '2016062117'}
+
+    reloaded = poll.Poller(['analysis_assim'], state_file,
+                           source='hydroshare')
+    assert reloaded.marks == {'analysis_assim': '2016062117'}
+    assert [c['key'] for c in reloaded.new_cycles()] == ['2016062118']
+    reloaded.mark(cycles[-1])
+    assert poll.Poller(['analysis_assim'], state_file,
+                       source='hydroshare').new_cycles() == []
+
+
+def test_watch_yields_only_new_cycles(noaa_ftp, tmpdir):
+    poller = poll.Poller(['short_range'], str(tmpdir.join('state.json')),
+                         workers=2)
+    cycles = poller.watch(interval=0, max_polls=3)
+    first = list(itertools.islice(cycles, 24 + 13))
+    assert first[0]['key'] == '2016092700'
+    assert first[-1]['key'] == '2016092812'
+    assert all(len(c['files']) == 15 for c in first)
+
+    # Cycle 13 arrives one file at a time; only the complete cycle is new.
+    folder = noaa_ftp.join('nwm.20160928', 'short_range')
+    for hour in range(1, 16):
+        folder.ensure(SHORT_RANGE.format(13, hour))
+    rest = list(cycles)
+    assert [c['key'] for c in rest] == ['2016092813']
+    assert rest[0]['files'][-1].endswith(SHORT_RANGE.format(13, 15))
+    assert poller.marks == {'short_range': '2016092813'}
+
+
+def test_combine_new_cycles(noaa_ftp, make_files, tmpdir):
+    folder = noaa_ftp.join('nwm.20160928', 'short_range')
+    for hour, nc_file in enumerate(make_files(count=15, gz=True), 1):
+        shutil.copy(nc_file, str(folder.join(SHORT_RANGE.format(12, hour))))
+    state_file = str(tmpdir.join('state.json'))
+    with open(state_file, 'w') as f:
+        json.dump({'short_range': '2016092811'}, f)
+    poller = poll.Poller('short_range', state_file)
+    download_folder = str(tmpdir.join('downloads'))
+    output_folder = str(tmpdir.join('combined'))
+
+    output_files = poll.combine_new_cycles(poller, download_folder,
+                                           output_folder, comids=[42, 7],
+                                           workers=3)
+    assert output_files == [os.path.join(output_folder,
+                                         'short_range.2016092812.nc')]
+    with Dataset(output_files[0]) as nc:
+        assert_array_equal(nc.variables['station_id'][:], [42, 7])
+        q = nc.variables['streamflow'][:]
+    assert q.shape == (15, 2) and np.isfinite(q).all()
+    assert os.listdir(download_folder) == []
+    assert poller.marks == {'short_range': '2016092812'}
+    assert poll.combine_new_cycles(poll.Poller('short_range', state_file),
+                                   download_folder, output_folder) == []
@@ -0,0 +1,140 @@
+from datetime import datetime, timedelta
+import gzip
+import os
+import shutil
+
+from netCDF4 import Dataset
+import numpy as np
+import pytest
+import pytz
+
+from pynwm import scan
+
+FORMATS = ['NETCDF3_CLASSIC', 'NETCDF3_64BIT_OFFSET', 'NETCDF3_64BIT_DATA',
+           'NETCDF4']
+FIRST_VALID_TIME = datetime(2016, 6, 21, 1, tzinfo=pytz.utc)
+
+
+def _write_file(filename, file_format, valid_time, station_count, gz):
+    """Writes a channel file in a netCDF format and returns its filename."""
+
+    with Dataset(filename, 'w', format=file_format) as nc:
+        nc.model_output_valid_time = valid_time.strftime('%Y-%m-%d_%H:%M:%S')
+        nc.model_initialization_time = '2016-06-21_00:00:00'
+        nc.proj4 = '+proj=longlat +datum=NAD83 +no_defs'
+        nc.dev_OVRTSWCRT = np.int32(1)
+        nc.dev_NOAH_TIMESTEP = np.int16(3600)
+        nc.scale = np.array([0.5, 0.25])
+        nc.createDimension('time', None)
+        nc.createDimension('station', station_count)
+        nc.createVariable('time', 'i', ('time',))[:] = [0]
+        var = nc.createVariable('streamflow', 'f4', ('time', 'station'))
+        var.units = 'meter^3 / sec'
+        var[0] = np.arange(station_count)
+    if not gz:
+        return filename
+    with open(filename, 'rb') as f, gzip.open(filename + '.gz', 'wb') as g:
+        shutil.copyfileobj(f, g)
+    os.remove(filename)
+    return filename + '.gz'
+
+
+@pytest.fixture
+def scan_fixture_files(tmpdir):
+    """Returns files in every format, plain and gzipped, newest first.
+
+    Neither the filenames nor the folder include the date, so valid times are
+    read from the headers.
+    """
+
+    files = []
+    for i, (file_format, gz) in enumerate(
+            [(f, gz) for f in FORMATS for gz in (False, True)]):
+        filename = str(tmpdir.join(
+            'nwm.t00z.short_range.channel_rt.f{0:03d}.conus.nc'.format(
+                i + 1)))
+        files.append(_write_file(filename, file_format,
+                                 FIRST_VALID_TIME + timedelta(hours=i),
+                                 3 + i, gz))
+    return files[::-1]
+
+
+def _read_with_netcdf4(nc_file, tmpdir):
+    if nc_file.endswith('.gz'):
+        path = str(tmpdir.join('unzipped.nc'))
+        with gzip.open(nc_file, 'rb') as g, open(path, 'wb') as f:
+            shutil.copyfileobj(g, f)
+    else:
+        path = nc_file
+    with Dataset(path) as nc:
+        return (nc.data_model,
+                dict((name, len(dim)) for name, dim
+                     in nc.dimensions.iteritems()),
+                dict((name, nc.getncattr(name)) for name in nc.ncattrs()))
+
+
+def test_read_classic_header(scan_fixture_files, tmpdir):
+    for nc_file in scan_fixture_files:
+        data_model, dimensions, attributes = _read_with_netcdf4(nc_file,
+                                                                tmpdir)
+        opener = gzip.open if nc_file.endswith('.gz') else open
+        with opener(nc_file, 'rb') as f:
+            header = scan._read_classic_header(f)
+        if data_model == 'NETCDF4':
+            assert header is None
+            continue
+        header_dimensions, header_attributes = header
+        assert header_dimensions.pop('time') is None
+        assert header_dimensions == dict((name, length) for name, length
+                                         in dimensions.iteritems()
+                                         if name != 'time')
+        assert sorted(header_attributes) == sorted(attributes)
+        for name, value in attributes.iteritems():
+            assert np.array_equal(header_attributes[name], value)
+
+
+def test_scan_and_select_files(scan_fixture_files, tmpdir):
+    expected = {}
+    for nc_file in scan_fixture_files:
+        with_netcdf4 = _read_with_netcdf4(nc_file, tmpdir)
+        expected[nc_file] = (with_netcdf4[2]['model_output_valid_time'],
+                             with_netcdf4[1]['station'])
+
+    for workers in (None, 3):
+        records = scan.scan_files(scan_fixture_files, station_count=True,
+                                  workers=workers)
+        assert [r['filename'] for r in records] == scan_fixture_files
+        for record in records:
+            valid_time, station_count = expected[record['filename']]
+            assert record['valid_time'] == datetime.strptime(
+                valid_time, '%Y-%m-%d_%H:%M:%S').replace(tzinfo=pytz.utc)
+            assert record['station_count'] == station_count
+            assert record['product'] == 'short_range'
+            assert record['date'] is None
+
+    records = scan.scan_files(scan_fixture_files)
+    selected = scan.select_files(records, '2016-06-21 03:00',
+                                 datetime(2016, 6, 21, 7),
+                                 product='short_range')
+    assert [r['filename'] for r in selected] == scan_fixture_files[::-1][2:6]
+    assert scan.select_files(records, product='analysis_assim') == []
+
+
+def test_scan_file_name_without_header(tmpdir):
+    folder = tmpdir.mkdir('nwm.20160928').mkdir('short_range')
+    nc_file = folder.join('nwm.t06z.short_range.channel_rt.f003.conus.nc.gz')
+    nc_file.write('not read')
+    record = scan.scan_file(str(nc_file))
+    assert record['valid_time'] == datetime(2016, 9, 28, 9, tzinfo=pytz.utc)
+    assert record['station_count'] is None
+
+
+def test_read_header_truncated(tmpdir):
+    nc_file = _write_file(str(tmpdir.join('channel.nc')), 'NETCDF3_CLASSIC',
+                          FIRST_VALID_TIME, 3, False)
+    with open(nc_file, 'rb') as f:
+        data = f.read()
+    with open(nc_file, 'wb') as f:
+        f.write(data[:40])
+    with pytest.raises(ValueError):
+        scan.read_header(nc_file)
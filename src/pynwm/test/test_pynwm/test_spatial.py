@@ -0,0 +1,109 @@
+import os
+
+from netCDF4 import Dataset
+import numpy as np
+from numpy.testing import assert_array_equal
+
+from pynwm import spatial
+
+
+def _rivers(count=500, seed=0):
+    """Returns COMIDs, latitudes and longitudes of random rivers.
+
+    Two rivers have no latitude.
+    """
+
+    rs = np.random.RandomState(seed)
+    comids = rs.permutation(np.arange(1000, 1000 + count))
+    lats = rs.uniform(29.0, 32.0, count)
+    lons = rs.uniform(-99.0, -96.0, count)
+    lats[[3, 50]] = np.nan
+    return comids, lats, lons
+
+
+def _distances(lon, lat, lons, lats):
+    """Returns great circle distances in km, computed one river at a time."""
+
+    distances = []
+    for river_lon, river_lat in zip(lons, lats):
+        phi1, phi2 = np.radians(lat), np.radians(river_lat)
+        cos_angle = (np.sin(phi1) * np.sin(phi2) + np.cos(phi1) *
+                     np.cos(phi2) * np.cos(np.radians(river_lon - lon)))
+        distances.append(6371.0088 * np.arccos(np.clip(cos_angle, -1, 1)))
+    return np.array(distances)
+
+
+def _write_georeferenced(filename, comids, lats, lons):
+    with Dataset(filename, 'w') as nc:
+        nc.createDimension('station', len(comids))
+        nc.createVariable('station_id', 'i', ('station',))[:] = comids
+        for name, values in (('latitude', lats), ('longitude', lons)):
+            var = nc.createVariable(name, 'f8', ('station',),
+                                    fill_value=-9999.0)
+            var[:] = np.ma.masked_invalid(values)
+
+
+def test_bbox_matches_brute_force():
+    comids, lats, lons = _rivers()
+    for cell_size in (0.1, 0.25, 5):
+        index = spatial.SpatialIndex(comids, lats, lons, cell_size)
+        for box in [(-98.0, 30.0, -97.5, 30.4), (-100, 28, -95, 33),
+                    (-97.03, 29.5, -96.97, 31.9), (-90, 30, -89, 31),
+                    (-98.5, 31.9, -98.2, 35)]:
+            min_lon, min_lat, max_lon, max_lat = box
+            with np.errstate(invalid='ignore'):
+                inside = ((lats >= min_lat) & (lats <= max_lat) &
+                          (lons >= min_lon) & (lons <= max_lon))
+            assert_array_equal(index.bbox(*box), comids[inside])
+        assert len(index.bbox(-100, 28, -95, 33)) == len(comids) - 2
+
+
+def test_radius_matches_brute_force():
+    comids, lats, lons = _rivers()
+    index = spatial.SpatialIndex(comids, lats, lons, 0.2)
+    for lon, lat, km in [(-97.68, 30.51, 25), (-99.0, 29.0, 60),
+                         (-96.2, 31.7, 5), (-97.5, 30.5, 400),
+                         (-90.0, 30.0, 100)]:
+        with np.errstate(invalid='ignore'):
+            inside = _distances(lon, lat, lons, lats) <= km
+        assert_array_equal(index.radius(lon, lat, km), comids[inside])
+
+
+def test_polygon_rectangle_matches_bbox():
+    comids, lats, lons = _rivers()
+    index = spatial.SpatialIndex(comids, lats, lons)
+    box = (-98.3, 29.6, -97.1, 30.9)
+    polygon = [(-98.3, 29.6), (-97.1, 29.6), (-97.1, 30.9), (-98.3, 30.9)]
+    assert_array_equal(index.polygon(polygon), index.bbox(*box))
+
+
+def test_cache_file_round_trip(tmpdir, monkeypatch):
+    comids, lats, lons = _rivers(200)
+    nc_file = str(tmpdir.join('georeferenced.nc'))
+    _write_georeferenced(nc_file, comids, lats, lons)
+    cache_dir = str(tmpdir.join('cache'))
+
+    index = spatial.SpatialIndex.from_file(nc_file, 0.3, cache_dir)
+    cached = os.listdir(cache_dir)
+    assert len(cached) == 1 and cached[0].endswith('.npz')
+
+    def rebuild(*args):
+        raise AssertionError('Index rebuilt instead of loaded')
+    with monkeypatch.context() as m:
+        m.setattr(spatial.SpatialIndex, '__init__', rebuild)
+        loaded = spatial.SpatialIndex.from_file(nc_file, 0.3, cache_dir)
+    assert loaded.cell_size == 0.3
+    assert_array_equal(loaded.comids, comids)
+    for box in [(-98.0, 30.0, -97.5, 30.4), (-100, 28, -95, 33)]:
+        assert_array_equal(loaded.bbox(*box), index.bbox(*box))
+    assert_array_equal(loaded.radius(-97.68, 30.51, 50),
+                       index.radius(-97.68, 30.51, 50))
+
+    # Moved rivers and another cell size each get their own file.
+    lons[0] += 0.5
+    _write_georeferenced(nc_file, comids, lats, lons)
+    moved = spatial.SpatialIndex.from_file(nc_file, 0.3, cache_dir)
+    spatial.SpatialIndex.from_file(nc_file, 0.5, cache_dir)
+    assert len(os.listdir(cache_dir)) == 3
+    assert_array_equal(moved.bbox(lons[0], lats[0], lons[0], lats[0]),
+                       comids[:1])
@@ -0,0 +1,86 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+from numpy.testing import assert_allclose, assert_array_equal
+
+from pynwm import nwm
+from pynwm import verify
+
+
+def _hours(*hours):
+    return [datetime(2016, 6, 21) + timedelta(hours=h) for h in hours]
+
+
+def test_add_cycle_statistics():
+    analysis_q = np.array([[10, 5], [20, 5], [30, 5], [40, 5], [50, 5],
+                           [60, 5]], np.float32)
+    verification = verify.Verification(_hours(*range(6)), analysis_q, [1, 2])
+    verification.add_cycle(_hours(0)[0], _hours(1, 2, 3),
+                           np.array([[12, 5], [18, 6], [33, 7]]))
+    # Columns in a different order, with a missing forecast value.
+    verification.add_cycle(_hours(1)[0], _hours(2, 3, 4),
+                           np.array([[5, 25], [5, 55], [np.nan, 50]]),
+                           comids=[2, 1])
+    result = verification.result()
+
+    assert result['cycles'] == 2
+    assert_array_equal(result['leads'], [1, 2, 3])
+    assert_array_equal(result['count'], [[2, 2], [2, 2], [2, 1]])
+    # River 1 errors by lead: (-8, -5), (-12, 15), (-7, 0).
+    assert_allclose(result['bias'][:, 0], [-6.5, 1.5, -3.5])
+    assert_allclose(result['rmse'][:, 0],
+                    np.sqrt([89 / 2.0, 369 / 2.0, 49 / 2.0]))
+    # Analysis values of each lead vary by 50 around their mean.
+    assert_allclose(result['nse'][:, 0],
+                    [1 - 89 / 50.0, 1 - 369 / 50.0, 1 - 49 / 50.0])
+    assert_allclose(result['bias'][:, 1], [0, 0.5, 2])
+    assert np.isnan(result['nse'][:, 1]).all()
+
+    # River 1 peaks an hour early in the second cycle. River 2's analysis
+    # is flat, so its first time counts as the peak.
+    assert_array_equal(result['peak_count'], [2, 2])
+    assert_allclose(result['peak_timing_error'], [-0.5, 1])
+    assert_allclose(result['peak_timing_mae'], [0.5, 1])
+
+
+def test_add_cycle_without_matching_times():
+    verification = verify.Verification(_hours(0, 1), np.ones((2, 1)), [1])
+    verification.add_cycle(_hours(5)[0], _hours(6, 7), np.ones((2, 1)))
+    result = verification.result()
+    assert result['cycles'] == 1
+    assert len(result['leads']) == 0
+    assert_array_equal(result['peak_count'], [0])
+
+
+def test_group_cycles():
+    name = ('nwm.2016062{0}/{1}/nwm.t{2:02d}z.{1}.channel_rt.f{3:03d}'
+            '.conus.nc')
+    files = [name.format(1, 'short_range', 1, 2),
+             name.format(1, 'short_range', 0, 2),
+             name.format(1, 'medium_range', 0, 3),
+             name.format(1, 'short_range', 1, 1),
+             name.format(0, 'short_range', 1, 1),
+             name.format(1, 'short_range', 0, 1)]
+    cycles = verify.group_cycles(files, workers=2)
+    assert cycles == [[files[2]],
+                      [files[4]],
+                      [files[5], files[1]],
+                      [files[3], files[0]]]
+
+
+def test_verify_files_ignores_missing_values(make_files):
+    files = make_files(count=4, gz=True, masked=[3])
+    comids = [5671187, 7, 42]
+    q, t, first_date, _ = nwm.build_streamflow_cube(files, comids)
+    times = [first_date + timedelta(seconds=int(s)) for s in t]
+    analysis = np.nan_to_num(q) - 1.5
+    result = verify.verify_files(files[::-1], times, analysis, comids,
+                                 workers=2)
+    assert result['cycles'] == 1
+    assert_array_equal(result['leads'], [1, 2, 3, 4])
+    assert_array_equal(result['count'][:, 1], [0, 0, 0, 0])
+    assert np.isnan(result['bias'][:, 1]).all()
+    assert_allclose(result['bias'][:, [0, 2]], 1.5, rtol=1e-5)
+    assert_allclose(result['rmse'][:, [0, 2]], 1.5, rtol=1e-5)
+    assert_array_equal(result['peak_count'], [1, 0, 1])
+    assert_array_equal(result['peak_timing_error'][[0, 2]], [0, 0])
@@ -0,0 +1,322 @@
+#!/usr/bin/python2
+"""Scores forecasts against the analysis of the times they forecast.
+
+Each forecast cycle is matched to analysis values on valid time and COMID,
+and errors are totaled by lead time (hours after the cycle) for every river:
+bias, root mean square error and Nash-Sutcliffe efficiency. The time of each
+cycle's forecast peak is also compared with the time of the analysis peak
+over the same hours.
+
+Cycles are added one at a time and only running totals sized by (number of
+lead times, number of rivers) are kept, so verifying a month of cycles uses
+no more memory than verifying one.
+
+The analysis is a table of values by valid time and COMID, such as the result
+of extract.extract_table or basin.BasinStore.read, whose memory-mapped values
+are only read for the times forecast.
+
+Example:
+    >>> from pynwm import extract, verify
+    >>> analysis = extract.extract_table(analysis_files, comids)
+    >>> result = verify.verify_files(short_range_files, analysis['dates'],
+                                     analysis['values'], analysis['comids'])
+    >>> result['leads']  # hours
+    >>> result['rmse'][0]  # error of the first lead time for each river
+"""
+
+import numpy as np
+
+from pynwm import comid_index
+from pynwm import extract
+from pynwm import ncfiles
+from pynwm import nwm
+from pynwm import scan
+
+# Running totals kept for each lead time.
+_count, _sum_error, _sum_squared_error, _sum_obs, _sum_squared_obs = range(5)
+
+
+def _to_datetime64(dates):
+    """Returns datetimes or datetime64 values as a datetime64[s] array."""
+
+    dates = np.asarray(dates)
+    if np.issubdtype(dates.dtype, np.datetime64):
+        return dates.astype('datetime64[s]')
+    return np.array([extract._to_datetime64(d) for d in dates.ravel()],
+                    'datetime64[s]').reshape(dates.shape)
+
+
+def _columns(from_comids, comids):
+    """Returns positions of comids within from_comids.
+
+    Raises:
+        ValueError: A COMID is not in from_comids.
+    """
+
+    index = comid_index.ComidIndex(from_comids)
+    comids = np.asarray(comids)
+    found = np.searchsorted(index.sorted_comids, comids)
+    found = np.minimum(found, len(from_comids) - 1)
+    columns = index.sorted_index[found]
+    missing = np.ma.getdata(from_comids)[columns] != comids
+    if missing.any():
+        raise ValueError('COMIDs not found: {0}'.format(
+            ', '.join(str(c) for c in comids[missing])))
+    return columns
+
+
+class Verification(object):
+    """Running forecast error totals by lead time and river.
+
+    Attributes:
+        comids: Numpy array of COMIDs of the rivers verified, in the order of
+            the result arrays.
+        cycles: Number of cycles added.
+    """
+
+    def __init__(self, analysis_times, analysis_q, analysis_comids,
+                 comids=None):
+        """Sets the analysis that forecasts are compared with.
+
+        Args:
+            analysis_times: Valid times of the rows of analysis_q, as
+                datetimes or numpy datetime64 values in UTC.
+            analysis_q: Array of analysis streamflow sized by (number of
+                times, number of rivers). NaN values are ignored.
+            analysis_comids: COMIDs of the columns of analysis_q.
+            comids: (Optional) COMIDs of the rivers to verify. If None, all
+                rivers of the analysis are verified.
+
+        Raises:
+            ValueError: A COMID is not in the analysis.
+        """
+
+        times = _to_datetime64(analysis_times)
+        order = np.argsort(times, kind='mergesort')
+        if np.any(order != np.arange(len(order))):
+            times = times[order]
+        else:
+            order = None
+        self._times = times
+        self._order = order
+        self._q = analysis_q
+        analysis_comids = np.ma.getdata(np.asarray(analysis_comids))
+        if comids is None:
+            self.comids = analysis_comids
+            self._columns = np.arange(len(analysis_comids))
+        else:
+            self.comids = np.ma.getdata(np.asarray(comids))
+            self._columns = _columns(analysis_comids, self.comids)
+        self.cycles = 0
+        self._totals = {}
+        num_rivers = len(self.comids)
+        self._peak_count = np.zeros(num_rivers, np.int64)
+        self._peak_error = np.zeros(num_rivers, np.float64)
+        self._peak_abs_error = np.zeros(num_rivers, np.float64)
+
+    def add_cycle(self, init_time, valid_times, q, comids=None):
+        """Adds the forecast of one cycle.
+
+        Args:
+            init_time: Time the cycle was run (its date and cycle hour), as a
+                datetime or numpy datetime64 value in UTC.
+            valid_times: Valid time of each row of q.
+            q: Forecast streamflow array sized by (number of times, number of
+                rivers), e.g., from nwm.build_streamflow_cube. NaN values are
+                ignored.
+            comids: (Optional) COMIDs of the columns of q. If None, columns
+                are in the order of comids.
+
+        Raises:
+            ValueError: A COMID is not in the forecast.
+        """
+
+        init_time = _to_datetime64([init_time])[0]
+        valid_times = _to_datetime64(valid_times)
+        q = np.asarray(q)
+        if comids is not None:
+            q = q[:, _columns(comids, self.comids)]
+        self.cycles += 1
+        if not len(self._times) or not len(valid_times):
+            return
+
+        # Keep the forecast times that have an analysis.
+        positions = np.minimum(np.searchsorted(self._times, valid_times),
+                               len(self._times) - 1)
+        matched = self._times[positions] == valid_times
+        if not matched.any():
+            return
+        valid_times = valid_times[matched]
+        rows = positions[matched]
+        if self._order is not None:
+            rows = self._order[rows]
+        forecast = np.asarray(q[matched], np.float64)
+        obs = np.asarray(self._q[np.ix_(rows, self._columns)], np.float64)
+
+        ok = np.isfinite(forecast) & np.isfinite(obs)
+        error = np.where(ok, forecast - obs, 0.0)
+        obs_ok = np.where(ok, obs, 0.0)
+        leads = (valid_times - init_time).astype(np.int64)
+        for i, lead in enumerate(leads):
+            totals = self._totals.get(lead)
+            if totals is None:
+                totals = np.zeros((5, len(self.comids)), np.float64)
+                self._totals[lead] = totals
+            totals[_count] += ok[i]
+            totals[_sum_error] += error[i]
+            totals[_sum_squared_error] += error[i] ** 2
+            totals[_sum_obs] += obs_ok[i]
+            totals[_sum_squared_obs] += obs_ok[i] ** 2
+
+        # Compare the hour of each river's forecast and analysis peaks.
+        hours = (valid_times - valid_times[0]).astype(np.int64) / 3600.0
+        forecast_peak = np.where(ok, forecast, -np.inf).argmax(axis=0)
+        obs_peak = np.where(ok, obs, -np.inf).argmax(axis=0)
+        has_peak = ok.any(axis=0)
+        peak_error = np.where(has_peak,
+                              hours[forecast_peak] - hours[obs_peak], 0.0)
+        self._peak_count += has_peak
+        self._peak_error += peak_error
+        self._peak_abs_error += np.abs(peak_error)
+
+    def add_files(self, nc_files, consistent_comid_order=True, workers=None):
+        """Adds the forecast of one cycle from its model files.
+
+        Args:
+            nc_files: List of netCDF filenames of one cycle, e.g., a list
+                returned by group_cycles. Files can have .nc or .gz extension.
+            consistent_comid_order: (Optional) True if the order of COMIDs in
+                all files is the same; False otherwise.
+            workers: (Optional) Number of processes used to unzip and read
+                files in parallel. If None or 1, files are read one at a time.
+
+        Missing values in the files are read as NaN, so they are ignored.
+
+        Raises:
+            ValueError: A filename does not describe a channel file.
+        """
+
+        nc_files = list(nc_files)
+        if not nc_files:
+            return
+        parsed = ncfiles.parse_filename(nc_files[0])
+        if parsed is None:
+            raise ValueError('Not a channel file: {0}'.format(nc_files[0]))
+        valid_times = np.empty(len(nc_files), 'datetime64[s]')
+        q = np.empty((len(nc_files), len(self.comids)), np.float32)
+        q_iter = nwm._iter_q_from_files(nc_files, self.comids,
+                                        consistent_comid_order, workers)
+        for i, (date, values) in enumerate(q_iter):
+            valid_times[i] = extract._to_datetime64(date)
+            q[i] = values
+        init_time = (valid_times[0] -
+                     np.timedelta64(parsed['forecast_hour'], 'h'))
+        self.add_cycle(init_time, valid_times, q)
+
+    def result(self):
+        """Returns error statistics of the cycles added so far.
+
+        Statistics are NaN where a river has no forecast and analysis values
+        to compare, and NSE is also NaN where the analysis does not vary.
+
+        Returns:
+            Dict with comids (the result columns), cycles (number of cycles),
+            leads (lead times in hours, sorted), count (int array of the
+            number of forecast values compared), bias (mean of forecast minus
+            analysis), rmse (root mean square error) and nse (Nash-Sutcliffe
+            efficiency), each sized by (number of lead times, number of
+            rivers), and peak_count (number of cycles with a peak compared),
+            peak_timing_error (mean hours from the analysis peak to the
+            forecast peak, negative if the forecast peaks early) and
+            peak_timing_mae (mean absolute peak timing error in hours), each
+            sized by number of rivers.
+        """
+
+        leads = sorted(self._totals)
+        num_rivers = len(self.comids)
+        if leads:
+            totals = np.array([self._totals[lead] for lead in leads])
+        else:
+            totals = np.zeros((0, 5, num_rivers), np.float64)
+        count = totals[:, _count]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            bias = totals[:, _sum_error] / count
+            rmse = np.sqrt(totals[:, _sum_squared_error] / count)
+            obs_variation = (totals[:, _sum_squared_obs] -
+                             totals[:, _sum_obs] ** 2 / count)
+            nse = 1 - totals[:, _sum_squared_error] / obs_variation
+            nse[~(obs_variation > 0)] = np.nan
+            peak_timing_error = self._peak_error / self._peak_count
+            peak_timing_mae = self._peak_abs_error / self._peak_count
+        return {'comids': self.comids,
+                'cycles': self.cycles,
+                'leads': np.array(leads, np.int64) / 3600.0,
+                'count': count.astype(np.int32),
+                'bias': bias,
+                'rmse': rmse,
+                'nse': nse,
+                'peak_count': self._peak_count.astype(np.int32),
+                'peak_timing_error': peak_timing_error,
+                'peak_timing_mae': peak_timing_mae}
+
+
+def group_cycles(nc_files, workers=None):
+    """Groups forecast files into cycles.
+
+    Files are grouped by product, the time the cycle was run and long range
+    member, using scan.scan_files, so files are only opened if their
+    filenames do not include the forecast date.
+
+    Args:
+        nc_files: List of forecast filenames, optionally including folders.
+        workers: (Optional) Number of threads reading headers at once.
+
+    Returns:
+        List of cycles sorted by product, time run and member, each a list of
+        filenames sorted by forecast hour.
+
+    Raises:
+        ValueError: A filename does not describe a channel file, or its valid
+            time cannot be found.
+    """
+
+    cycles = {}
+    for record in scan.scan_files(nc_files, workers=workers):
+        if record['product'] is None or record['valid_time'] is None:
+            raise ValueError('Not a channel file: {0}'.format(
+                record['filename']))
+        init_time = (_to_datetime64([record['valid_time']])[0] -
+                     np.timedelta64(record['forecast_hour'], 'h'))
+        key = (record['product'], init_time, record['member'])
+        cycles.setdefault(key, []).append(
+            (record['forecast_hour'], record['filename']))
+    return [[f for _, f in sorted(cycles[key])] for key in sorted(cycles)]
+
+
+def verify_files(forecast_files, analysis_times, analysis_q, analysis_comids,
+                 comids=None, consistent_comid_order=True, workers=None):
+    """Scores forecast files against an analysis, one cycle at a time.
+
+    Args:
+        forecast_files: List of forecast filenames from any number of cycles
+            of one product, e.g., short_range.
+        analysis_times: Valid times of the rows of analysis_q.
+        analysis_q: Array of analysis streamflow sized by (number of times,
+            number of rivers).
+        analysis_comids: COMIDs of the columns of analysis_q.
+        comids: (Optional) COMIDs of the rivers to verify. If None, all
+            rivers of the analysis are verified.
+        consistent_comid_order: (Optional) True if the order of COMIDs in all
+            forecast files is the same; False otherwise.
+        workers: (Optional) Number of processes used to read files, and of
+            threads reading headers when grouping them into cycles.
+
+    Returns:
+        Dict of statistics as returned by Verification.result.
+    """
+
+    verification = Verification(analysis_times, analysis_q, analysis_comids,
+                                comids)
+    for cycle_files in group_cycles(forecast_files, workers):
+        verification.add_files(cycle_files, consistent_comid_order, workers)
+    return verification.result()